@@ -43,11 +43,47 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',   
     ],
+    'DEFAULT_PAGINATION_CLASS': 'library.pagination.KeysetPagination',
+    'DEFAULT_FILTER_BACKENDS': ['library.filters.SerializerFilterBackend', 'library.fieldsets.SparseFieldsFilterBackend'],
+    'PAGE_SIZE': 50,
 }
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+EXPORT_JOB_WORKERS = 2
+EXPORT_JOB_TTL = 24 * 60 * 60
+
+STATS_CACHE_TIMEOUT = 300
+
+SERVER_TIMING = True
+# one JSON line per request on the library.timing logger
+SERVER_TIMING_LOG = False
+
+# covers and photos get a thumbnail of at most this size, in WebP (JPEG where Pillow lacks it)
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_FORMAT = 'WEBP'
+
+# list pages rendered from values() rows, same output as the serializers; opt in once
+# `benchmark lists` shows a gain for the deployment
+FAST_LISTS = False
+
+# every worker process keeps its metrics in a file here, /api/metrics adds them up
+METRICS_DIR = BASE_DIR / 'metrics'
+# addresses that may scrape /api/metrics without logging in, staff users always can
+METRICS_ALLOWED_IPS = []
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'library.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 
 # Application definition
 
@@ -66,6 +102,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'library.timing.ServerTimingMiddleware',
+    'library.metrics.MetricsMiddleware',
+    'library.versions.TableVersionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -97,6 +136,17 @@ TEMPLATES = [
 WSGI_APPLICATION = 'app.wsgi.application'
 
 
+# Cached stats entries and their :lock stampede guard live here, the generation that
+# invalidates them is read from TableVersion. LocMemCache is per process, so every worker
+# computes its own copy; to share the entries between workers use a shared backend, e.g.
+# {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -21,7 +21,7 @@ from django.conf.urls.static import static
 
 from rest_framework.routers import DefaultRouter
 
-from library.api import LibraryViewSet, BookViewSet, GenreViewSet, LoanViewSet, MemberViewSet, LibraryMemberViewSet
+from library.api import LibraryViewSet, BookViewSet, GenreViewSet, LoanViewSet, MemberViewSet, LibraryMemberViewSet, ExportJobViewSet, StatsCacheView
 from library.views import UserProfileViewSet
 
 from library import views
@@ -34,10 +34,13 @@ router.register("members", MemberViewSet, basename="member")
 router.register("loans", LoanViewSet, basename="loan")
 router.register("userprofile", UserProfileViewSet, basename="userprofile")
 router.register("library-members", LibraryMemberViewSet, basename="library-member")
+router.register("export-jobs", ExportJobViewSet, basename="export-job")
 
 urlpatterns = [
     path('', views.ShowLibraryView.as_view()),
     path('admin/', admin.site.urls),
+    path('api/stats-cache/', StatsCacheView.as_view()),
+    path('api/metrics', views.metrics_view),
     path('api/', include(router.urls)),
     path('api/', include('rest_framework.urls'))
 ]
@@ -1,4 +1,5 @@
 import { ref } from 'vue';
+import axios from 'axios';
 
 export function showNotification(notification, msg, type = "success", duration = 2000) {
   if (notification._timeoutId) {
@@ -35,6 +36,21 @@ export async function fetchData(url) {
   return response.data;
 }
 
+export async function fetchPage(url, params = {}) {
+  const response = await axios.get(url, { params });
+  return response.data;
+}
+
+export async function fetchAll(url, params = {}) {
+  let page = await fetchPage(url, { page_size: 1000, ...params });
+  const results = [...page.results];
+  while (page.next) {
+    page = await fetchPage(page.next);
+    results.push(...page.results);
+  }
+  return results;
+}
+
 export function clearTimeoutAndHideModal(modalInstance) {
   if (modalInstance) {
     modalInstance.hide();
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from library.models import Library, Genre, Book, Member, Loan
+from library.models import Library, Genre, Book, Member, Loan, ExportJob
 
 # Register your models here.
 @admin.register(Library)
@@ -12,7 +12,7 @@ class GenreAdmin(admin.ModelAdmin):
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ["id", "title", "genre", "library"]
+    list_display = ["id", "title", "genre", "library", "is_available"]
 
 @admin.register(Member)
 class MemberAdmin(admin.ModelAdmin):
@@ -27,3 +27,7 @@ class MemberAdmin(admin.ModelAdmin):
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
     list_display = ["id", "book", "member", "loan_date"]
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "name", "file_type", "status", "user", "created_at", "expires_at"]
@@ -1,84 +1,72 @@
+from datetime import date
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count
-from django.http import HttpResponse
-import io
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.views import APIView
+from django.http import FileResponse, Http404
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum
 from django.contrib.auth.models import User
-from openpyxl import Workbook
-from docx import Document
-from library.models import Library, Book, Genre, Member, Loan, UserProfile
-from library.serializers import (LibrarySerializer, BookSerializer, GenreSerializer,MemberSerializer, LoanSerializer, UserSerializer)
-
-
-import io
-from openpyxl import Workbook
-from docx import Document
-from django.http import HttpResponse
-from rest_framework.response import Response
+from library.exports import (EXPORT_TYPES, SUPERUSER, ExportColumn, ExportSpec, available_status, build_export_response,
+                             export_extension, iter_export_rows, yes_no)
+from library.export_jobs import submit_export_job
+from library.stats_cache import cached_stats, stats_cache_info
+from library.autocomplete import AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT, autocomplete_key, book_titles, member_names
+from library.bulk import BookBulkCreateMixin, BulkReturnSerializer, LoanBulkCreateMixin, return_loans
+from library.filters import BookFilterSerializer, LoanFilterSerializer, MemberFilterSerializer
+from library.search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, fts_available, ranked_book_ids
+from library.versions import ConditionalGetMixin
+from library.reference import ReferenceViewMixin, genres, libraries
+from library.fast_lists import FastListMixin
+from library.models import (Library, Book, Genre, Member, Loan, UserProfile, ExportJob, LibraryCirculation, GenreCirculation,
+                            BookCirculation, MemberCirculation)
+from library.serializers import (LibrarySerializer, BookSerializer, GenreSerializer,MemberSerializer, LoanSerializer, UserSerializer,
+                                  ExportJobSerializer)
+
+
+def autocomplete_params(request):
+    try:
+        limit = min(int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT)), MAX_AUTOCOMPLETE_LIMIT)
+        library = request.query_params.get('library')
+        library = int(library) if library else None
+    except ValueError:
+        return None
+    return request.query_params.get('q', ''), max(limit, 0), library
 
 
 class BaseExportMixin:
-    def export_queryset(self, queryset, columns, filename_base):
-        file_type = self.request.query_params.get('type', 'excel')
+    export_spec = None
 
-        if file_type == 'excel':
-            workbook = Workbook()
-            sheet = workbook.active
-            sheet.title = filename_base
-            
-            sheet.append(columns)
-            
-            for data_row in queryset:
-                row_data = []
-                for col in columns:
-                    value = data_row.get(col, '')
-                    row_data.append(value)
-                sheet.append(row_data)
-
-            excel_file = io.BytesIO()
-            workbook.save(excel_file)
-            excel_file.seek(0)
-
-            file_response = HttpResponse(
-                excel_file,
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            file_response['Content-Disposition'] = f'attachment; filename="{filename_base}.xlsx"'
-            return file_response
-
-        elif file_type == 'word':
-            document = Document()
-            document.add_heading(filename_base, 0)
-
-            for data_row in queryset:
-                row_values = []
-                for col in columns:
-                    value = data_row.get(col, '')
-                    row_values.append(str(value))
-                
-                text_line = ' | '.join(row_values)
-                document.add_paragraph(text_line)
-
-            word_file = io.BytesIO()
-            document.save(word_file)
-            word_file.seek(0)
-
-            file_response = HttpResponse(
-                word_file,
-                content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            )
-            file_response['Content-Disposition'] = f'attachment; filename="{filename_base}.docx"'
-            return file_response
+    def export_queryset(self, queryset=None, file_type=None):
+        file_type = file_type or self.request.query_params.get('type', 'excel')
 
-        else:
+        if file_type not in EXPORT_TYPES:
             return Response({"error": "Unknown file type"}, status=400)
 
+        if queryset is None:
+            queryset = self.filter_queryset(self.get_queryset())
+        queryset, columns, row = self.export_spec.compile(queryset, self.request.user)
+        filename_base = self.export_spec.name
+
+        if self.request.query_params.get('async', '').lower() in ('1', 'true', 'yes'):
+            job = submit_export_job(self.request.user, queryset, columns, filename_base, file_type, row)
+            return Response(ExportJobSerializer(job, context={'request': self.request}).data, status=status.HTTP_202_ACCEPTED)
+
+        rows = iter_export_rows(queryset, row)
+        return build_export_response(rows, columns, filename_base, file_type)
 
-class GenreViewSet(viewsets.ModelViewSet, BaseExportMixin):
+
+class GenreViewSet(ConditionalGetMixin, ReferenceViewMixin, FastListMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = GenreSerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (Genre,)
+    reference_table = genres
+    cursor_ordering = ('name', 'id')
+    export_spec = ExportSpec('Genres', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Name', 'name'),
+        ExportColumn('User', 'user__username', default='', roles=SUPERUSER),
+    ])
 
     def get_queryset(self):
         return Genre.objects.all().order_by('name')
@@ -87,12 +75,12 @@ class GenreViewSet(viewsets.ModelViewSet, BaseExportMixin):
         serializer.save(user=self.request.user)
 
     @action(detail=False, methods=['get'])
+    @cached_stats('genre')
     def stats(self, request):
         queryset = self.get_queryset()
         total = queryset.count()
         
-        top_genre = Genre.objects.annotate(book_count=Count('book')).order_by('-book_count').first()
-        top_name = top_genre.name if top_genre else None
+        top_name = GenreCirculation.objects.order_by('-book_count').values_list('genre__name', flat=True).first()
 
         return Response({
             'count': total,
@@ -101,32 +89,19 @@ class GenreViewSet(viewsets.ModelViewSet, BaseExportMixin):
 
     @action(detail=False, methods=['get'])
     def export(self, request):
-        queryset = self.get_queryset()
-        
-        if request.user.is_superuser:
-            data_list = []
-            for genre in queryset:
-                user_name = genre.user.username if genre.user else ''
-                data_list.append({
-                    'ID': genre.id,
-                    'Name': genre.name,
-                    'User': user_name
-                })
-            columns = ['ID', 'Name', 'User']
-        else:
-            data_list = []
-            for genre in queryset:
-                data_list.append({
-                    'ID': genre.id,
-                    'Name': genre.name
-                })
-            columns = ['ID', 'Name']
-        
-        return self.export_queryset(data_list, columns, 'Genres')
+        return self.export_queryset()
 
-class LibraryViewSet(viewsets.ModelViewSet, BaseExportMixin):
+class LibraryViewSet(ConditionalGetMixin, ReferenceViewMixin, FastListMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = LibrarySerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (Library,)
+    reference_table = libraries
+    cursor_ordering = ('name', 'id')
+    export_spec = ExportSpec('Libraries', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Name', 'name'),
+        ExportColumn('User', 'user__username', default='', roles=SUPERUSER),
+    ])
 
     def get_queryset(self):
         return Library.objects.all().order_by('name')
@@ -147,12 +122,12 @@ class LibraryViewSet(viewsets.ModelViewSet, BaseExportMixin):
         instance.delete()
 
     @action(detail=False, methods=['get'])
+    @cached_stats('library')
     def stats(self, request):
         queryset = self.get_queryset()
         total = queryset.count()
         
-        top_library = Library.objects.annotate(loan_count=Count('book__loan')).order_by('-loan_count').first()
-        top_name = top_library.name if top_library else None
+        top_name = LibraryCirculation.objects.order_by('-loan_count').values_list('library__name', flat=True).first()
 
         return Response({
             'count': total,
@@ -161,43 +136,78 @@ class LibraryViewSet(viewsets.ModelViewSet, BaseExportMixin):
 
     @action(detail=False, methods=['get'])
     def export(self, request):
-        queryset = self.get_queryset()
-        
-        if request.user.is_superuser:
-            data_list = []
-            for library in queryset:
-                user_name = library.user.username if library.user else ''
-                data_list.append({
-                    'ID': library.id,
-                    'Name': library.name,
-                    'User': user_name
-                })
-            columns = ['ID', 'Name', 'User']
-        else:
-            data_list = []
-            for library in queryset:
-                data_list.append({
-                    'ID': library.id,
-                    'Name': library.name
-                })
-            columns = ['ID', 'Name']
-        
-        return self.export_queryset(data_list, columns, 'Libraries')
+        return self.export_queryset()
 
 
-class BookViewSet(viewsets.ModelViewSet, BaseExportMixin):
+class BookViewSet(ConditionalGetMixin, BookBulkCreateMixin, FastListMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = BookSerializer
+    filter_serializer_class = BookFilterSerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (Book, Genre, Library, Loan)
+    export_spec = ExportSpec('Books', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Title', 'title'),
+        ExportColumn('Genre', 'genre__name', default=''),
+        ExportColumn('Library', 'library__name', default=''),
+        ExportColumn('Status', 'is_available', format=available_status),
+    ])
 
     def get_queryset(self):
-        return Book.objects.all()
+        queryset = Book.objects.order_by('id')
+
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = queryset.search(query)
+
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        books = Book.objects.all()
+        if fts_available():
+            ids = ranked_book_ids(query, max(limit, 0))
+            found = books.in_bulk(ids)
+            results = [found[pk] for pk in ids if pk in found]
+        else:
+            results = books.search(query).order_by('id')[:max(limit, 0)]
+
+        serializer = self.get_serializer(results, many=True)
+        return Response({'results': serializer.data})
 
     @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        params = autocomplete_params(request)
+        if params is None:
+            return Response({"error": "limit and library must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        query, limit, library = params
+
+        if request.query_params.get('available', '').lower() not in ('1', 'true', 'yes'):
+            matches = book_titles.lookup(query, limit, library)
+        else:
+            # availability changes with every loan, so it is checked in the database for a few extra candidates
+            candidates = book_titles.lookup(query, limit * 4, library)
+            available = set(Book.objects.filter(pk__in=[pk for pk, _, _ in candidates], is_available=True).values_list('pk', flat=True))
+            matches = [match for match in candidates if match[0] in available][:limit]
+
+        return Response({'results': [{'id': pk, 'title': title, 'library': library_id} for pk, title, library_id in matches]})
+
+    @action(detail=False, methods=['get'])
+    @cached_stats('book')
     def stats(self, request):
-        queryset = self.get_queryset()
-        total = queryset.count()
+        total = LibraryCirculation.objects.aggregate(total=Sum('book_count'))['total'] or 0
 
-        most_borrowed = Loan.objects.values('book__id', 'book__title').annotate(borrow_count=Count('book')).order_by('-borrow_count').first()
+        most_borrowed = (
+            BookCirculation.objects.filter(loan_count__gt=0)
+            .order_by('-loan_count')
+            .values('book__id', 'book__title', borrow_count=F('loan_count'))
+            .first()
+        )
 
         if most_borrowed:
             most_borrowed_book = {
@@ -221,30 +231,23 @@ class BookViewSet(viewsets.ModelViewSet, BaseExportMixin):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        queryset = self.get_queryset()
-        data_list = []
-        
-        for book in queryset:
-            genre_name = book.genre.name if book.genre else ''
-            library_name = book.library.name if book.library else ''
-            status_text = 'Available' if book.is_available else 'Borrowed'
-            
-            data_list.append({
-                'ID': book.id,
-                'Title': book.title,
-                'Genre': genre_name,
-                'Library': library_name,
-                'Status': status_text
-            })
-        
-        columns = ['ID', 'Title', 'Genre', 'Library', 'Status']
-        
-        return self.export_queryset(data_list, columns, 'Books')
+        return self.export_queryset()
     
 
-class LoanViewSet(viewsets.ModelViewSet, BaseExportMixin):
+class LoanViewSet(ConditionalGetMixin, LoanBulkCreateMixin, FastListMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = LoanSerializer
+    filter_serializer_class = LoanFilterSerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (Loan, Book, Member)
+    cursor_ordering = ('-loan_date', '-id')
+    export_spec = ExportSpec('Loans', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Book', 'book__title', default=''),
+        ExportColumn('Member', 'member__first_name', default=''),
+        ExportColumn('User', 'user__username', default=''),
+        ExportColumn('Loan Date', 'loan_date'),
+        ExportColumn('Return Date', 'return_date', default='Not returned'),
+    ])
 
     def get_queryset(self):
         queryset = Loan.objects.select_related('book', 'member', 'user')
@@ -266,8 +269,6 @@ class LoanViewSet(viewsets.ModelViewSet, BaseExportMixin):
         
         loan.return_date = date.today()
         loan.save()
-        
-        self.update_loan_stats()
 
         serializer = self.get_serializer(loan)
         return Response({
@@ -275,28 +276,30 @@ class LoanViewSet(viewsets.ModelViewSet, BaseExportMixin):
             'loan': serializer.data
         })
 
-    def update_loan_stats(self):
-        top_reader = Loan.objects.filter(return_date__isnull=True).values('member__id', 'member__first_name').annotate(loan_count=Count('id')).order_by('-loan_count').first()
-
-        top_reader_data = {
-            'name': top_reader['member__first_name'] if top_reader else None,
-            'loan_count': top_reader['loan_count'] if top_reader else 0
-        }
+    @action(detail=False, methods=['post'], url_path='bulk-return')
+    def bulk_return(self, request):
+        serializer = BulkReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        loan_count = Loan.objects.filter(return_date__isnull=False).count()
-
-        return Response({
-            'count': loan_count,
-            'topReader': top_reader_data
-        })
+        result = return_loans(self.get_queryset(), **serializer.validated_data)
+        return Response(result)
 
     @action(detail=False, methods=['get'])
+    @cached_stats('loan', scoped=True)
     def stats(self, request):
-        queryset = self.get_queryset()
-        total = queryset.count()
+        if request.user.is_superuser:
+            total = LibraryCirculation.objects.aggregate(total=Sum('loan_count'))['total'] or 0
+            top_reader = (
+                MemberCirculation.objects.filter(loan_count__gt=0)
+                .order_by('-loan_count')
+                .values('member__id', 'member__first_name', 'loan_count')
+                .first()
+            )
+        else:
+            queryset = self.get_queryset()
+            total = queryset.count()
+            top_reader = queryset.values('member__id', 'member__first_name').annotate(loan_count=Count('id')).order_by('-loan_count').first()
 
-        top_reader = queryset.values('member__id', 'member__first_name').annotate(loan_count=Count('id')).order_by('-loan_count').first()
-        
         if top_reader:
             top_reader_data = {
                 'name': top_reader['member__first_name'],
@@ -318,32 +321,20 @@ class LoanViewSet(viewsets.ModelViewSet, BaseExportMixin):
         if not request.user.is_superuser:
             return Response({"error": "Permission denied"}, status=403)
 
-        queryset = self.get_queryset()
-        data_list = []
-        
-        for loan in queryset:
-            book_title = loan.book.title if loan.book else ''
-            member_name = loan.member.first_name if loan.member else ''
-            user_name = loan.user.username if loan.user else ''
-            return_date = loan.return_date if loan.return_date else 'Not returned'
-            
-            data_list.append({
-                'ID': loan.id,
-                'Book': book_title,
-                'Member': member_name,
-                'User': user_name,
-                'Loan Date': loan.loan_date,
-                'Return Date': return_date
-            })
-        
-        columns = ['ID', 'Book', 'Member', 'User', 'Loan Date', 'Return Date']
-        
-        return self.export_queryset(data_list, columns, 'Loans')
+        return self.export_queryset()
 
 
-class MemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
+class MemberViewSet(ConditionalGetMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (User, UserProfile)
+    export_spec = ExportSpec('Members', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Username', 'username'),
+        ExportColumn('Email', 'email'),
+        ExportColumn('Is Superuser', 'is_superuser', format=yes_no),
+        ExportColumn('Is Staff', 'is_staff', format=yes_no),
+    ])
 
     def get_queryset(self):
         if self.request.user.is_superuser:
@@ -434,41 +425,33 @@ class MemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @cached_stats('member', scoped=True)
     def stats(self, request):
-        queryset_users = self.get_queryset().filter(is_superuser=False)
-        total_users = queryset_users.count()
-
-        queryset_admins = self.get_queryset().filter(is_superuser=True)
-        total_admins = queryset_admins.count()
-
-        user_profiles = UserProfile.objects.filter(user__in=queryset_users, age__isnull=False)
-        if user_profiles.exists():
-            age_list = []
-            for profile in user_profiles:
-                if profile.age:
-                    age_list.append(profile.age)
-            if age_list:
-                avg_age_users = round(sum(age_list) / len(age_list), 1)
-            else:
-                avg_age_users = 0
-        else:
-            avg_age_users = 0
-
-        admin_profiles = UserProfile.objects.filter(user__in=queryset_admins, age__isnull=False)
-        if admin_profiles.exists():
-            admin_age_list = []
-            for profile in admin_profiles:
-                if profile.age:
-                    admin_age_list.append(profile.age)
-            if admin_age_list:
-                avg_age_admins = round(sum(admin_age_list) / len(admin_age_list), 1)
-            else:
-                avg_age_admins = 0
-        else:
-            avg_age_admins = 0
+        regular = Q(is_superuser=False)
+        admins = Q(is_superuser=True)
+        with_age = Q(profile__age__isnull=False) & ~Q(profile__age=0)
+        loans_per_user = (
+            Loan.objects.filter(member__user=OuterRef('pk'))
+            .order_by()
+            .values('member__user')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+
+        totals = self.get_queryset().aggregate(
+            total_users=Count('id', filter=regular),
+            total_admins=Count('id', filter=admins),
+            avg_age_users=Avg('profile__age', filter=regular & with_age),
+            avg_age_admins=Avg('profile__age', filter=admins & with_age),
+            loans_total=Sum(Subquery(loans_per_user), filter=regular),
+        )
+
+        total_users = totals['total_users']
+        total_admins = totals['total_admins']
+        avg_age_users = round(totals['avg_age_users'] or 0, 1)
+        avg_age_admins = round(totals['avg_age_admins'] or 0, 1)
+        loans_total = totals['loans_total'] or 0
 
-        loans_total = Loan.objects.filter(member__user__in=queryset_users).count()
-        
         if total_users > 0:
             avg_books = round(loans_total / total_users, 1)
         else:
@@ -482,54 +465,33 @@ class MemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
             'avg_books': avg_books
         })
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        return self.export_queryset()
+
     @action(detail=False, methods=['get'], url_path='export/excel')
     def export_excel(self, request):
-        queryset = self.get_queryset()
-        
-        data_list = []
-        for user in queryset:
-            data_list.append({
-                'ID': user.id,
-                'Username': user.username,
-                'Email': user.email,
-                'Is Superuser': 'Yes' if user.is_superuser else 'No',
-                'Is Staff': 'Yes' if user.is_staff else 'No'
-            })
-        
-        columns = ['ID', 'Username', 'Email', 'Is Superuser', 'Is Staff']
-        
-        return self.export_queryset(data_list, columns, 'Members')
+        return self.export_queryset(file_type='excel')
 
     @action(detail=False, methods=['get'], url_path='export/word')
     def export_word(self, request):
-        queryset = self.get_queryset()
-        
-        data_list = []
-        for user in queryset:
-            data_list.append({
-                'ID': user.id,
-                'Username': user.username,
-                'Email': user.email,
-                'Is Superuser': 'Yes' if user.is_superuser else 'No',
-                'Is Staff': 'Yes' if user.is_staff else 'No'
-            })
-        
-        columns = ['ID', 'Username', 'Email', 'Is Superuser', 'Is Staff']
-        
-        from django.http import QueryDict
-        request_copy = request._request.GET.copy()
-        request_copy['type'] = 'word'
-        request._request.GET = request_copy
-        
-        return self.export_queryset(data_list, columns, 'Members')
+        return self.export_queryset(file_type='word')
 
 
-class LibraryMemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
+class LibraryMemberViewSet(ConditionalGetMixin, FastListMixin, viewsets.ModelViewSet, BaseExportMixin):
     serializer_class = MemberSerializer
+    filter_serializer_class = MemberFilterSerializer
     permission_classes = [IsAuthenticated]
+    etag_models = (Member, Library, User)
+    export_spec = ExportSpec('LibraryMembers', [
+        ExportColumn('ID', 'id'),
+        ExportColumn('Name', 'first_name', roles=SUPERUSER),
+        ExportColumn('Library', 'library__name', default=''),
+        ExportColumn('User', 'user__username', default='', masked='*****'),
+    ])
     
     def get_queryset(self):
-        queryset = Member.objects.all().select_related('user', 'library')
+        queryset = Member.objects.all().select_related('user')
         
         if self.request.user.is_superuser:
             return queryset
@@ -537,13 +499,13 @@ class LibraryMemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
         user_member = queryset.filter(user=self.request.user).first()
         
         if not user_member:
-            default_library = Library.objects.first()
+            default_library = libraries.first()
             
             if default_library:
                 user_member = Member.objects.create(
                     user=self.request.user,
                     first_name=self.request.user.username,
-                    library=default_library
+                    library_id=default_library.id
                 )
         
         return queryset.filter(user=self.request.user)
@@ -564,31 +526,59 @@ class LibraryMemberViewSet(viewsets.ModelViewSet, BaseExportMixin):
         instance.delete()
 
     @action(detail=False, methods=['get'])
-    def export(self, request):
-        queryset = self.get_queryset()
-        
-        if not request.user.is_superuser:
-            data_list = []
-            for member in queryset:
-                library_name = member.library.name if member.library else ''
-                data_list.append({
-                    'ID': member.id,
-                    'Library': library_name,
-                    'User': '*****'
-                })
-            columns = ['ID', 'Library', 'User']
+    def autocomplete(self, request):
+        params = autocomplete_params(request)
+        if params is None:
+            return Response({"error": "limit and library must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        query, limit, library = params
+
+        if request.user.is_superuser:
+            matches = member_names.lookup(query, limit, library)
         else:
-            data_list = []
-            for member in queryset:
-                member_name = member.first_name
-                library_name = member.library.name if member.library else ''
-                user_name = member.user.username if member.user else ''
-                data_list.append({
-                    'ID': member.id,
-                    'Name': member_name,
-                    'Library': library_name,
-                    'User': user_name
-                })
-            columns = ['ID', 'Name', 'Library', 'User']
-        
-        return self.export_queryset(data_list, columns, 'LibraryMembers')
+            # regular users only ever see their own membership, no need for the index
+            prefix = autocomplete_key(query)
+            matches = [
+                (member.pk, member.first_name, member.library_id)
+                for member in self.get_queryset()
+                if autocomplete_key(member.first_name).startswith(prefix) and library in (None, member.library_id)
+            ][:limit]
+
+        return Response({'results': [{'id': pk, 'first_name': name, 'library': library_id} for pk, name, library_id in matches]})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        return self.export_queryset()
+
+
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = ExportJob.objects.all()
+
+        if self.request.user.is_superuser:
+            return queryset
+
+        return queryset.filter(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+
+        if job.status != ExportJob.DONE or not job.file:
+            raise Http404("Export is not ready.")
+
+        return FileResponse(
+            job.file.open('rb'),
+            as_attachment=True,
+            filename=f'{job.name}.{export_extension(job.file_type)}',
+        )
+
+
+class StatsCacheView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(stats_cache_info())
@@ -0,0 +1,114 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.db import transaction
+
+from library.models import Book, Member
+from library.search import normalize
+from library.versions import table_name, table_versions
+
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+def autocomplete_key(text):
+    return ' '.join(normalize(text or '').casefold().split())
+
+
+class PrefixIndex:
+    """Sorted (key, pk) pairs of one text field, answering prefix lookups with bisect.
+
+    Built lazily on the first lookup and then patched by the model signals once the write
+    commits. The index is stamped with the model's TableVersion, every patch stands for one
+    bump of it, so a write from another process shows up as a mismatch and a rebuild.
+    """
+
+    def __init__(self, name, model, field, group_field):
+        self.name = name
+        self.model = model
+        self.field = field
+        self.group_field = group_field
+        self.lock = threading.RLock()
+        self.keys = None
+        self.entries = {}
+        self.version = None
+
+    def shared_version(self):
+        return table_versions([self.model])[table_name(self.model)]
+
+    def build(self):
+        version = self.shared_version()
+        entries = {
+            pk: (autocomplete_key(text), text, group)
+            for pk, text, group in self.model.objects.values_list('pk', self.field, self.group_field).iterator(chunk_size=10000)
+        }
+        keys = sorted((key, pk) for pk, (key, _, _) in entries.items())
+        with self.lock:
+            self.keys, self.entries, self.version = keys, entries, version
+
+    def ensure_built(self):
+        if self.keys is None or self.version != self.shared_version():
+            with self.lock:
+                if self.keys is None or self.version != self.shared_version():
+                    self.build()
+
+    def lookup(self, prefix, limit=AUTOCOMPLETE_LIMIT, group=None):
+        self.ensure_built()
+        prefix = autocomplete_key(prefix)
+        results = []
+        with self.lock:
+            keys = self.keys
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and len(results) < limit:
+                key, pk = keys[position]
+                if not key.startswith(prefix):
+                    break
+                _, text, entry_group = self.entries[pk]
+                if group is None or entry_group == group:
+                    results.append((pk, text, entry_group))
+                position += 1
+        return results
+
+    def changed(self, pk, text=None, group=None, deleted=False):
+        self.changed_many([(pk, text, group, deleted)])
+
+    def changed_many(self, changes):
+        # (pk, text, group, deleted) of one save or bulk write, a rollback drops the patch
+        transaction.on_commit(lambda: self.apply(changes))
+
+    def apply(self, changes):
+        with self.lock:
+            if self.keys is None:
+                return
+            # the write bumped the table version once
+            self.version += 1
+            for pk, text, group, deleted in changes:
+                previous = self.entries.pop(pk, None)
+                if previous is not None:
+                    position = bisect_left(self.keys, (previous[0], pk))
+                    if position < len(self.keys) and self.keys[position] == (previous[0], pk):
+                        del self.keys[position]
+                if not deleted:
+                    key = autocomplete_key(text)
+                    self.entries[pk] = (key, text, group)
+                    insort(self.keys, (key, pk))
+
+    def invalidate(self):
+        # for bulk writes that bypass the signals, their table version bump reaches the other processes
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.keys = None
+            self.entries = {}
+            self.version = None
+
+
+book_titles = PrefixIndex('books', Book, 'title', 'library_id')
+member_names = PrefixIndex('members', Member, 'first_name', 'library_id')
+
+
+def reset_indexes():
+    for index in (book_titles, member_names):
+        index.reset()
@@ -0,0 +1,402 @@
+import io
+import json
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, timedelta
+from fnmatch import fnmatch
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from library.exports import EXPORT_TYPES
+from library.models import Library, Book, Genre, Member, Loan, UserProfile
+from library.reference import REFERENCE_TABLES
+from library.versions import versions_scope
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    # the test environment also allows the 'testserver' host that paginated responses link to
+    setup_test_environment()
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def bulk_insert(model, objects, batch_size=5000):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed_loans(count, books=1000, members=1000, seed=0):
+    rng = random.Random(seed)
+    with transaction.atomic():
+        genre = Genre.objects.create(name="Бенчмарк")
+        library = Library.objects.create(name="Бенчмарк", address="")
+        bulk_insert(Book, (Book(title=f"Книга {i}", genre=genre, library=library) for i in range(books)))
+        bulk_insert(Member, (Member(first_name=f"Читатель {i}", library=library) for i in range(members)))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        member_ids = list(Member.objects.values_list('id', flat=True))
+
+        start = date.today() - timedelta(days=730)
+        bulk_insert(Loan, (
+            Loan(
+                book_id=rng.choice(book_ids),
+                member_id=rng.choice(member_ids),
+                loan_date=start + timedelta(days=rng.randrange(730)),
+                return_date=None if rng.random() < 0.1 else date.today(),
+            )
+            for _ in range(count)
+        ))
+
+
+def benchmark_superuser():
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'is_superuser': True, 'is_staff': True})
+    return user
+
+
+def call_action(viewset, action, user, params=None, method='get', detail_pk=None):
+    request = getattr(APIRequestFactory(), method)('/', params or {})
+    force_authenticate(request, user=user)
+    view = viewset.as_view({method: action})
+    if detail_pk is None:
+        return view(request)
+    return view(request, pk=detail_pk)
+
+
+def measure_streaming(make_response, trace_heap=False):
+    # tracemalloc slows the export down several times, so heap tracing is opt-in
+    if trace_heap:
+        tracemalloc.start()
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    response = make_response()
+    first_byte = None
+    size = 0
+
+    chunks = response.streaming_content if response.streaming else [response.content]
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+
+    total = time.perf_counter() - started
+    if hasattr(response, 'close'):
+        response.close()
+
+    result = {
+        'status': response.status_code,
+        'bytes': size,
+        'ttfb_s': round(first_byte or total, 3),
+        'total_s': round(total, 3),
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if trace_heap:
+        result['heap_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    return result
+
+
+def seed_users(count, admin_share=0.05, loans_per_user=3, seed=0):
+    rng = random.Random(seed)
+    with transaction.atomic():
+        genre = Genre.objects.create(name="Бенчмарк")
+        library = Library.objects.create(name="Бенчмарк", address="")
+        bulk_insert(Book, (Book(title=f"Книга {i}", genre=genre, library=library) for i in range(100)))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+
+        bulk_insert(User, (
+            User(username=f"user{i}", is_superuser=rng.random() < admin_share, password='!')
+            for i in range(count)
+        ))
+        user_ids = list(User.objects.values_list('id', flat=True))
+        bulk_insert(UserProfile, (
+            UserProfile(user_id=user_id, age=rng.choice([None, rng.randint(14, 80)]), totp_key='')
+            for user_id in user_ids
+        ))
+        bulk_insert(Member, (Member(user_id=user_id, first_name=f"user{user_id}", library=library) for user_id in user_ids))
+        member_ids = list(Member.objects.values_list('id', flat=True))
+        bulk_insert(Loan, (
+            Loan(book_id=rng.choice(book_ids), member_id=member_id, loan_date=date.today())
+            for member_id in member_ids
+            for _ in range(rng.randint(0, loans_per_user * 2))
+        ))
+
+
+def legacy_member_stats(users):
+    # MemberViewSet.stats before it was rewritten as a single aggregate, kept for comparison
+    queryset_users = users.filter(is_superuser=False)
+    total_users = queryset_users.count()
+
+    queryset_admins = users.filter(is_superuser=True)
+    total_admins = queryset_admins.count()
+
+    def average_age(queryset):
+        profiles = UserProfile.objects.filter(user__in=queryset, age__isnull=False)
+        if not profiles.exists():
+            return 0
+        ages = [profile.age for profile in profiles if profile.age]
+        return round(sum(ages) / len(ages), 1) if ages else 0
+
+    loans_total = Loan.objects.filter(member__user__in=queryset_users).count()
+
+    return {
+        'count_users': total_users,
+        'count_admins': total_admins,
+        'avg_age_users': average_age(queryset_users),
+        'avg_age_admins': average_age(queryset_admins),
+        'avg_books': round(loans_total / total_users, 1) if total_users > 0 else 0,
+    }
+
+
+def measure_queries(func):
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as ctx:
+        result = func()
+    return result, {
+        'queries': len(ctx.captured_queries),
+        'total_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def seed_books(count, seed=0):
+    rng = random.Random(seed)
+    syllables = ['ма', 'ли', 'то', 'ра', 'не', 'ко', 'сё', 'да', 'ве', 'жу', 'пи', 'го']
+    with transaction.atomic():
+        genre = Genre.objects.create(name="Бенчмарк")
+        library = Library.objects.create(name="Бенчмарк", address="")
+        bulk_insert(Book, (
+            Book(title=' '.join(''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(rng.randint(1, 3))),
+                 genre=genre, library=library)
+            for _ in range(count)
+        ))
+    return syllables
+
+
+def latency_percentiles(func, samples):
+    timings = []
+    for args in samples:
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'samples': len(timings),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99)], 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+
+# generate_data arguments per dataset size
+SCALES = {
+    'small': {'libraries': 5, 'books': 2_000, 'members': 500, 'loans': 20_000},
+    'medium': {'libraries': 20, 'books': 50_000, 'members': 10_000, 'loans': 500_000},
+    'large': {'libraries': 50, 'books': 500_000, 'members': 100_000, 'loans': 5_000_000},
+}
+
+
+# viewsets that serialize through per-action serializers and have no serializer_class
+DETAIL_MODELS = {'userprofile': UserProfile}
+
+
+def seed_scale(scale, seed=0):
+    args = [f'--{name}={value}' for name, value in SCALES[scale].items()]
+    call_command('generate_data', *args, f'--seed={seed}', stdout=io.StringIO(), stderr=io.StringIO())
+
+
+def endpoint_cases(pattern=None):
+    # every list, retrieve, stats and export action of the API router
+    from app.urls import router
+
+    for prefix, viewset, _ in router.registry:
+        cases = []
+        if hasattr(viewset, 'list'):
+            cases.append((f'{prefix}.list', 'list', {}, False))
+        if hasattr(viewset, 'retrieve'):
+            cases.append((f'{prefix}.retrieve', 'retrieve', {}, True))
+        actions = {extra.__name__ for extra in viewset.get_extra_actions()}
+        if 'stats' in actions:
+            cases.append((f'{prefix}.stats', 'stats', {}, False))
+        if 'export' in actions:
+            cases += [(f'{prefix}.export.{file_type}', 'export', {'type': file_type}, False) for file_type in EXPORT_TYPES]
+
+        model = DETAIL_MODELS.get(prefix) or viewset.serializer_class.Meta.model
+        for name, action, params, detail in cases:
+            if pattern is None or fnmatch(name, pattern):
+                yield name, viewset, action, params, model if detail else None
+
+
+def consume(response):
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        if hasattr(response, 'render'):
+            response.render()
+        size = len(response.content)
+    response.close()
+    return size
+
+
+def warm_reference_tables():
+    # a running worker keeps them loaded, they are not part of any single request
+    for table in REFERENCE_TABLES.values():
+        table.snapshot()
+
+
+def measure_endpoint(viewset, action, user, params=None, detail_pk=None, repeats=5, trace_memory=True):
+    timings = []
+    for _ in range(repeats):
+        # cold stats caches: the budget is for the work, not for a cache hit
+        cache.clear()
+        warm_reference_tables()
+        started = time.perf_counter()
+        # the views are called without the middleware, the scope is what TableVersionMiddleware adds
+        with versions_scope(), CaptureQueriesContext(connection) as ctx:
+            response = call_action(viewset, action, user, params, detail_pk=detail_pk)
+            size = consume(response)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+
+    result = {
+        'status': response.status_code,
+        'bytes': size,
+        'queries': len(ctx.captured_queries),
+        'p50_ms': round(timings[len(timings) // 2], 1),
+        'max_ms': round(timings[-1], 1),
+    }
+    if trace_memory:
+        # a separate run, tracemalloc slows everything down
+        cache.clear()
+        warm_reference_tables()
+        tracemalloc.start()
+        try:
+            with versions_scope():
+                consume(call_action(viewset, action, user, params, detail_pk=detail_pk))
+            result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_endpoint_suite(user, pattern=None, repeats=5, trace_memory=True):
+    results = {}
+    for name, viewset, action, params, detail_model in endpoint_cases(pattern):
+        detail_pk = None
+        if detail_model is not None:
+            detail_pk = detail_model.objects.order_by('pk').values_list('pk', flat=True).first()
+            if detail_pk is None:
+                continue
+        results[name] = measure_endpoint(viewset, action, user, params, detail_pk, repeats, trace_memory)
+    return results
+
+
+BUDGET_METRICS = ('status', 'queries', 'p50_ms', 'peak_mb')
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not Path(path).exists():
+        # limit = budget * factor + slack; the slack keeps millisecond endpoints from flapping
+        return {'tolerance': {'p50_ms': [1.5, 5], 'peak_mb': [1.25, 0.5]}, 'scales': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def as_budgets(results):
+    return {name: {metric: measured[metric] for metric in BUDGET_METRICS if metric in measured} for name, measured in results.items()}
+
+
+def check_budgets(results, budgets, tolerance, metrics=BUDGET_METRICS):
+    violations = []
+    for name, measured in sorted(results.items()):
+        budget = budgets.get(name)
+        if budget is None:
+            violations.append(f'{name}: no budget in the baseline')
+            continue
+        for metric in metrics:
+            if metric not in measured or metric not in budget:
+                continue
+            if metric == 'status':
+                if measured[metric] != budget[metric]:
+                    violations.append(f'{name}: status {measured[metric]}, expected {budget[metric]}')
+                continue
+            # query counts are exact, timings and memory get some room for noise
+            factor, slack = tolerance.get(metric, (1, 0))
+            limit = budget[metric] * factor + slack
+            if measured[metric] > limit:
+                violations.append(f'{name}: {metric} {measured[metric]} > {round(limit, 2)}')
+    return violations
+
+
+
+def walk_list(viewset, user, params):
+    # every page of a list action, following the cursor like a client would
+    params = dict(params)
+    pages, rows = [], 0
+    while True:
+        response = call_action(viewset, 'list', user, params)
+        response.render()
+        pages.append(response.content)
+        rows += len(response.data['results'])
+        if not response.data['next']:
+            return pages, rows
+        params['cursor'] = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+
+def compare_list_paths(viewset, user, page_size=1000, repeats=3):
+    """Serializer and fast list rendering over the same pages: rows per second and identical output."""
+    result = {}
+    outputs = {}
+    for name, enabled in (('serializer', False), ('fast', True)):
+        timings = []
+        with override_settings(FAST_LISTS=enabled):
+            for _ in range(repeats):
+                started = time.perf_counter()
+                pages, rows = walk_list(viewset, user, {'page_size': page_size})
+                timings.append(time.perf_counter() - started)
+        outputs[name] = pages
+        best = min(timings)
+        result[name] = {'total_s': round(best, 3), 'rows_per_s': round(rows / best)}
+    result['rows'] = rows
+    result['speedup'] = round(result['fast']['rows_per_s'] / result['serializer']['rows_per_s'], 2)
+    result['identical'] = outputs['serializer'] == outputs['fast']
+    return result
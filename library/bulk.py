@@ -0,0 +1,137 @@
+from datetime import date
+
+from django.db import transaction
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from library.models import Book, Genre, Library, Loan, Member
+from library.rollups import apply_books_added, apply_loan_changes, loan_state
+from library.signals import bulk_changed
+
+
+BULK_MAX_ITEMS = 1000
+
+
+class BulkItemSerializer(serializers.Serializer):
+    # foreign keys are plain integers here and resolved for the whole batch at once
+    related_models = {}
+
+
+class BookBulkItemSerializer(BulkItemSerializer):
+    title = serializers.CharField()
+    genre = serializers.IntegerField(min_value=1)
+    library = serializers.IntegerField(min_value=1)
+
+    related_models = {'genre': Genre, 'library': Library}
+
+
+class LoanBulkItemSerializer(BulkItemSerializer):
+    book = serializers.IntegerField(min_value=1)
+    member = serializers.IntegerField(min_value=1)
+    loan_date = serializers.DateField()
+
+    related_models = {'book': Book, 'member': Member}
+
+
+def resolve_related(related_models, items, errors):
+    for field, model in related_models.items():
+        # one IN query per related model for the whole batch
+        found = model.objects.in_bulk({item[field] for item in items if item is not None})
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+            if item[field] in found:
+                item[field] = found[item[field]]
+            else:
+                errors[index][field] = [f'Invalid pk "{item[field]}" - object does not exist.']
+
+
+class BulkCreateMixin:
+    bulk_serializer_class = None
+
+    def bulk_object_defaults(self):
+        return {}
+
+    def perform_bulk_create(self, objects):
+        pass
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        data = request.data
+        if not isinstance(data, list) or not data:
+            return Response({"error": "Expected a non-empty list of objects"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(data) > BULK_MAX_ITEMS:
+            return Response({"error": f"At most {BULK_MAX_ITEMS} objects per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = []
+        errors = []
+        for entry in data:
+            serializer = self.bulk_serializer_class(data=entry)
+            valid = serializer.is_valid()
+            items.append(dict(serializer.validated_data) if valid else None)
+            errors.append({} if valid else dict(serializer.errors))
+
+        resolve_related(self.bulk_serializer_class.related_models, items, errors)
+        if any(errors):
+            # all or nothing: the errors line up with the submitted items
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        defaults = self.bulk_object_defaults()
+        objects = [model(**defaults, **item) for item in items]
+        with transaction.atomic():
+            objects = model.objects.bulk_create(objects)
+            self.perform_bulk_create(objects)
+        bulk_changed.send(sender=model, instances=objects)
+
+        serializer = self.get_serializer(objects, many=True)
+        return Response({"results": serializer.data}, status=status.HTTP_201_CREATED)
+
+
+class BookBulkCreateMixin(BulkCreateMixin):
+    bulk_serializer_class = BookBulkItemSerializer
+
+    def perform_bulk_create(self, books):
+        apply_books_added(books)
+
+
+class LoanBulkCreateMixin(BulkCreateMixin):
+    bulk_serializer_class = LoanBulkItemSerializer
+
+    def bulk_object_defaults(self):
+        return {'user': self.request.user}
+
+    def perform_bulk_create(self, loans):
+        # what the Loan signals would have done one by one
+        Book.objects.filter(pk__in={loan.book_id for loan in loans}).refresh_availability()
+        apply_loan_changes(added=[loan_state(loan.book_id, loan.member_id, loan.return_date) for loan in loans])
+
+
+class BulkReturnSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=BULK_MAX_ITEMS)
+    return_date = serializers.DateField(required=False)
+
+
+def return_loans(queryset, ids, return_date=None):
+    requested = set(ids)
+    with transaction.atomic():
+        rows = list(queryset.filter(pk__in=requested).values_list('pk', 'return_date', 'book_id', 'member_id'))
+        open_loans = [(pk, book_id, member_id) for pk, returned, book_id, member_id in rows if returned is None]
+        Loan.objects.filter(pk__in=[pk for pk, _, _ in open_loans], return_date__isnull=True).update(
+            return_date=return_date or date.today()
+        )
+
+        # once per batch instead of once per loan through the signals
+        Book.objects.filter(pk__in={book_id for _, book_id, _ in open_loans}).refresh_availability()
+        apply_loan_changes(
+            removed=[(book_id, member_id, True) for _, book_id, member_id in open_loans],
+            added=[(book_id, member_id, False) for _, book_id, member_id in open_loans],
+        )
+    bulk_changed.send(sender=Loan, instances=None)
+
+    return {
+        'returned': sorted(pk for pk, _, _ in open_loans),
+        'already_returned': sorted(pk for pk, returned, _, _ in rows if returned is not None),
+        'not_found': sorted(requested - {pk for pk, _, _, _ in rows}),
+    }
@@ -0,0 +1,107 @@
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from library.exports import (EXPORT_CHUNK_SIZE, EXPORT_SPOOL_MAX_SIZE, export_extension, iter_export_rows,
+                             record_export_bytes, write_export)
+from library.models import ExportJob
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EXPORT_JOB_WORKERS', 2),
+                thread_name_prefix='export-job',
+            )
+    return _executor
+
+
+def job_ttl():
+    return timedelta(seconds=getattr(settings, 'EXPORT_JOB_TTL', 24 * 60 * 60))
+
+
+def submit_export_job(user, queryset, columns, filename_base, file_type, row=None):
+    purge_expired_jobs()
+    job = ExportJob.objects.create(user=user, name=filename_base, file_type=file_type)
+
+    if getattr(settings, 'EXPORT_JOBS_EAGER', False):
+        run_export_job(job.pk, queryset, columns, row)
+        job.refresh_from_db()
+        return job
+
+    def run_in_worker():
+        try:
+            run_export_job(job.pk, queryset, columns, row)
+        finally:
+            # worker threads get their own connections, don't leave them open
+            connections.close_all()
+
+    transaction.on_commit(lambda: get_executor().submit(run_in_worker))
+    return job
+
+
+def track_progress(rows, job_id):
+    done = 0
+    for values in rows:
+        yield values
+        done += 1
+        if done % EXPORT_CHUNK_SIZE == 0:
+            ExportJob.objects.filter(pk=job_id).update(rows_done=done)
+    ExportJob.objects.filter(pk=job_id).update(rows_done=done)
+
+
+def run_export_job(job_id, queryset, columns, row=None):
+    job = ExportJob.objects.get(pk=job_id)
+    job.status = ExportJob.RUNNING
+    job.rows_total = queryset.count()
+    job.save(update_fields=['status', 'rows_total'])
+
+    try:
+        rows = track_progress(iter_export_rows(queryset, row), job.pk)
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE) as target:
+            write_export(rows, columns, job.name, job.file_type, target)
+            record_export_bytes(job.file_type, target.tell())
+            target.seek(0)
+            job.file.save(f'{job.pk}.{export_extension(job.file_type)}', File(target), save=False)
+    except Exception as exc:
+        logger.exception("Export job %s failed", job.pk)
+        job.status = ExportJob.FAILED
+        job.error = str(exc)
+    else:
+        job.status = ExportJob.DONE
+
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + job_ttl()
+    # rows_done is left alone, track_progress keeps it up to date in the database
+    job.save(update_fields=['status', 'error', 'file', 'finished_at', 'expires_at'])
+
+
+def purge_expired_jobs(now=None):
+    now = now or timezone.now()
+    # jobs that never finished (e.g. the worker process died) are dropped after the same TTL
+    expired = ExportJob.objects.filter(
+        Q(expires_at__lt=now) | Q(expires_at__isnull=True, created_at__lt=now - job_ttl())
+    )
+    count = 0
+    for job in expired.iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        count += 1
+    return count
@@ -0,0 +1,213 @@
+import csv
+import tempfile
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, StreamingHttpResponse
+from docx import Document
+from openpyxl import Workbook
+
+from library.metrics import inc
+
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_SPOOL_MAX_SIZE = getattr(settings, 'EXPORT_SPOOL_MAX_SIZE', 8 * 1024 * 1024)
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+EVERYONE = 'everyone'
+SUPERUSER = 'superuser'
+REGULAR_USER = 'user'
+
+
+class ExportColumn:
+    def __init__(self, header, source, default=None, format=None, roles=EVERYONE, masked=None):
+        # source is an ORM path ('book__title') or a query expression that gets annotated
+        self.header = header
+        self.source = source
+        self.default = default
+        self.format = format
+        self.roles = roles
+        # regular users get this constant instead of the real value
+        self.masked = masked
+
+    def visible_for(self, user):
+        if self.roles == EVERYONE:
+            return True
+        return (self.roles == SUPERUSER) == bool(user.is_superuser)
+
+    def is_masked_for(self, user):
+        return self.masked is not None and not user.is_superuser
+
+
+class ExportSpec:
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+
+    def columns_for(self, user):
+        return [column for column in self.columns if column.visible_for(user)]
+
+    def compile(self, queryset, user):
+        columns = self.columns_for(user)
+        fields = []
+        annotations = {}
+        plan = []
+
+        for index, column in enumerate(columns):
+            if column.is_masked_for(user):
+                plan.append((None, None, None, column.masked))
+                continue
+            if isinstance(column.source, str):
+                field = column.source
+            else:
+                field = f'export_col_{index}'
+                annotations[field] = column.source
+            plan.append((len(fields), column.format, column.default, None))
+            fields.append(field)
+
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        queryset = queryset.values_list(*fields)
+
+        def row(*values):
+            result = []
+            for position, format_value, default, constant in plan:
+                if position is None:
+                    result.append(constant)
+                    continue
+                value = values[position]
+                if format_value is not None:
+                    value = format_value(value)
+                if value is None and default is not None:
+                    value = default
+                result.append(value)
+            return result
+
+        return queryset, [column.header for column in columns], row
+
+
+def yes_no(value):
+    return 'Yes' if value else 'No'
+
+
+def available_status(value):
+    return 'Available' if value else 'Borrowed'
+
+
+def write_xlsx(rows, columns, title, target):
+    # write-only mode keeps only the current row in memory instead of the whole sheet
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(target)
+
+
+def write_docx(rows, columns, title, target):
+    document = Document()
+    document.add_heading(title, 0)
+    for row in rows:
+        document.add_paragraph(' | '.join(str(value) for value in row))
+    document.save(target)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(rows, columns):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+FILE_WRITERS = {
+    'excel': (write_xlsx, 'xlsx', XLSX_CONTENT_TYPE),
+    'word': (write_docx, 'docx', DOCX_CONTENT_TYPE),
+}
+
+STREAM_WRITERS = {
+    'csv': (stream_csv, 'csv', 'text/csv; charset=utf-8'),
+    'ndjson': (stream_ndjson, 'ndjson', 'application/x-ndjson; charset=utf-8'),
+}
+
+EXPORT_TYPES = {**FILE_WRITERS, **STREAM_WRITERS}
+
+
+def iter_export_rows(queryset, row=None):
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if row is None:
+        return rows
+    return (row(*values) for values in rows)
+
+
+def write_export(rows, columns, title, file_type, target):
+    if file_type in FILE_WRITERS:
+        writer = FILE_WRITERS[file_type][0]
+        writer(rows, columns, title, target)
+        return
+    writer = STREAM_WRITERS[file_type][0]
+    for chunk in writer(rows, columns):
+        target.write(chunk.encode('utf-8'))
+
+
+def record_export_bytes(file_type, size):
+    inc('library_export_bytes_total', size, type=file_type)
+
+
+def export_extension(file_type):
+    return EXPORT_TYPES[file_type][1]
+
+
+def build_file_response(rows, columns, filename_base, file_type):
+    writer, extension, content_type = FILE_WRITERS[file_type]
+
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    writer(rows, columns, filename_base, spool)
+    record_export_bytes(file_type, spool.tell())
+    spool.seek(0)
+
+    return FileResponse(
+        spool,
+        as_attachment=True,
+        filename=f'{filename_base}.{extension}',
+        content_type=content_type,
+    )
+
+
+def counted_chunks(chunks, file_type):
+    size = 0
+    try:
+        for chunk in chunks:
+            chunk = chunk.encode('utf-8')
+            size += len(chunk)
+            yield chunk
+    finally:
+        # also when the client goes away halfway through
+        record_export_bytes(file_type, size)
+
+
+def build_streaming_response(rows, columns, filename_base, file_type):
+    writer, extension, content_type = STREAM_WRITERS[file_type]
+
+    response = StreamingHttpResponse(counted_chunks(writer(rows, columns), file_type), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename_base}.{extension}"'
+    return response
+
+
+def build_export_response(rows, columns, filename_base, file_type):
+    if file_type in STREAM_WRITERS:
+        return build_streaming_response(rows, columns, filename_base, file_type)
+    return build_file_response(rows, columns, filename_base, file_type)
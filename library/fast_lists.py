@@ -0,0 +1,150 @@
+from collections import namedtuple
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from library.fieldsets import column_path
+from library.reference import ReferenceNameField
+from library.timing import timed_serialization
+
+
+# key: output name, column: values() key, convert: None or a function of (value, state),
+# guard: the nullable foreign key that makes DRF skip the field when it is empty
+Step = namedtuple('Step', ['key', 'column', 'convert', 'guard'])
+ListPlan = namedtuple('ListPlan', ['columns', 'steps', 'tables'])
+
+_plans = {}
+
+
+def fast_lists_enabled():
+    return getattr(settings, 'FAST_LISTS', False)
+
+
+def to_date(value, state):
+    return value.isoformat()
+
+
+def to_int(value, state):
+    return int(value)
+
+
+def file_url(storage):
+    def convert(value, state):
+        # what FileField.to_representation returns for a stored name
+        if not value:
+            return None
+        url = storage.url(value)
+        return state.request.build_absolute_uri(url) if state.request is not None else url
+    return convert
+
+
+def reference_name(table):
+    def convert(value, state):
+        row = state.tables[table].get(value)
+        return row.name if row else None
+    return convert
+
+
+def field_converter(field, model_field):
+    """How a DRF field turns a values() column into output, False when the plan can't reproduce it."""
+    kind = type(field)
+    if kind in (serializers.ReadOnlyField, serializers.CharField, serializers.BooleanField,
+                serializers.PrimaryKeyRelatedField):
+        if kind is serializers.PrimaryKeyRelatedField and field.pk_field is not None:
+            return False
+        return None
+    if kind is serializers.IntegerField:
+        return to_int
+    if kind is serializers.DateField:
+        output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+        return to_date if output_format and output_format.lower() == 'iso-8601' else False
+    if kind in (serializers.FileField, serializers.ImageField):
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        return file_url(model_field.storage) if use_url else False
+    if kind is ReferenceNameField:
+        return reference_name(field.table)
+    return False
+
+
+def compile_plan(serializer, model):
+    steps = []
+    tables = set()
+    for field in serializer._readable_fields:
+        if field.source == '*':
+            return None
+        path = column_path(model, field.source_attrs)
+        if path is None:
+            return None
+
+        related, model_field = model, None
+        for name in path:
+            model_field = related._meta.get_field(name)
+            related = model_field.related_model or related
+        convert = field_converter(field, model_field)
+        if convert is False:
+            return None
+
+        guard = None
+        if len(path) > 1 and model._meta.get_field(path[0]).null:
+            guard = path[0]
+        if isinstance(field, ReferenceNameField):
+            tables.add(field.table)
+        steps.append(Step(field.field_name, '__'.join(path), convert, guard))
+
+    columns = list(dict.fromkeys([step.column for step in steps] + [step.guard for step in steps if step.guard]))
+    return ListPlan(columns, steps, tables)
+
+
+def list_plan(serializer, model):
+    # compiled once per serializer class and set of fields, ?fields= gives each narrowing its own plan
+    key = (type(serializer), tuple(serializer.fields))
+    if key not in _plans:
+        _plans[key] = compile_plan(serializer, model)
+    return _plans[key]
+
+
+class RenderState:
+    def __init__(self, plan, request):
+        self.request = request
+        # one snapshot per response, like ReferenceNameField
+        self.tables = {table: table.snapshot().by_id for table in plan.tables}
+
+
+def render_rows(plan, rows, request):
+    state = RenderState(plan, request)
+    steps = plan.steps
+    results = []
+    for row in rows:
+        item = {}
+        for key, column, convert, guard in steps:
+            if guard is not None and row[guard] is None:
+                continue
+            value = row[column]
+            item[key] = value if value is None or convert is None else convert(value, state)
+        results.append(item)
+    return results
+
+
+class FastListMixin:
+    """Renders list pages from values() rows instead of model instances and serializer fields.
+
+    The plan is compiled from the serializer, so the output is the same as the serializer's,
+    byte for byte. Serializers with fields the plan can't reproduce (method fields, nested
+    serializers) take the usual path. Off unless FAST_LISTS = True.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not fast_lists_enabled() or self.paginator is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        plan = list_plan(self.get_serializer(), queryset.model)
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        # the cursor is read from the ordering columns of the rows at the page edges
+        ordering = [name.lstrip('-') for name in self.paginator.get_ordering(request, queryset, self)]
+        page = self.paginate_queryset(queryset.values(*dict.fromkeys(plan.columns + ordering)))
+        with timed_serialization():
+            data = render_rows(plan, page, request)
+        return self.get_paginated_response(data)
@@ -0,0 +1,124 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.permissions import SAFE_METHODS
+
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+
+def parse_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def is_sparse(request):
+    if request is None or request.method not in SAFE_METHODS:
+        return False
+    return bool(parse_names(request.query_params.get(FIELDS_PARAM, '')) or parse_names(request.query_params.get(EXCLUDE_PARAM, '')))
+
+
+def requested_fields(request, available):
+    """The field names a GET asks for with ?fields= and ?exclude=, None when it takes them all."""
+    if not is_sparse(request):
+        return None
+    only = parse_names(request.query_params.get(FIELDS_PARAM, ''))
+    exclude = parse_names(request.query_params.get(EXCLUDE_PARAM, ''))
+
+    errors = {}
+    for param, names in ((FIELDS_PARAM, only), (EXCLUDE_PARAM, exclude)):
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [f"Unknown fields: {', '.join(unknown)}."]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    names = set(only or available) - set(exclude)
+    return [name for name in available if name in names]
+
+
+class SparseFieldsMixin:
+    """Drops the fields the request didn't ask for, before any of them is computed.
+
+    Only the top level serializer of a response is narrowed. Method fields that read model
+    columns declare them in Meta.field_sources, so that the queryset can be narrowed as well.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.is_response_root():
+            return fields
+        names = requested_fields(self.context.get('request'), list(fields))
+        if names is None:
+            return fields
+        return {name: fields[name] for name in names}
+
+    def is_response_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+
+def column_path(model, attrs):
+    # ['book', 'title'] -> ['book', 'title'], None when a step isn't a concrete field
+    path = []
+    for position, attr in enumerate(attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            field = next((field for field in model._meta.concrete_fields if field.attname == attr), None)
+        if field is None or not field.concrete:
+            return None
+        path.append(field.name)
+        if field.is_relation:
+            model = field.related_model
+        elif position != len(attrs) - 1:
+            return None
+    return path
+
+
+def sparse_columns(serializer, model):
+    """The columns (and joins) that the serializer's fields read, None when that can't be told."""
+    field_sources = getattr(getattr(serializer, 'Meta', None), 'field_sources', {})
+    paths = [[model._meta.pk.name]]
+    for name, field in serializer.fields.items():
+        if field.source == '*':
+            if name not in field_sources:
+                return None
+            sources = [source.split('.') for source in field_sources[name]]
+        else:
+            sources = [field.source_attrs]
+        for attrs in sources:
+            path = column_path(model, attrs)
+            if path is None:
+                return None
+            paths.append(path)
+    columns = {'__'.join(path) for path in paths}
+    relations = {'__'.join(path[:-1]) for path in paths if len(path) > 1}
+    return columns, relations
+
+
+class SparseFieldsFilterBackend(BaseFilterBackend):
+    """Loads only() the columns behind the requested fields for list and retrieve."""
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) not in ('list', 'retrieve'):
+            return queryset
+        serializer = view.get_serializer()
+        if not isinstance(serializer, SparseFieldsMixin) or not is_sparse(request):
+            return queryset
+
+        narrowed = sparse_columns(serializer, queryset.model)
+        if narrowed is None:
+            return queryset
+        columns, relations = narrowed
+
+        paginator = getattr(view, 'paginator', None)
+        if view.action == 'list' and paginator is not None and hasattr(paginator, 'get_ordering'):
+            # the cursor is built from the ordering columns of the page's edge rows
+            columns |= {name.lstrip('-') for name in paginator.get_ordering(request, queryset, view)}
+
+        # joins that no requested field reads are dropped, deferring their key would clash with them
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*columns)
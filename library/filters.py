@@ -0,0 +1,87 @@
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+
+class QueryFilterSerializer(serializers.Serializer):
+    # query parameter -> ORM lookup; parameters with a filter_<name> method are applied by it instead
+    lookups = {}
+
+    def filter_queryset(self, queryset):
+        for name, value in self.validated_data.items():
+            if value is None:
+                continue
+            method = getattr(self, f'filter_{name}', None)
+            if method is not None:
+                queryset = method(queryset, value)
+            else:
+                queryset = queryset.filter(**{self.lookups[name]: value})
+        return queryset
+
+
+class SerializerFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        serializer_class = getattr(view, 'filter_serializer_class', None)
+        if serializer_class is None:
+            return queryset
+
+        # a plain dict, so that missing booleans are not read as unchecked checkboxes
+        serializer = serializer_class(data=request.query_params.dict())
+        serializer.is_valid(raise_exception=True)
+        return serializer.filter_queryset(queryset)
+
+
+class BookFilterSerializer(QueryFilterSerializer):
+    genre = serializers.IntegerField(required=False, min_value=1)
+    library = serializers.IntegerField(required=False, min_value=1)
+    available = serializers.BooleanField(required=False, allow_null=True, default=None)
+    title = serializers.CharField(required=False, max_length=200)
+    title_prefix = serializers.CharField(required=False, max_length=200)
+
+    lookups = {
+        'genre': 'genre_id',
+        'library': 'library_id',
+        'available': 'is_available',
+        # any substring, a scan of the table; SQLite only folds the case of Latin letters
+        'title': 'title__icontains',
+    }
+
+    def filter_title_prefix(self, queryset, value):
+        # whole words, the last one also as a prefix, matched through the full-text index
+        return queryset.search(value, column='title')
+
+
+class LoanFilterSerializer(QueryFilterSerializer):
+    OPEN = 'open'
+    RETURNED = 'returned'
+
+    status = serializers.ChoiceField(choices=[OPEN, RETURNED], required=False)
+    loan_date_from = serializers.DateField(required=False)
+    loan_date_to = serializers.DateField(required=False)
+    member = serializers.IntegerField(required=False, min_value=1)
+    book = serializers.IntegerField(required=False, min_value=1)
+    library = serializers.IntegerField(required=False, min_value=1)
+
+    lookups = {
+        'loan_date_from': 'loan_date__gte',
+        'loan_date_to': 'loan_date__lte',
+        'member': 'member_id',
+        'book': 'book_id',
+        'library': 'book__library_id',
+    }
+
+    def validate(self, attrs):
+        start, end = attrs.get('loan_date_from'), attrs.get('loan_date_to')
+        if start and end and start > end:
+            raise serializers.ValidationError({'loan_date_to': "Must not be earlier than loan_date_from."})
+        return attrs
+
+    def filter_status(self, queryset, value):
+        return queryset.filter(return_date__isnull=value == self.OPEN)
+
+
+class MemberFilterSerializer(QueryFilterSerializer):
+    library = serializers.IntegerField(required=False, min_value=1)
+
+    lookups = {
+        'library': 'library_id',
+    }
@@ -0,0 +1,143 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import benchmarks
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import CommandError
+
+from library.api import BookViewSet, LibraryMemberViewSet, LoanViewSet, MemberViewSet
+from library.autocomplete import book_titles
+
+
+class Command(BaseCommand):
+    help = "Замеры производительности API на временной базе данных"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='target', required=True)
+
+        export = subparsers.add_parser('export', help="Выгрузка выдач: пиковая память и время до первого байта")
+        export.add_argument('--rows', type=int, default=1_000_000)
+        export.add_argument('--type', default='excel')
+        export.add_argument('--trace-heap', action='store_true', help="Дополнительно замерить пик кучи Python (медленно)")
+
+        member_stats = subparsers.add_parser('member-stats', help="Статистика читателей: старая и новая реализация")
+        member_stats.add_argument('--users', type=int, default=100_000)
+
+        autocomplete = subparsers.add_parser('autocomplete', help="Автодополнение названий книг: построение индекса и задержка")
+        autocomplete.add_argument('--books', type=int, default=1_000_000)
+        autocomplete.add_argument('--lookups', type=int, default=20_000)
+
+        lists = subparsers.add_parser('lists', help="Списки книг, выдач и читателей: сериализаторы против быстрого пути")
+        lists.add_argument('--rows', type=int, default=50_000)
+        lists.add_argument('--page-size', type=int, default=1000)
+        lists.add_argument('--repeats', type=int, default=3)
+
+        endpoints = subparsers.add_parser('endpoints', help="Все list/retrieve/stats/export: запросы, время и память против бюджетов")
+        endpoints.add_argument('--scale', action='append', choices=list(benchmarks.SCALES), help="Размер данных, можно несколько (по умолчанию small)")
+        endpoints.add_argument('--only', help="Шаблон имён эндпоинтов, например 'loans.*'")
+        endpoints.add_argument('--repeats', type=int, default=5)
+        endpoints.add_argument('--baseline', default=str(benchmarks.BASELINE_PATH))
+        endpoints.add_argument('--update-baseline', action='store_true', help="Записать замеры как новые бюджеты")
+
+    def handle(self, *args, **options):
+        if options['target'] == 'endpoints':
+            result = self.bench_endpoints(options)
+        else:
+            with benchmarks.scratch_database():
+                result = getattr(self, f"bench_{options['target'].replace('-', '_')}")(options)
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+
+        violations = result.get('violations') if isinstance(result, dict) else None
+        if violations:
+            raise CommandError("Превышены бюджеты:\n" + "\n".join(violations))
+
+    def bench_export(self, options):
+        self.stderr.write(f"Создаём {options['rows']} выдач...")
+        benchmarks.seed_loans(options['rows'])
+        user = benchmarks.benchmark_superuser()
+
+        result = benchmarks.measure_streaming(
+            lambda: benchmarks.call_action(LoanViewSet, 'export', user, {'type': options['type']}),
+            trace_heap=options['trace_heap'],
+        )
+        return {'rows': options['rows'], 'type': options['type'], **result}
+
+    def bench_member_stats(self, options):
+        self.stderr.write(f"Создаём {options['users']} пользователей...")
+        benchmarks.seed_users(options['users'])
+        user = benchmarks.benchmark_superuser()
+
+        legacy, legacy_timing = benchmarks.measure_queries(lambda: benchmarks.legacy_member_stats(User.objects.all()))
+        cache.clear()
+        response, timing = benchmarks.measure_queries(lambda: benchmarks.call_action(MemberViewSet, 'stats', user))
+
+        if response.data != legacy:
+            raise CommandError(f"Результаты расходятся: {response.data} != {legacy}")
+        return {'users': options['users'], 'legacy': legacy_timing, 'aggregate': timing, 'result': response.data}
+
+    def bench_autocomplete(self, options):
+        self.stderr.write(f"Создаём {options['books']} книг...")
+        syllables = benchmarks.seed_books(options['books'])
+        user = benchmarks.benchmark_superuser()
+
+        rss_before = benchmarks.peak_rss_mb()
+        started = time.perf_counter()
+        book_titles.ensure_built()
+        build_s = round(time.perf_counter() - started, 3)
+
+        rng = random.Random(0)
+        prefixes = [''.join(rng.choices(syllables, k=rng.randint(1, 3)))[:rng.randint(1, 6)] for _ in range(options['lookups'])]
+        return {
+            'books': options['books'],
+            'build_s': build_s,
+            'rss_before_mb': rss_before,
+            'peak_rss_mb': benchmarks.peak_rss_mb(),
+            'index': benchmarks.latency_percentiles(book_titles.lookup, [(prefix,) for prefix in prefixes]),
+            'endpoint': benchmarks.latency_percentiles(
+                lambda prefix: benchmarks.call_action(BookViewSet, 'autocomplete', user, {'q': prefix}),
+                [(prefix,) for prefix in prefixes[:2000]],
+            ),
+        }
+
+    def bench_lists(self, options):
+        rows = options['rows']
+        self.stderr.write(f"Создаём по {rows} книг, читателей и выдач...")
+        benchmarks.seed_loans(rows, books=rows, members=rows)
+        user = benchmarks.benchmark_superuser()
+
+        result = {'rows': rows, 'page_size': options['page_size']}
+        for name, viewset in (('books', BookViewSet), ('loans', LoanViewSet), ('library-members', LibraryMemberViewSet)):
+            result[name] = benchmarks.compare_list_paths(viewset, user, options['page_size'], options['repeats'])
+            if not result[name]['identical']:
+                raise CommandError(f"{name}: быстрый путь отдаёт другие данные")
+        return result
+
+    def bench_endpoints(self, options):
+        baseline = benchmarks.load_baseline(options['baseline'])
+        result = {'scales': {}, 'violations': []}
+
+        for scale in options['scale'] or ['small']:
+            # every scale gets a fresh database
+            with benchmarks.scratch_database():
+                self.stderr.write(f"Генерируем данные {scale}: {benchmarks.SCALES[scale]}...")
+                benchmarks.seed_scale(scale)
+                user = benchmarks.benchmark_superuser()
+                measured = benchmarks.run_endpoint_suite(user, options['only'], options['repeats'])
+
+            result['scales'][scale] = measured
+            budgets = baseline['scales'].setdefault(scale, {})
+            if options['update_baseline']:
+                budgets.update(benchmarks.as_budgets(measured))
+            else:
+                result['violations'] += [
+                    f"{scale} {violation}"
+                    for violation in benchmarks.check_budgets(measured, budgets, baseline['tolerance'])
+                ]
+
+        if options['update_baseline']:
+            benchmarks.save_baseline(baseline, options['baseline'])
+        return result
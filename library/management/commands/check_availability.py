@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from library.models import Book
+
+
+class Command(BaseCommand):
+    help = "Проверяет и исправляет денормализованный статус доступности книг"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать расхождения, ничего не менять")
+
+    def handle(self, *args, **options):
+        mismatched = Book.objects.availability_mismatches()
+        total = mismatched.count()
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Расхождений не найдено."))
+            return
+
+        self.stdout.write(self.style.WARNING(f"Книг с неверным статусом: {total}"))
+        if options['dry_run']:
+            for book_id in mismatched.values_list('id', flat=True).iterator():
+                self.stdout.write(str(book_id))
+            return
+
+        fixed = mismatched.refresh_availability()
+        self.stdout.write(self.style.SUCCESS(f"Исправлено: {fixed}"))
@@ -1,132 +1,293 @@
 # library/management/commands/generate_data.py
 
+import multiprocessing
+import random
+import time
+from bisect import bisect
+from datetime import date, timedelta
+from itertools import accumulate, islice
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from faker import Faker
-import random
-from datetime import timedelta
+
 from library.models import Library, Book, Genre, Member, Loan
+from library.rollups import rebuild_rollups
+from library.search import drop_search_triggers, install_search_triggers
+from library.signals import bulk_changed
+
+
+GENRE_MAP = {
+    "Русская классика": [
+        "Преступление и наказание",
+        "Мастер и Маргарита",
+        "Война и мир",
+        "Анна Каренина",
+        "Идиот",
+        "Обломов",
+        "Отцы и дети",
+        "Евгений Онегин",
+        "Герой нашего времени",
+        "Доктор Живаго",
+        "Белая гвардия",
+        "Собачье сердце",
+        "Мёртвые души",
+    ],
+    "Фантастика": [
+        "Пикник на обочине",
+        "Трудно быть богом",
+        "Мы",
+        "1984",
+        "Человек-амфибия",
+    ],
+    "Приключения": [
+        "Три мушкетёра",
+        "Граф Монте-Кристо",
+        "Золотой телёнок",
+        "Двенадцать стульев",
+    ],
+}
+
+LIBRARIES_DATA = [
+    ("ИОГУНБ им. Молчанова-Сибирского", "ул. Лермонтова, 253"),
+    ("ЦГБ им. Потаниной", "ул. Урицкого, 32"),
+    ("Детская библиотека им. Маршака", "ул. Ленина, 23"),
+    ("Библиотека им. Чехова", "ул. Рабочего Штаба, 10"),
+    ("Библиотека №4 им. Некрасова", "ул. Красногвардейская, 18"),
+]
+
+HISTORY_DAYS = 730
+# a few books and readers account for most of the loans: index = n * random() ** skew
+BOOK_POPULARITY_SKEW = 3.0
+MEMBER_ACTIVITY_SKEW = 2.0
+# share of loans that are never returned, on top of the ones still within their loan period
+LOST_SHARE = 0.03
+LOAN_INDEX_REBUILD_THRESHOLD = 100_000
+
+_worker = {}
+
+
+def init_loan_worker(libraries, seed, today):
+    # libraries: [(book_ids, member_ids)] of the libraries that have both
+    _worker['libraries'] = libraries
+    _worker['cum_weights'] = list(accumulate(len(book_ids) for book_ids, _ in libraries))
+    _worker['seed'] = seed
+    _worker['today'] = today
+
+
+def generate_loan_chunk(task):
+    chunk_index, size = task
+    # every chunk has its own seed, so the output doesn't depend on the number of workers
+    rng = random.Random(f"{_worker['seed']}:{chunk_index}")
+    libraries = _worker['libraries']
+    cum_weights = _worker['cum_weights']
+    total = cum_weights[-1]
+    today = _worker['today']
+
+    rows = []
+    for _ in range(size):
+        book_ids, member_ids = libraries[bisect(cum_weights, rng.random() * total)]
+        book_id = book_ids[int(len(book_ids) * rng.random() ** BOOK_POPULARITY_SKEW)]
+        member_id = member_ids[int(len(member_ids) * rng.random() ** MEMBER_ACTIVITY_SKEW)]
+
+        # random() is several times cheaper than randrange(), which adds up over millions of rows
+        loan_date = today - timedelta(days=int(HISTORY_DAYS * rng.random()))
+        return_date = loan_date + timedelta(days=3 + int(58 * rng.random()))
+        if return_date > today or rng.random() < LOST_SHARE:
+            return_date = None
+
+        rows.append((book_id, member_id, loan_date.isoformat(), return_date and return_date.isoformat()))
+    return rows
+
+
+def insert_rows(model, fields, rows, batch_size, progress=None):
+    # bulk_create without building a model instance per row, one transaction per batch
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+    rows = iter(rows)
+    inserted = 0
+    while batch := list(islice(rows, batch_size)):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        inserted += len(batch)
+        if progress is not None:
+            progress(inserted)
 
 
 class Command(BaseCommand):
     help = "Генерирует реалистичные тестовые данные для библиотек Иркутска"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--libraries', type=int, help="Режим нагрузочного теста: количество библиотек")
+        parser.add_argument('--books', type=int, help="Количество книг")
+        parser.add_argument('--members', type=int, help="Количество читателей")
+        parser.add_argument('--loans', type=int, help="Количество выдач")
+        parser.add_argument('--seed', type=int, help="Зерно генератора для воспроизводимых данных")
+        parser.add_argument('--batch-size', type=int, default=10_000, help="Строк в одной транзакции")
+        parser.add_argument('--workers', type=int, default=1, help="Процессов для генерации выдач")
+
     def handle(self, *args, **options):
-        fake = Faker("ru_RU")
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker("ru_RU")
+        if options['seed'] is not None:
+            self.fake.seed_instance(options['seed'])
+        self.seed = options['seed'] if options['seed'] is not None else self.rng.randrange(2 ** 32)
+        self.batch_size = options['batch_size']
+        self.workers = max(1, options['workers'])
 
-        # ------------------------------
-        # 1. Жанры
-        # ------------------------------
-        genre_map = {
-            "Русская классика": [
-                "Преступление и наказание",
-                "Мастер и Маргарита",
-                "Война и мир",
-                "Анна Каренина",
-                "Идиот",
-                "Обломов",
-                "Отцы и дети",
-                "Евгений Онегин",
-                "Герой нашего времени",
-                "Доктор Живаго",
-                "Белая гвардия",
-                "Собачье сердце",
-                "Мёртвые души",
-            ],
-            "Фантастика": [
-                "Пикник на обочине",
-                "Трудно быть богом",
-                "Мы",
-                "1984",
-                "Человек-амфибия",
-            ],
-            "Приключения": [
-                "Три мушкетёра",
-                "Граф Монте-Кристо",
-                "Золотой телёнок",
-                "Двенадцать стульев",
-            ],
-        }
-
-        for name in genre_map.keys():
-            Genre.objects.get_or_create(name=name)
-        genres = list(Genre.objects.all())
+        scaled = any(options[name] is not None for name in ('libraries', 'books', 'members', 'loans'))
+        started = time.perf_counter()
+
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # a throwaway load: no fsync per batch, and the index pages being written stay in memory
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA synchronous = OFF")
+                cursor.execute("PRAGMA cache_size = -262144")
+
+        # the full-text index is refilled once at the end instead of row by row by its triggers
+        drop_search_triggers()
+        try:
+            if scaled:
+                self.generate_scaled(options)
+            else:
+                self.generate_demo()
+        finally:
+            install_search_triggers(rebuild=True)
+
+        self.refresh_derived_data()
+        self.stdout.write(self.style.SUCCESS(f"✨ ГЕНЕРАЦИЯ УСПЕШНА за {time.perf_counter() - started:.1f} с"))
 
+    def generate_demo(self):
         # ------------------------------
-        # 2. Библиотеки Иркутска
+        # 1. Жанры и библиотеки Иркутска
         # ------------------------------
-        libraries_data = [
-            ("ИОГУНБ им. Молчанова-Сибирского", "ул. Лермонтова, 253"),
-            ("ЦГБ им. Потаниной", "ул. Урицкого, 32"),
-            ("Детская библиотека им. Маршака", "ул. Ленина, 23"),
-            ("Библиотека им. Чехова", "ул. Рабочего Штаба, 10"),
-            ("Библиотека №4 им. Некрасова", "ул. Красногвардейская, 18"),
-        ]
-
-        for name, address in libraries_data:
+        genres = {name: Genre.objects.get_or_create(name=name)[0].pk for name in GENRE_MAP.keys()}
+
+        for name, address in LIBRARIES_DATA:
             Library.objects.get_or_create(name=name, address=address)
 
-        libraries = list(Library.objects.all())
+        library_ids = list(Library.objects.values_list('id', flat=True))
         self.stdout.write(self.style.SUCCESS("📚 Библиотеки готовы."))
 
         # ------------------------------
-        # 3. Книги
+        # 2. Книги и читатели
         # ------------------------------
         if Book.objects.count() < 800:
-            for genre_name, titles in genre_map.items():
-                genre = Genre.objects.get(name=genre_name)
-                for library in libraries:
-                    for _ in range(random.randint(10, 25)):
-                        Book.objects.create(
-                            title=random.choice(titles),
-                            genre=genre,
-                            library=library,
-                        )
-
+            insert_rows(Book, ['title', 'genre', 'library', 'is_available'], (
+                (self.rng.choice(titles), genres[genre_name], library_id, True)
+                for genre_name, titles in GENRE_MAP.items()
+                for library_id in library_ids
+                for _ in range(self.rng.randint(10, 25))
+            ), self.batch_size)
             self.stdout.write(self.style.SUCCESS("📘 Книги созданы."))
 
-        books = list(Book.objects.all())
-
-        # ------------------------------
-        # 4. Читатели
-        # ------------------------------
         if Member.objects.count() < 200:
-            for _ in range(200):
-                Member.objects.create(
-                    first_name=fake.name(),
-                    library=random.choice(libraries),
-                )
-
-        members = list(Member.objects.all())
+            insert_rows(Member, ['first_name', 'library'], (
+                (self.fake.name(), self.rng.choice(library_ids)) for _ in range(200)
+            ), self.batch_size)
         self.stdout.write(self.style.SUCCESS("🧍 Читатели готовы."))
 
         # ------------------------------
-        # 5. Реалистичные выдачи
+        # 3. Реалистичные выдачи
         # ------------------------------
         if Loan.objects.count() < 1000:
-            for _ in range(1000):
+            self.generate_loans(1000)
+        self.stdout.write(self.style.SUCCESS("🎉 Выдачи созданы!"))
 
-                library = random.choice(libraries)
-                library_books = [b for b in books if b.library == library]
-                library_members = [m for m in members if m.library == library]
+    def generate_scaled(self, options):
+        genres = [(Genre.objects.get_or_create(name=name)[0].pk, titles) for name, titles in GENRE_MAP.items()]
 
-                if not library_books or not library_members:
-                    continue
+        library_count = options['libraries'] or len(LIBRARIES_DATA)
+        Library.objects.bulk_create(
+            Library(name=f"Библиотека №{i + 1}", address=self.fake.street_address()) for i in range(library_count)
+        )
+        library_ids = list(Library.objects.order_by('-id').values_list('id', flat=True)[:library_count])
+        self.stdout.write(self.style.SUCCESS(f"📚 Библиотек: {library_count}"))
 
-                book = random.choice(library_books)
-                member = random.choice(library_members)
+        book_count = options['books'] if options['books'] is not None else 1000 * library_count
+        insert_rows(Book, ['title', 'genre', 'library', 'is_available'], (
+            (self.rng.choice(titles), genre_id, self.rng.choice(library_ids), True)
+            for genre_id, titles in (self.rng.choice(genres) for _ in range(book_count))
+        ), self.batch_size)
+        self.stdout.write(self.style.SUCCESS(f"📘 Книг: {book_count}"))
 
-                loan_date = fake.date_between(start_date="-2y", end_date="today")
+        member_count = options['members'] if options['members'] is not None else 200 * library_count
+        # a pool of names is much cheaper than asking Faker for every reader
+        first_names = [self.fake.first_name() for _ in range(500)]
+        last_names = [self.fake.last_name() for _ in range(500)]
+        insert_rows(Member, ['first_name', 'library'], (
+            (f"{self.rng.choice(first_names)} {self.rng.choice(last_names)}", self.rng.choice(library_ids))
+            for _ in range(member_count)
+        ), self.batch_size)
+        self.stdout.write(self.style.SUCCESS(f"🧍 Читателей: {member_count}"))
 
-                return_date = None
-                if random.random() < 0.4:
-                    return_date = loan_date + timedelta(days=random.randint(3, 60))
+        loan_count = options['loans'] if options['loans'] is not None else 10 * member_count
+        self.generate_loans(loan_count)
+        self.stdout.write(self.style.SUCCESS(f"🎉 Выдач: {loan_count}"))
 
-                Loan.objects.create(
-                    book=book,
-                    member=member,
-                    loan_date=loan_date,
-                    return_date=return_date,
-                )
+    def library_index(self):
+        # per-library id lists built once, instead of scanning all books for every loan
+        books = {}
+        members = {}
+        for library_id, book_id in Book.objects.values_list('library_id', 'id').iterator(chunk_size=self.batch_size):
+            books.setdefault(library_id, []).append(book_id)
+        for library_id, member_id in Member.objects.values_list('library_id', 'id').iterator(chunk_size=self.batch_size):
+            members.setdefault(library_id, []).append(member_id)
 
-        self.stdout.write(self.style.SUCCESS("🎉 Выдачи созданы!"))
-        self.stdout.write(self.style.SUCCESS("✨ ГЕНЕРАЦИЯ УСПЕШНА"))
+        libraries = []
+        for library_id in sorted(books.keys() & members.keys()):
+            # popularity must not follow the insertion order
+            self.rng.shuffle(books[library_id])
+            self.rng.shuffle(members[library_id])
+            libraries.append((books[library_id], members[library_id]))
+        return libraries
+
+    def generate_loans(self, count):
+        libraries = self.library_index()
+        if not libraries or count <= 0:
+            return
+
+        tasks = [(index, min(self.batch_size, count - start)) for index, start in enumerate(range(0, count, self.batch_size))]
+        initargs = (libraries, self.seed, date.today())
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers, initializer=init_loan_worker, initargs=initargs)
+            chunks = pool.imap(generate_loan_chunk, tasks)
+        else:
+            pool = None
+            init_loan_worker(*initargs)
+            chunks = map(generate_loan_chunk, tasks)
+
+        def progress(done):
+            if done % (self.batch_size * 50) < self.batch_size or done == count:
+                self.stderr.write(f"  выдач: {done}/{count}")
+
+        # a large load is cheaper to index once at the end than row by row
+        rebuild_indexes = count >= LOAN_INDEX_REBUILD_THRESHOLD and not connection.in_atomic_block
+        try:
+            if rebuild_indexes:
+                with connection.schema_editor() as editor:
+                    for index in Loan._meta.indexes:
+                        editor.remove_index(Loan, index)
+            # SQLite has a single writer, so the workers only generate rows and this process inserts them
+            insert_rows(
+                Loan, ['book', 'member', 'loan_date', 'return_date'],
+                (row for rows in chunks for row in rows), self.batch_size, progress,
+            )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if rebuild_indexes:
+                with connection.schema_editor() as editor:
+                    for index in Loan._meta.indexes:
+                        editor.add_index(Loan, index)
+
+    def refresh_derived_data(self):
+        # bulk inserts skip the model signals that keep these up to date
+        Book.objects.refresh_availability()
+        rebuild_rollups()
+        bulk_changed.send(sender=Library, instances=None)
+        bulk_changed.send(sender=Book, instances=None)
+        bulk_changed.send(sender=Member, instances=None)
+        bulk_changed.send(sender=Loan, instances=None)
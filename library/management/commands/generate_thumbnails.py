@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from library.models import Book, Member
+from library.thumbnails import THUMBNAILS, thumbnail_name, update_thumbnail
+from library.versions import bump_version
+
+
+MODELS = {'books': Book, 'members': Member}
+
+
+class Command(BaseCommand):
+    help = "Создаёт миниатюры обложек книг и фото читателей, которых ещё нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=list(MODELS), action='append', help="Только книги или только читатели, можно несколько")
+        parser.add_argument('--force', action='store_true', help="Пересоздать все миниатюры, например после смены размера")
+
+    def handle(self, *args, **options):
+        for key in options['model'] or list(MODELS):
+            model = MODELS[key]
+            source_field, thumb_field = THUMBNAILS[model]
+            queryset = model.objects.exclude(**{f'{source_field}__isnull': True}).exclude(**{source_field: ''}).only(
+                'pk', source_field, thumb_field
+            )
+
+            created = failed = 0
+            for instance in queryset.iterator(chunk_size=1000):
+                current = getattr(instance, thumb_field).name == thumbnail_name(getattr(instance, source_field).name)
+                if current and not options['force']:
+                    continue
+                if update_thumbnail(instance, force=options['force']):
+                    created += 1
+                else:
+                    failed += 1
+
+            if created:
+                # written with update(), the API's ETags only learn about it from the version
+                bump_version(model)
+            self.stdout.write(f"{key}: создано {created}, не удалось {failed}")
+        self.stdout.write(self.style.SUCCESS("Миниатюры готовы."))
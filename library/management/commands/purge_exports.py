@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from library.export_jobs import purge_expired_jobs
+
+
+class Command(BaseCommand):
+    help = "Удаляет устаревшие файлы выгрузок"
+
+    def handle(self, *args, **options):
+        purged = purge_expired_jobs()
+        self.stdout.write(self.style.SUCCESS(f"Удалено выгрузок: {purged}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from library.rollups import rebuild_rollups
+from library.stats_cache import invalidate_stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицы статистики выдач по библиотекам, жанрам, книгам и читателям"
+
+    def handle(self, *args, **options):
+        counts = rebuild_rollups()
+        invalidate_stats()
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(self.style.SUCCESS("Статистика пересчитана."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from library.search import install_search_triggers, search_table_exists
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс книг и восстанавливает его триггеры"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' or not search_table_exists():
+            raise CommandError("Полнотекстовый индекс доступен только для SQLite после применения миграций.")
+
+        install_search_triggers(rebuild=True)
+        self.stdout.write(self.style.SUCCESS("Индекс поиска перестроен."))
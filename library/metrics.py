@@ -0,0 +1,324 @@
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+from library.timing import request_timings
+
+
+FLUSH_INTERVAL = 1.0
+TOTALS_FILE = 'totals.json'
+LOCK_FILE = 'compact.lock'
+LOCK_STALE_AFTER = 60
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help)
+METRICS = {
+    'library_http_requests_total': ('counter', 'API requests by endpoint and status.'),
+    'library_http_request_duration_seconds': ('histogram', 'API request latency by endpoint.'),
+    'library_http_requests_in_flight': ('gauge', 'API requests being processed right now.'),
+    'library_db_queries_total': ('counter', 'SQL queries run while handling API requests.'),
+    'library_cache_requests_total': ('counter', 'Cache lookups by cache and result.'),
+    'library_cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits.'),
+    'library_export_bytes_total': ('counter', 'Bytes of export files produced.'),
+}
+
+
+def metrics_dir():
+    return Path(getattr(settings, 'METRICS_DIR', Path(tempfile.gettempdir()) / 'library-metrics'))
+
+
+def label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # exists but belongs to someone else, or the platform can't tell
+        return True
+    return True
+
+
+class ProcessMetrics:
+    """Metrics of the current process, flushed to their own file in metrics_dir().
+
+    Every worker process writes only its file, the endpoint sums them all up. Counters of
+    finished processes keep counting towards the totals, folded into TOTALS_FILE when the
+    next process starts, gauges only come from live ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def ensure_process(self):
+        # a forked worker must not report the counts it inherited from its parent
+        if self.pid != os.getpid():
+            self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # the random part keeps a reused pid from overwriting a finished process
+        self.filename = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.gauges = defaultdict(lambda: defaultdict(float))
+        self.histograms = defaultdict(dict)
+        self.flushed_at = 0.0
+        compact_finished_processes()
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.ensure_process()
+            self.counters[name][label_key(labels)] += value
+        self.maybe_flush()
+
+    def add_gauge(self, name, value, **labels):
+        with self.lock:
+            self.ensure_process()
+            self.gauges[name][label_key(labels)] += value
+        self.maybe_flush()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self.lock:
+            self.ensure_process()
+            series = self.histograms[name].setdefault(
+                label_key(labels), {'buckets': [0] * len(buckets), 'le': list(buckets), 'sum': 0.0, 'count': 0}
+            )
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.ensure_process()
+            self.flushed_at = time.monotonic()
+            directory = metrics_dir()
+            directory.mkdir(parents=True, exist_ok=True)
+            write_store(directory / self.filename, {
+                'pid': self.pid,
+                'counters': self.counters,
+                'gauges': self.gauges,
+                'histograms': self.histograms,
+            })
+
+
+process_metrics = ProcessMetrics()
+
+
+@atexit.register
+def flush_at_exit():
+    # whatever happened since the last periodic flush
+    if process_metrics.pid == os.getpid() and (process_metrics.counters or process_metrics.histograms):
+        process_metrics.flush()
+
+
+def inc(name, value=1, **labels):
+    process_metrics.inc(name, value, **labels)
+
+
+def add_gauge(name, value, **labels):
+    process_metrics.add_gauge(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    process_metrics.observe(name, value, **labels)
+
+
+def record_cache_lookup(cache_name, hit):
+    inc('library_cache_requests_total', cache=cache_name, result='hit' if hit else 'miss')
+
+
+def read_store(path):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def merge_store(counters, histograms, data):
+    for name, series in data['counters'].items():
+        for key, value in series.items():
+            counters[name][key] += value
+    for name, series in data['histograms'].items():
+        for key, value in series.items():
+            total = histograms[name].setdefault(key, {**value, 'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+            total['sum'] += value['sum']
+            total['count'] += value['count']
+
+
+def write_store(path, data):
+    # readers never see a half written file
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    os.replace(temporary, path)
+
+
+def compact_finished_processes():
+    """Folds the files of dead processes into TOTALS_FILE, so recycled workers don't pile up.
+
+    Runs when a process starts recording. A lock file keeps two processes from adding the
+    same file to the totals twice, whoever finds it taken just skips the compaction.
+    """
+    directory = metrics_dir()
+    if not directory.is_dir():
+        return
+    lock = directory / LOCK_FILE
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        try:
+            # a compaction that died half way must not block all the later ones
+            if time.time() - lock.stat().st_mtime > LOCK_STALE_AFTER:
+                lock.unlink()
+        except FileNotFoundError:
+            pass
+        return
+
+    try:
+        finished = []
+        for path in directory.glob('*.json'):
+            if path.name == TOTALS_FILE:
+                continue
+            data = read_store(path)
+            if data is not None and not process_alive(data['pid']):
+                finished.append((path, data))
+        if not finished:
+            return
+
+        counters = defaultdict(lambda: defaultdict(float))
+        histograms = defaultdict(dict)
+        totals = read_store(directory / TOTALS_FILE)
+        if totals is not None:
+            merge_store(counters, histograms, totals)
+        for _, data in finished:
+            merge_store(counters, histograms, data)
+        write_store(directory / TOTALS_FILE, {'pid': None, 'counters': counters, 'gauges': {}, 'histograms': histograms})
+        for path, _ in finished:
+            path.unlink(missing_ok=True)
+    finally:
+        lock.unlink(missing_ok=True)
+
+
+def collect():
+    process_metrics.flush()
+    counters = defaultdict(lambda: defaultdict(float))
+    gauges = defaultdict(lambda: defaultdict(float))
+    histograms = defaultdict(dict)
+
+    for path in metrics_dir().glob('*.json'):
+        data = read_store(path)
+        if data is None:
+            continue
+        merge_store(counters, histograms, data)
+        # the totals of finished processes have no pid, and no gauges
+        if data['pid'] is not None and process_alive(data['pid']):
+            for name, series in data['gauges'].items():
+                for key, value in series.items():
+                    gauges[name][key] += value
+
+    for cache_name, results in cache_lookups(counters).items():
+        total = results.get('hit', 0) + results.get('miss', 0)
+        gauges['library_cache_hit_ratio'][label_key({'cache': cache_name})] = results.get('hit', 0) / total if total else 0
+
+    return counters, gauges, histograms
+
+
+def cache_lookups(counters):
+    # cache: {'hit': n, 'miss': n}
+    lookups = defaultdict(dict)
+    for key, value in counters['library_cache_requests_total'].items():
+        labels = dict(json.loads(key))
+        lookups[labels['cache']][labels['result']] = value
+    return lookups
+
+
+def cache_lookup_counts(cache_name):
+    """Hits and misses of one cache, summed over all worker processes."""
+    counters, _, _ = collect()
+    results = cache_lookups(counters).get(cache_name, {})
+    return int(results.get('hit', 0)), int(results.get('miss', 0))
+
+
+def format_labels(key, **extra):
+    labels = [*json.loads(key), *extra.items()]
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_metrics():
+    counters, gauges, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for key, series in sorted(histograms[name].items()):
+                for bound, count in zip(series['le'], series['buckets']):
+                    lines.append(f'{name}_bucket{format_labels(key, le=format_value(bound))} {count}')
+                lines.append(f'{name}_bucket{format_labels(key, le="+Inf")} {series["count"]}')
+                lines.append(f'{name}_sum{format_labels(key)} {format_value(series["sum"])}')
+                lines.append(f'{name}_count{format_labels(key)} {series["count"]}')
+        else:
+            values = counters[name] if kind == 'counter' else gauges[name]
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{format_labels(key)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def endpoint_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = match.func
+    actions = getattr(view, 'actions', None)
+    if actions:
+        # viewset routes: basename.action, e.g. loan.stats
+        return f"{view.initkwargs.get('basename')}.{actions.get(request.method.lower(), request.method.lower())}"
+    return match.view_name or 'other'
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        add_gauge('library_http_requests_in_flight', 1)
+        started = time.perf_counter()
+        try:
+            with request_timings() as timings:
+                response = self.get_response(request)
+        finally:
+            add_gauge('library_http_requests_in_flight', -1)
+
+        endpoint = endpoint_label(request)
+        observe('library_http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+        inc('library_http_requests_total', endpoint=endpoint, status=str(response.status_code))
+        inc('library_db_queries_total', timings.queries, endpoint=endpoint)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def fill_is_available(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Loan = apps.get_model('library', 'Loan')
+    open_loans = Loan.objects.filter(book=OuterRef('pk'), return_date__isnull=True)
+    Book.objects.update(is_available=~Exists(open_loans))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0021_remove_userprofile_otp_confirmed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='is_available',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Доступна'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['book'], name='loan_open_book_idx'),
+        ),
+        migrations.RunPython(fill_is_available, migrations.RunPython.noop),
+    ]
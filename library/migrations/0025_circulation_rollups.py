@@ -0,0 +1,96 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_rollups(apps, schema_editor):
+    # frozen here on purpose: library.rollups may change, what this migration did must not
+    Library = apps.get_model('library', 'Library')
+    Genre = apps.get_model('library', 'Genre')
+    Book = apps.get_model('library', 'Book')
+    Loan = apps.get_model('library', 'Loan')
+    loan_counts = dict(loan_count=Count('id'), open_loan_count=Count('id', filter=Q(return_date__isnull=True)))
+
+    def grouped(queryset, key, **aggregates):
+        return {row.pop(key): row for row in queryset.order_by().values(key).annotate(**aggregates)}
+
+    for owner, key, rollup in ((Library, 'library_id', 'LibraryCirculation'), (Genre, 'genre_id', 'GenreCirculation')):
+        model = apps.get_model('library', rollup)
+        books = grouped(Book.objects.all(), key, book_count=Count('id'))
+        loans = grouped(Loan.objects.all(), f'book__{key}', **loan_counts)
+        model.objects.bulk_create(
+            (model(pk=pk, **books.get(pk, {}), **loans.get(pk, {})) for pk in owner.objects.values_list('pk', flat=True).iterator()),
+            batch_size=1000,
+        )
+
+    for key, rollup in (('book_id', 'BookCirculation'), ('member_id', 'MemberCirculation')):
+        model = apps.get_model('library', rollup)
+        rows = Loan.objects.order_by().values(key).annotate(**loan_counts).iterator()
+        model.objects.bulk_create((model(pk=row.pop(key), **row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0024_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCirculation',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation', serialize=False, to='library.book')),
+                ('loan_count', models.IntegerField(default=0, verbose_name='Выдач')),
+                ('open_loan_count', models.IntegerField(default=0, verbose_name='На руках')),
+            ],
+            options={
+                'verbose_name': 'Статистика книги',
+                'verbose_name_plural': 'Статистика книг',
+                'indexes': [models.Index(fields=['-loan_count'], name='book_circ_loans_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GenreCirculation',
+            fields=[
+                ('genre', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation', serialize=False, to='library.genre')),
+                ('book_count', models.IntegerField(default=0, verbose_name='Книг')),
+                ('loan_count', models.IntegerField(default=0, verbose_name='Выдач')),
+                ('open_loan_count', models.IntegerField(default=0, verbose_name='Книг на руках')),
+            ],
+            options={
+                'verbose_name': 'Статистика жанра',
+                'verbose_name_plural': 'Статистика жанров',
+                'indexes': [models.Index(fields=['-book_count'], name='genre_circ_books_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LibraryCirculation',
+            fields=[
+                ('library', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation', serialize=False, to='library.library')),
+                ('book_count', models.IntegerField(default=0, verbose_name='Книг')),
+                ('loan_count', models.IntegerField(default=0, verbose_name='Выдач')),
+                ('open_loan_count', models.IntegerField(default=0, verbose_name='Книг на руках')),
+            ],
+            options={
+                'verbose_name': 'Статистика библиотеки',
+                'verbose_name_plural': 'Статистика библиотек',
+                'indexes': [models.Index(fields=['-loan_count'], name='library_circ_loans_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MemberCirculation',
+            fields=[
+                ('member', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation', serialize=False, to='library.member')),
+                ('loan_count', models.IntegerField(default=0, verbose_name='Выдач')),
+                ('open_loan_count', models.IntegerField(default=0, verbose_name='Книг на руках')),
+            ],
+            options={
+                'verbose_name': 'Статистика читателя',
+                'verbose_name_plural': 'Статистика читателей',
+                'indexes': [models.Index(fields=['-loan_count'], name='member_circ_loans_idx')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
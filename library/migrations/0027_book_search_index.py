@@ -0,0 +1,60 @@
+from django.db import migrations
+
+
+# the SQL as it was when the index was introduced, library.search may move on without it
+CREATE_SQL = [
+    # remove_diacritics 0 keeps "й" apart from "и"; "ё" is folded into "е" by hand instead
+    """
+    CREATE VIRTUAL TABLE library_book_fts USING fts5(
+        title, genre, library,
+        tokenize = 'unicode61 remove_diacritics 0',
+        prefix = '3 4'
+    )
+    """,
+    "INSERT INTO library_book_fts(library_book_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 1.0)')",
+    """
+    INSERT INTO library_book_fts(rowid, title, genre, library)
+    SELECT b.id, replace(replace(b.title, 'ё', 'е'), 'Ё', 'Е'), replace(replace(g.name, 'ё', 'е'), 'Ё', 'Е'),
+           replace(replace(l.name, 'ё', 'е'), 'Ё', 'Е')
+    FROM library_book b
+    JOIN library_genre g ON g.id = b.genre_id
+    JOIN library_library l ON l.id = b.library_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS library_library_fts_update",
+    "DROP TRIGGER IF EXISTS library_genre_fts_update",
+    "DROP TRIGGER IF EXISTS library_book_fts_delete",
+    "DROP TRIGGER IF EXISTS library_book_fts_update",
+    "DROP TRIGGER IF EXISTS library_book_fts_insert",
+    "DROP TABLE IF EXISTS library_book_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # other backends fall back to icontains in BookQuerySet.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # the triggers are installed by the post_migrate handler in library.signals: later
+    # migrations that rebuild library_book in the same run would fail with them in place
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0026_loan_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0029_table_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_thumb',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='books', verbose_name='Миниатюра обложки'),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='photo_thumb',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='members', verbose_name='Миниатюра фото'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:55
+
+import pyotp
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0031_list_ordering_indexes'),
+    ]
+
+    # UserProfile.totp_key has had this default in the model since before 0022 without a
+    # migration for it; defaults are applied by Django, so nothing changes in the database
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='totp_key',
+            field=models.CharField(blank=True, default=pyotp.random_hex, max_length=128, null=True),
+        ),
+    ]
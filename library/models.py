@@ -1,9 +1,14 @@
-from django.db import models
+import uuid
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 import pyotp
 
+from library.search import fallback_filter, fts_available, match_expression, matching_ids_sql
+
 
 # Create your models here.
 class Genre(models.Model):
@@ -13,6 +18,8 @@ class Genre(models.Model):
     class Meta:
         verbose_name = "Жанр"
         verbose_name_plural = "Жанры"
+        # the API pages genres by (name, id)
+        indexes = [models.Index(fields=['name', 'id'], name='genre_name_id_idx')]
 
     def __str__(self) -> str:
         return self.name
@@ -25,32 +32,67 @@ class Library(models.Model):
     class Meta:
         verbose_name = "Библиотека"
         verbose_name_plural = "Библиотеки"
+        # the API pages libraries by (name, id)
+        indexes = [models.Index(fields=['name', 'id'], name='library_name_id_idx')]
 
     def __str__(self) -> str:
         return self.name
 
 
+class BookQuerySet(models.QuerySet):
+    def refresh_availability(self):
+        open_loans = Loan.objects.filter(book=OuterRef('pk'), return_date__isnull=True)
+        return self.update(is_available=~Exists(open_loans))
+
+    def availability_mismatches(self):
+        open_loans = Loan.objects.filter(book=OuterRef('pk'), return_date__isnull=True)
+        return self.alias(has_open_loan=Exists(open_loans)).filter(
+            Q(is_available=True, has_open_loan=True) | Q(is_available=False, has_open_loan=False)
+        )
+
+    def search(self, text, column=None):
+        if match_expression(text) is None:
+            return self.none()
+        if not fts_available():
+            return self.filter(fallback_filter(text, column))
+        sql, params = matching_ids_sql(text, column)
+        return self.filter(id__in=RawSQL(sql, params))
+
+
 class Book(models.Model):
     title = models.TextField("Название книги")
     genre = models.ForeignKey(Genre, on_delete=models.CASCADE, verbose_name="Жанр")
     library = models.ForeignKey(Library, on_delete=models.CASCADE, verbose_name="Библиотека")
     cover = models.ImageField("Обложка", upload_to="books", null=True, blank=True)
+    cover_thumb = models.ImageField("Миниатюра обложки", upload_to="books", null=True, blank=True, editable=False)
+    is_available = models.BooleanField("Доступна", default=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
+        indexes = [
+            # partial, because Django filters booleans as a bare column and SQLite only matches that against a condition
+            models.Index(fields=['library'], condition=Q(is_available=True), name='book_library_available_idx'),
+            models.Index(fields=['genre'], condition=Q(is_available=True), name='book_genre_available_idx'),
+            models.Index(fields=['id'], condition=Q(is_available=False), name='book_borrowed_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.title
-    
-    def is_available(self):
-        return not Loan.objects.filter(book=self, return_date__isnull=True).exists()
+
+    def save(self, *args, **kwargs):
+        # circulation rollups are maintained by the Book signals, keep them in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class Member(models.Model):
     first_name = models.TextField("Имя")
     library = models.ForeignKey(Library, on_delete=models.CASCADE, verbose_name="Библиотека")
     photo = models.ImageField("Фото", upload_to="members", null=True, blank=True)
+    photo_thumb = models.ImageField("Миниатюра фото", upload_to="members", null=True, blank=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Пользователь")
 
     class Meta:
@@ -62,8 +104,10 @@ class Member(models.Model):
 
 
 class Loan(models.Model):
-    book = models.ForeignKey(Book, on_delete=models.CASCADE, verbose_name="Книга")
-    member = models.ForeignKey(Member, on_delete=models.CASCADE, verbose_name="Читатель")
+    # looked up through loan_book_date_idx, which also serves plain book filters
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, verbose_name="Книга", db_index=False)
+    # looked up through loan_member_date_idx, which also serves plain member filters
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, verbose_name="Читатель", db_index=False)
     loan_date = models.DateField("Дата выдачи")
     return_date = models.DateField(null=True, blank=True, verbose_name="Дата возврата")
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Пользователь")
@@ -71,10 +115,116 @@ class Loan(models.Model):
     class Meta:
         verbose_name = "Выдача книги"
         verbose_name_plural = "Выдачи книг"
+        indexes = [
+            models.Index(fields=['book'], condition=Q(return_date__isnull=True), name='loan_open_book_idx'),
+            models.Index(fields=['loan_date', 'id'], name='loan_date_id_idx'),
+            models.Index(fields=['member'], condition=Q(return_date__isnull=True), name='loan_open_member_idx'),
+            models.Index(fields=['member', 'loan_date', 'id'], name='loan_member_date_idx'),
+            models.Index(fields=['return_date'], condition=Q(return_date__isnull=False), name='loan_returned_idx'),
+            models.Index(fields=['book', 'loan_date', 'id'], name='loan_book_date_idx'),
+            models.Index(fields=['loan_date', 'id'], condition=Q(return_date__isnull=True), name='loan_open_date_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.book} → {self.member}"
 
+    def save(self, *args, **kwargs):
+        # Book.is_available and the rollups are maintained by the Loan signals, keep them in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class LibraryCirculation(models.Model):
+    library = models.OneToOneField(Library, on_delete=models.CASCADE, primary_key=True, related_name='circulation')
+    book_count = models.IntegerField("Книг", default=0)
+    loan_count = models.IntegerField("Выдач", default=0)
+    open_loan_count = models.IntegerField("Книг на руках", default=0)
+
+    class Meta:
+        verbose_name = "Статистика библиотеки"
+        verbose_name_plural = "Статистика библиотек"
+        indexes = [models.Index(fields=['-loan_count'], name='library_circ_loans_idx')]
+
+
+class GenreCirculation(models.Model):
+    genre = models.OneToOneField(Genre, on_delete=models.CASCADE, primary_key=True, related_name='circulation')
+    book_count = models.IntegerField("Книг", default=0)
+    loan_count = models.IntegerField("Выдач", default=0)
+    open_loan_count = models.IntegerField("Книг на руках", default=0)
+
+    class Meta:
+        verbose_name = "Статистика жанра"
+        verbose_name_plural = "Статистика жанров"
+        indexes = [models.Index(fields=['-book_count'], name='genre_circ_books_idx')]
+
+
+class BookCirculation(models.Model):
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='circulation')
+    loan_count = models.IntegerField("Выдач", default=0)
+    open_loan_count = models.IntegerField("На руках", default=0)
+
+    class Meta:
+        verbose_name = "Статистика книги"
+        verbose_name_plural = "Статистика книг"
+        indexes = [models.Index(fields=['-loan_count'], name='book_circ_loans_idx')]
+
+
+class MemberCirculation(models.Model):
+    member = models.OneToOneField(Member, on_delete=models.CASCADE, primary_key=True, related_name='circulation')
+    loan_count = models.IntegerField("Выдач", default=0)
+    open_loan_count = models.IntegerField("Книг на руках", default=0)
+
+    class Meta:
+        verbose_name = "Статистика читателя"
+        verbose_name_plural = "Статистика читателей"
+        indexes = [models.Index(fields=['-loan_count'], name='member_circ_loans_idx')]
+
+
+class ExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
+    name = models.CharField("Выгрузка", max_length=64)
+    file_type = models.CharField("Формат", max_length=16)
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    rows_total = models.PositiveIntegerField("Всего строк", null=True, blank=True)
+    rows_done = models.PositiveIntegerField("Готово строк", default=0)
+    file = models.FileField("Файл", upload_to="exports", null=True, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+    finished_at = models.DateTimeField("Завершена", null=True, blank=True)
+    expires_at = models.DateTimeField("Удалить после", null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+        # newest first, for admins and for each user's own jobs
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='exportjob_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='exportjob_user_created_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name}.{self.file_type} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, int(self.rows_done * 100 / self.rows_total))
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -97,4 +247,16 @@ class UserProfile(models.Model):
     @receiver(post_save, sender=User)
     def create_user_profile(sender, instance, created, **kwargs):
         if created:
-            UserProfile.objects.create(user=instance)
\ No newline at end of file
+            UserProfile.objects.create(user=instance)
+
+class TableVersion(models.Model):
+    # bumped by the signals on every write, list and retrieve ETags are built from these
+    table = models.CharField("Таблица", max_length=100, primary_key=True)
+    version = models.BigIntegerField("Версия", default=0)
+
+    class Meta:
+        verbose_name = "Версия таблицы"
+        verbose_name_plural = "Версии таблиц"
+
+    def __str__(self) -> str:
+        return f"{self.table}: {self.version}"
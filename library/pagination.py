@@ -0,0 +1,128 @@
+import json
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+def reverse_ordering(ordering):
+    return tuple(name[1:] if name.startswith('-') else f'-{name}' for name in ordering)
+
+
+def after_position(ordering, values):
+    """The rows that follow values in ordering: a row comparison over all the ordering columns.
+
+    (a, -b) > (1, 2) becomes a >= 1 AND (a > 1 OR (a = 1 AND b < 2)), the first part lets the
+    database range scan the index on the leading column.
+    """
+    conditions = []
+    for position, name in enumerate(ordering):
+        column = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        equal = {other.lstrip('-'): value for other, value in zip(ordering[:position], values)}
+        conditions.append(Q(**equal, **{f'{column}__{lookup}': values[position]}))
+    first = ordering[0].lstrip('-')
+    bound = Q(**{f"{first}__{'lte' if ordering[0].startswith('-') else 'gte'}": values[0]})
+    return bound & reduce(lambda left, right: left | right, conditions)
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination whose position holds every ordering column, not just the first.
+
+    DRF's CursorPagination keeps only the first column plus an offset, so rows sharing a
+    value (loans of one day) are paged with OFFSET. Here the ordering ends with the primary
+    key, every position is unique and each page is one index range read. Ordering columns
+    must not be nullable.
+    """
+
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'with_count'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering is None:
+            return super().get_ordering(request, queryset, view)
+        ordering = (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            # the primary key makes the position unique
+            ordering += ('-id' if ordering[-1].startswith('-') else 'id',)
+        return ordering
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # COUNT(*) is the expensive part on big tables, so it is opt-in
+        self.count = queryset.count() if self.count_requested(request) else None
+
+        # CursorPagination.paginate_queryset with the filter on the whole position
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        ordering = reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(after_position(ordering, self.position_values(current_position)))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if has_following_position else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def position_values(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        # values() rows from the fast list path are dicts
+        get = instance.__getitem__ if isinstance(instance, dict) else lambda name: getattr(instance, name)
+        return json.dumps([str(get(name.lstrip('-'))) for name in ordering])
+
+    def fits_first_page(self, request, total):
+        # the first page of a result that fits on it has no links, so it needs no cursor
+        page_size = self.get_page_size(request)
+        return page_size is not None and total <= page_size and not request.query_params.get(self.cursor_query_param)
+
+    def get_first_page_response(self, request, data):
+        self.has_next = self.has_previous = False
+        self.count = len(data) if self.count_requested(request) else None
+        return self.get_paginated_response(data)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
@@ -0,0 +1,136 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from library.metrics import record_cache_lookup
+from library.models import Genre, Library
+from library.versions import current_versions, table_name, table_versions
+
+
+Snapshot = namedtuple('Snapshot', ['rows', 'by_id', 'first', 'version'])
+
+
+class ReferenceTable:
+    """An immutable in-process copy of a small table that hardly ever changes.
+
+    Rows are namedtuples in the API ordering. Every process keeps its own snapshot and
+    compares it with the table's TableVersion, which the signals bump in the same transaction
+    as the write, so the other workers reload on their first access after the commit.
+    """
+
+    def __init__(self, name, model, fields, ordering):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.ordering = ordering
+        self.row_class = namedtuple(f'{model.__name__}Row', fields)
+        self.lock = threading.Lock()
+        self.current = None
+
+    def __deepcopy__(self, memo):
+        # serializer fields deep copy their arguments, the table is shared by design
+        return self
+
+    def shared_version(self):
+        versions = current_versions.get()
+        if versions is None or table_name(self.model) not in versions:
+            # all the tables in one read, a book page looks up both genres and libraries
+            versions = table_versions(REFERENCE_TABLES)
+        return versions[table_name(self.model)]
+
+    def load(self, version):
+        rows = tuple(self.row_class(*values) for values in self.model.objects.order_by(*self.ordering).values_list(*self.fields))
+        by_id = MappingProxyType({row.id: row for row in rows})
+        return Snapshot(rows, by_id, by_id[min(by_id)] if by_id else None, version)
+
+    def snapshot(self):
+        version = self.shared_version()
+        current = self.current
+        record_cache_lookup('reference', current is not None and current.version == version)
+        if current is None or current.version != version:
+            with self.lock:
+                current = self.current
+                if current is None or current.version != version:
+                    # the version is read before the rows, a write in between only causes another reload
+                    current = self.current = self.load(version)
+        return current
+
+    def all(self):
+        return self.snapshot().rows
+
+    def get(self, pk):
+        return self.snapshot().by_id.get(pk)
+
+    def first(self):
+        # same row as model.objects.first(), the lowest id
+        return self.snapshot().first
+
+    def instance(self, row):
+        # a fresh unsaved-looking copy, so callers can't modify the shared snapshot
+        return self.model.from_db(None, self.fields, row)
+
+    def changed(self):
+        # the version itself is bumped by the table version signals
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.current = None
+
+
+genres = ReferenceTable('genres', Genre, ('id', 'name', 'user_id'), ('name', 'id'))
+libraries = ReferenceTable('libraries', Library, ('id', 'name', 'address', 'user_id'), ('name', 'id'))
+REFERENCE_TABLES = {Genre: genres, Library: libraries}
+
+
+def reset_reference_tables():
+    for table in REFERENCE_TABLES.values():
+        table.reset()
+
+
+class ReferenceNameField(serializers.ReadOnlyField):
+    """The name of a referenced genre or library, looked up in the snapshot by the foreign key id."""
+
+    def __init__(self, table, **kwargs):
+        self.table = table
+        self.rows = None
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        # one snapshot per serializer, a list response doesn't check the version for every row
+        if self.rows is None:
+            self.rows = self.table.snapshot().by_id
+        row = self.rows.get(value)
+        return row.name if row else None
+
+
+class ReferenceViewMixin:
+    """Serves list and retrieve of a reference table from its snapshot.
+
+    A list that fits on the first page is answered without a query, anything that needs a
+    cursor goes to the database as before.
+    """
+
+    reference_table = None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.reference_table.all()
+        paginator = self.paginator
+        if paginator is None or not paginator.fits_first_page(request, len(rows)):
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer([self.reference_table.instance(row) for row in rows], many=True)
+        return paginator.get_first_page_response(request, serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            row = self.reference_table.get(int(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+        except ValueError:
+            row = None
+        if row is None:
+            return super().retrieve(request, *args, **kwargs)
+        instance = self.reference_table.instance(row)
+        self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
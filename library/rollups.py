@@ -0,0 +1,134 @@
+from collections import Counter, defaultdict
+
+from django.apps import apps as global_apps
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+
+
+ROLLUP_MODELS = ('LibraryCirculation', 'GenreCirculation', 'BookCirculation', 'MemberCirculation')
+
+
+def bump_many(model, deltas_by_pk):
+    # rows that change by the same amounts share one UPDATE, e.g. every book of a bulk return
+    groups = defaultdict(list)
+    for pk, deltas in deltas_by_pk.items():
+        deltas = tuple(sorted((field, delta) for field, delta in deltas.items() if delta))
+        if deltas:
+            groups[deltas].append(pk)
+
+    for deltas, pks in groups.items():
+        updates = {field: F(field) + delta for field, delta in deltas}
+        if model.objects.filter(pk__in=pks).update(**updates) == len(pks):
+            continue
+        # a missing row is only created on growth: during cascades the owner may already be gone
+        if any(delta > 0 for _, delta in deltas):
+            existing = set(model.objects.filter(pk__in=pks).values_list('pk', flat=True))
+            missing = [pk for pk in pks if pk not in existing]
+            model.objects.bulk_create([model(pk=pk) for pk in missing], ignore_conflicts=True)
+            model.objects.filter(pk__in=missing).update(**updates)
+
+
+def bump(model, pk, **deltas):
+    bump_many(model, {pk: deltas})
+
+
+def loan_state(book_id, member_id, return_date):
+    return (book_id, member_id, return_date is None)
+
+
+def apply_loan_changes(removed=(), added=()):
+    from library.models import Book, BookCirculation, GenreCirculation, LibraryCirculation, MemberCirculation
+
+    changes = [(state, -1) for state in removed if state] + [(state, 1) for state in added if state]
+    if not changes:
+        return
+
+    book_ids = {book_id for (book_id, _, _), _ in changes}
+    placement = {
+        book_id: (library_id, genre_id)
+        for book_id, library_id, genre_id in Book.objects.filter(pk__in=book_ids).values_list('id', 'library_id', 'genre_id')
+    }
+
+    deltas = defaultdict(Counter)
+    for (book_id, member_id, is_open), sign in changes:
+        keys = [(BookCirculation, book_id), (MemberCirculation, member_id)]
+        if book_id in placement:
+            library_id, genre_id = placement[book_id]
+            keys += [(LibraryCirculation, library_id), (GenreCirculation, genre_id)]
+        for key in keys:
+            deltas[key]['loan_count'] += sign
+            deltas[key]['open_loan_count'] += sign * is_open
+
+    by_model = defaultdict(dict)
+    for (model, pk), counts in deltas.items():
+        by_model[model][pk] = counts
+    for model, deltas_by_pk in by_model.items():
+        bump_many(model, deltas_by_pk)
+
+
+def apply_book_move(book_id, old, new):
+    from library.models import BookCirculation, GenreCirculation, LibraryCirculation
+
+    old_library, old_genre = old or (None, None)
+    new_library, new_genre = new or (None, None)
+    loans = BookCirculation.objects.filter(pk=book_id).values('loan_count', 'open_loan_count').first() or {}
+
+    for model, before, after in ((LibraryCirculation, old_library, new_library), (GenreCirculation, old_genre, new_genre)):
+        if before == after:
+            continue
+        if before is not None:
+            bump(model, before, book_count=-1, **{field: -value for field, value in loans.items()})
+        if after is not None:
+            bump(model, after, book_count=1, **loans)
+
+
+def apply_books_added(books):
+    from library.models import GenreCirculation, LibraryCirculation
+
+    for model, counts in ((LibraryCirculation, Counter(book.library_id for book in books)),
+                          (GenreCirculation, Counter(book.genre_id for book in books))):
+        bump_many(model, {pk: {'book_count': count} for pk, count in counts.items()})
+
+
+def insert_from(model, fields, queryset):
+    # INSERT ... SELECT, so millions of rollup rows never pass through Python
+    connection = connections[queryset.db]
+    select_sql, params = queryset.query.sql_with_params()
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) {select_sql}', params)
+
+
+def rebuild_rollups(apps=global_apps):
+    Library = apps.get_model('library', 'Library')
+    Genre = apps.get_model('library', 'Genre')
+    Book = apps.get_model('library', 'Book')
+    Loan = apps.get_model('library', 'Loan')
+    rollups = {name: apps.get_model('library', name) for name in ROLLUP_MODELS}
+
+    loan_counts = dict(loan_count=Count('id'), open_loan_count=Count('id', filter=Q(return_date__isnull=True)))
+
+    def grouped(queryset, key, **aggregates):
+        return {row.pop(key): row for row in queryset.order_by().values(key).annotate(**aggregates)}
+
+    with transaction.atomic():
+        for model in rollups.values():
+            model.objects.all().delete()
+
+        for owner, key, rollup in ((Library, 'library_id', 'LibraryCirculation'), (Genre, 'genre_id', 'GenreCirculation')):
+            books = grouped(Book.objects.all(), key, book_count=Count('id'))
+            loans = grouped(Loan.objects.all(), f'book__{key}', **loan_counts)
+            rollups[rollup].objects.bulk_create(
+                (rollups[rollup](pk=pk, **books.get(pk, {}), **loans.get(pk, {}))
+                 for pk in owner.objects.values_list('pk', flat=True).iterator()),
+                batch_size=1000,
+            )
+
+        for key, rollup in (('book_id', 'BookCirculation'), ('member_id', 'MemberCirculation')):
+            insert_from(
+                rollups[rollup],
+                [key.removesuffix('_id'), *loan_counts],
+                Loan.objects.order_by().values(key).annotate(**loan_counts),
+            )
+
+    return {name: model.objects.count() for name, model in rollups.items()}
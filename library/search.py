@@ -0,0 +1,148 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+
+SEARCH_TABLE = 'library_book_fts'
+SEARCH_LIMIT = 20
+# shorter prefixes match a large part of the catalogue and every match has to be ranked
+PREFIX_MIN_LENGTH = 3
+MAX_SEARCH_LIMIT = 100
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def normalized_sql(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+BOOK_ROW_SQL = f"""
+    SELECT b.id, {normalized_sql('b.title')}, {normalized_sql('g.name')}, {normalized_sql('l.name')}
+    FROM library_book b
+    JOIN library_genre g ON g.id = b.genre_id
+    JOIN library_library l ON l.id = b.library_id
+"""
+
+POPULATE_SQL = [
+    f"DELETE FROM {SEARCH_TABLE}",
+    f"INSERT INTO {SEARCH_TABLE}(rowid, title, genre, library) {BOOK_ROW_SQL}",
+]
+
+TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_insert AFTER INSERT ON library_book BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, title, genre, library) {BOOK_ROW_SQL} WHERE b.id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_update AFTER UPDATE OF title, genre_id, library_id ON library_book BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, title, genre, library) {BOOK_ROW_SQL} WHERE b.id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_delete AFTER DELETE ON library_book BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_genre_fts_update AFTER UPDATE OF name ON library_genre BEGIN
+        UPDATE {SEARCH_TABLE} SET genre = {normalized_sql('new.name')}
+        WHERE rowid IN (SELECT id FROM library_book WHERE genre_id = new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_library_fts_update AFTER UPDATE OF name ON library_library BEGIN
+        UPDATE {SEARCH_TABLE} SET library = {normalized_sql('new.name')}
+        WHERE rowid IN (SELECT id FROM library_book WHERE library_id = new.id);
+    END
+    """,
+]
+
+DROP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS library_library_fts_update",
+    "DROP TRIGGER IF EXISTS library_genre_fts_update",
+    "DROP TRIGGER IF EXISTS library_book_fts_delete",
+    "DROP TRIGGER IF EXISTS library_book_fts_update",
+    "DROP TRIGGER IF EXISTS library_book_fts_insert",
+]
+
+def search_table_exists(using_connection=connection):
+    return SEARCH_TABLE in using_connection.introspection.table_names()
+
+
+def run_statements(using_connection, statements):
+    if using_connection.vendor != 'sqlite' or not search_table_exists(using_connection):
+        return
+    with using_connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+# SQLite refuses to rebuild library_book while triggers on other tables point at it,
+# so migrations run without the triggers and the index is refilled afterwards
+def drop_search_triggers(using_connection=connection):
+    run_statements(using_connection, DROP_TRIGGERS_SQL)
+
+
+def install_search_triggers(using_connection=connection, rebuild=False):
+    run_statements(using_connection, TRIGGERS_SQL + (POPULATE_SQL if rebuild else []))
+
+
+def normalize(text):
+    # the index stores "ё" as "е", so both spellings of a word match
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def search_tokens(text):
+    return TOKEN_RE.findall(normalize(text or '').lower())
+
+
+def match_expression(text, column=None):
+    # every word must match, the last one also as a prefix of a longer word
+    tokens = search_tokens(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if len(tokens[-1]) >= PREFIX_MIN_LENGTH:
+        terms[-1] += '*'
+    expression = ' '.join(terms)
+    if column is not None:
+        return f'{column} : ({expression})'
+    return expression
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def matching_ids_sql(text, column=None):
+    return f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', (match_expression(text, column),)
+
+
+def ranked_book_ids(text, limit=SEARCH_LIMIT):
+    match = match_expression(text)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        # rank is configured as bm25 with the title weighted above genre and library
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+FALLBACK_FIELDS = {'title': 'title', 'genre': 'genre__name', 'library': 'library__name'}
+
+
+def fallback_filter(text, column=None):
+    fields = [FALLBACK_FIELDS[column]] if column else list(FALLBACK_FIELDS.values())
+    condition = Q()
+    for token in search_tokens(text):
+        token_condition = Q()
+        for field in fields:
+            token_condition |= Q(**{f'{field}__icontains': token})
+        condition &= token_condition
+    return condition
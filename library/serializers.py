@@ -1,30 +1,26 @@
 from rest_framework import serializers
-from library.models import Library, Book, Genre, Member, Loan, UserProfile
+from library.models import Library, Book, Genre, Member, Loan, UserProfile, ExportJob
 from django.contrib.auth.models import User
+from django.urls import reverse
 
+from library.fieldsets import SparseFieldsMixin
+from library.reference import ReferenceNameField, genres, libraries
+from library.timing import TimedSerializerMixin
 
-class BookSerializer(serializers.ModelSerializer):
-    genre_name = serializers.StringRelatedField(source='genre', read_only=True)
-    library_name = serializers.StringRelatedField(source='library', read_only=True)
-    cover_url = serializers.SerializerMethodField()
-    is_available = serializers.SerializerMethodField()
+
+class BookSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    genre_name = ReferenceNameField(genres, source='genre_id')
+    library_name = ReferenceNameField(libraries, source='library_id')
+    cover_url = serializers.ImageField(source='cover', read_only=True)
+    thumb_url = serializers.ImageField(source='cover_thumb', read_only=True)
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'genre', 'library', 'genre_name', 'library_name', 'cover', 'cover_url', 'is_available']
-        read_only_fields = ['user']
-
-    def get_cover_url(self, obj):
-        request = self.context.get('request')
-        if obj.cover:
-            return request.build_absolute_uri(obj.cover.url) if request else obj.cover.url
-        return None
-
-    def get_is_available(self, obj):
-        return obj.is_available()
+        fields = ['id', 'title', 'genre', 'library', 'genre_name', 'library_name', 'cover', 'cover_url', 'thumb_url', 'is_available']
+        read_only_fields = ['user', 'is_available']
 
 
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = ['id', 'name', 'user']
@@ -37,7 +33,7 @@ class GenreSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class LibrarySerializer(serializers.ModelSerializer):
+class LibrarySerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Library
         fields = ['id', 'name', 'user']
@@ -50,22 +46,17 @@ class LibrarySerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class MemberSerializer(serializers.ModelSerializer):
-    library_name = serializers.CharField(source='library.name', read_only=True)
+class MemberSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    library_name = ReferenceNameField(libraries, source='library_id')
     user_name = serializers.CharField(source='user.username', read_only=True)
-    photo_url = serializers.SerializerMethodField()
+    photo_url = serializers.ImageField(source='photo', read_only=True)
+    thumb_url = serializers.ImageField(source='photo_thumb', read_only=True)
 
     class Meta:
         model = Member
-        fields = ['id', 'user', 'user_name', 'library', 'library_name', 'first_name', 'photo', 'photo_url']
+        fields = ['id', 'user', 'user_name', 'library', 'library_name', 'first_name', 'photo', 'photo_url', 'thumb_url']
         read_only_fields = ['user']
 
-    def get_photo_url(self, obj):
-        request = self.context.get('request')
-        if obj.photo:
-            return request.build_absolute_uri(obj.photo.url) if request else obj.photo.url
-        return None
-
     def create(self, validated_data):
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
@@ -79,13 +70,14 @@ class MemberSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class LoanSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     book_title = serializers.CharField(source='book.title', read_only=True)
     member_name = serializers.CharField(source='member.first_name', read_only=True)
+    library = serializers.IntegerField(source='book.library_id', read_only=True)
 
     class Meta:
         model = Loan
-        fields = ['id', 'book', 'member', 'loan_date', 'return_date', 'book_title', 'member_name']
+        fields = ['id', 'book', 'member', 'loan_date', 'return_date', 'book_title', 'member_name', 'library']
         read_only_fields = ['return_date']
 
     def create(self, validated_data):
@@ -97,11 +89,29 @@ class LoanSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class ExportJobSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'name', 'file_type', 'status', 'progress', 'rows_done', 'rows_total', 'error',
+                  'created_at', 'finished_at', 'expires_at', 'download_url']
+        read_only_fields = fields
+        field_sources = {'download_url': ['status']}
+
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.DONE:
+            return None
+        request = self.context.get('request')
+        url = reverse('export-job-download', kwargs={'pk': obj.pk})
+        return request.build_absolute_uri(url) if request else url
+
+
 class OTPSerializer(serializers.Serializer):
     key = serializers.CharField()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     age = serializers.IntegerField(source='profile.age', required=False, allow_null=True)
 
     class Meta:
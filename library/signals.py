@@ -1,8 +1,20 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db import connections
+from django.db.models.signals import post_save, pre_save, post_delete, post_migrate, pre_migrate
+from django.dispatch import Signal, receiver
 from django.contrib.auth.models import User
 
-from .models import Member, Library, UserProfile
+from .models import Member, Library, UserProfile, Book, Loan, Genre, LibraryCirculation, GenreCirculation
+from .autocomplete import book_titles, member_names
+from .search import drop_search_triggers, install_search_triggers
+from .rollups import apply_book_move, apply_loan_changes, bump, loan_state
+from .versions import bump_version
+from .reference import REFERENCE_TABLES, libraries
+from .thumbnails import THUMBNAILS, delete_thumbnail, update_thumbnail
+
+
+# sent after writes that bypass the model signals (bulk_create, queryset.update) with the
+# affected instances, or instances=None when they are not known
+bulk_changed = Signal()
 
 
 @receiver(post_save, sender=User)
@@ -10,13 +22,179 @@ def create_member_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.get_or_create(user=instance)
         
-        library = Library.objects.first()
+        library = libraries.first()
         
         if library:
             Member.objects.get_or_create(
                 user=instance,
                 defaults={
                     'first_name': instance.username,
-                    'library': library
+                    'library_id': library.id
                 }
             )
+
+
+@receiver(pre_save, sender=Loan)
+def remember_loan_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not kwargs.get('raw'):
+        previous = Loan.objects.filter(pk=instance.pk).values_list('book_id', 'member_id', 'return_date').first()
+        instance._previous_state = previous and loan_state(*previous)
+
+
+@receiver(post_save, sender=Loan)
+def update_availability_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    book_ids = {instance.book_id, previous and previous[0]} - {None}
+    Book.objects.filter(pk__in=book_ids).refresh_availability()
+
+
+@receiver(post_delete, sender=Loan)
+def update_availability_on_delete(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.book_id).refresh_availability()
+
+
+@receiver(post_save, sender=Loan)
+def update_rollups_on_loan_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    current = loan_state(instance.book_id, instance.member_id, instance.return_date)
+    previous = getattr(instance, '_previous_state', None)
+    if current != previous:
+        apply_loan_changes(removed=[previous], added=[current])
+
+
+@receiver(post_delete, sender=Loan)
+def update_rollups_on_loan_delete(sender, instance, **kwargs):
+    apply_loan_changes(removed=[loan_state(instance.book_id, instance.member_id, instance.return_date)])
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_placement(sender, instance, **kwargs):
+    instance._previous_placement = None
+    if instance.pk and not kwargs.get('raw'):
+        instance._previous_placement = Book.objects.filter(pk=instance.pk).values_list('library_id', 'genre_id').first()
+
+
+@receiver(post_save, sender=Book)
+def update_rollups_on_book_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_placement', None)
+    current = (instance.library_id, instance.genre_id)
+    if current != previous:
+        apply_book_move(instance.pk, previous, current)
+
+
+@receiver(post_delete, sender=Book)
+def update_rollups_on_book_delete(sender, instance, **kwargs):
+    # the loans are deleted first by the cascade, so only the book itself is left to subtract
+    bump(LibraryCirculation, instance.library_id, book_count=-1)
+    bump(GenreCirculation, instance.genre_id, book_count=-1)
+
+
+@receiver(post_save, sender=Library)
+def create_library_rollup(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        LibraryCirculation.objects.get_or_create(library=instance)
+
+
+@receiver(post_save, sender=Genre)
+def create_genre_rollup(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        GenreCirculation.objects.get_or_create(genre=instance)
+
+
+@receiver(post_save, sender=Book)
+def update_book_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        book_titles.changed(instance.pk, instance.title, instance.library_id)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_autocomplete(sender, instance, **kwargs):
+    book_titles.changed(instance.pk, deleted=True)
+
+
+@receiver(post_save, sender=Member)
+def update_member_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        member_names.changed(instance.pk, instance.first_name, instance.library_id)
+
+
+@receiver(post_delete, sender=Member)
+def remove_member_autocomplete(sender, instance, **kwargs):
+    member_names.changed(instance.pk, deleted=True)
+
+
+def update_thumbnail_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_thumbnail(instance)
+
+
+def remove_thumbnail_on_delete(sender, instance, **kwargs):
+    delete_thumbnail(getattr(instance, THUMBNAILS[sender][1]))
+
+
+# connected before the table versions, so that the version is bumped after the thumbnail is saved
+for model in THUMBNAILS:
+    post_save.connect(update_thumbnail_on_save, sender=model, dispatch_uid=f'thumbnail_save_{model.__name__}')
+    post_delete.connect(remove_thumbnail_on_delete, sender=model, dispatch_uid=f'thumbnail_delete_{model.__name__}')
+
+
+@receiver(bulk_changed)
+def update_autocomplete_in_bulk(sender, instances=None, **kwargs):
+    index, field = {Book: (book_titles, 'title'), Member: (member_names, 'first_name')}.get(sender, (None, None))
+    if index is None:
+        return
+    if instances is None:
+        index.invalidate()
+        return
+    index.changed_many([(instance.pk, getattr(instance, field), instance.library_id, False) for instance in instances])
+
+
+@receiver(pre_migrate)
+def suspend_search_triggers(sender, using, **kwargs):
+    if sender.name == 'library':
+        drop_search_triggers(connections[using])
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, plan=None, **kwargs):
+    if sender.name == 'library':
+        # applied migrations may have written books while the triggers were off
+        install_search_triggers(connections[using], rebuild=bool(plan))
+
+
+# the stats cache generation is made of these versions as well, see stats_cache.STATS_TABLES
+def bump_table_version(sender, **kwargs):
+    if not kwargs.get('raw'):
+        bump_version(sender)
+
+
+for model in (Loan, Book, Genre, Library, Member, User, UserProfile):
+    post_save.connect(bump_table_version, sender=model, dispatch_uid=f'table_version_save_{model.__name__}')
+    post_delete.connect(bump_table_version, sender=model, dispatch_uid=f'table_version_delete_{model.__name__}')
+
+
+@receiver(bulk_changed)
+def bump_table_version_in_bulk(sender, **kwargs):
+    bump_version(sender)
+
+
+def reference_table_changed(sender, **kwargs):
+    if not kwargs.get('raw'):
+        REFERENCE_TABLES[sender].changed()
+
+
+for model in REFERENCE_TABLES:
+    post_save.connect(reference_table_changed, sender=model, dispatch_uid=f'reference_save_{model.__name__}')
+    post_delete.connect(reference_table_changed, sender=model, dispatch_uid=f'reference_delete_{model.__name__}')
+
+
+@receiver(bulk_changed)
+def reference_table_changed_in_bulk(sender, **kwargs):
+    if sender in REFERENCE_TABLES:
+        REFERENCE_TABLES[sender].changed()
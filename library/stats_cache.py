@@ -0,0 +1,93 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from library.metrics import cache_lookup_counts, record_cache_lookup
+from library.models import Book, Genre, Library, Loan, Member, UserProfile
+from library.versions import bump_version, table_name, table_versions, user_scope
+
+
+# what the stats are computed from; their TableVersion rows are bumped with every write
+STATS_TABLES = (User, Loan, Book, Genre, Library, Member, UserProfile)
+# bumped by invalidate_stats, for writes the table versions don't see (rollup rebuilds)
+STATS_TABLE = 'stats'
+
+
+def cache_timeout():
+    return getattr(settings, 'STATS_CACHE_TIMEOUT', 300)
+
+
+def lock_timeout():
+    return getattr(settings, 'STATS_CACHE_LOCK_TIMEOUT', 10)
+
+
+def current_generation():
+    # read from the database, so a commit in any worker changes it for all of them
+    versions = table_versions([*STATS_TABLES, STATS_TABLE])
+    return '.'.join(str(versions[table_name(table)]) for table in (*STATS_TABLES, STATS_TABLE))
+
+
+def invalidate_stats():
+    # the entries of the old generation are never read again, they expire on their own
+    bump_version(STATS_TABLE)
+
+
+def stats_cache_info():
+    hits, misses = cache_lookup_counts('stats')
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 3) if total else None,
+    }
+
+
+def wait_for(key):
+    deadline = time.monotonic() + lock_timeout()
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return None
+
+
+def cached_stats(endpoint, scoped=False):
+    """Caches a stats action's response until a write commits, see current_generation.
+
+    The entries and the stampede lock live in the default cache, with LocMemCache every
+    worker computes and keeps its own copy; the generation comes from the database.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            scope = user_scope(request.user) if scoped else 'all'
+            key = f'stats:{current_generation()}:{endpoint}:{scope}'
+
+            data = cache.get(key)
+            locked = data is None and cache.add(f'{key}:lock', 1, lock_timeout())
+            if data is None and not locked:
+                # somebody else is already computing this entry, don't stampede the database
+                data = wait_for(key)
+
+            record_cache_lookup('stats', data is not None)
+            if data is not None:
+                return Response(data, headers={'X-Stats-Cache': 'hit'})
+
+            try:
+                response = func(self, request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response.data, cache_timeout())
+            finally:
+                # after a timed out wait the lock is still somebody else's
+                if locked:
+                    cache.delete(f'{key}:lock')
+            response['X-Stats-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
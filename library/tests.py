@@ -1,29 +1,62 @@
 
+import io
+import os
+import threading
 import pytest
 import json
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from model_bakery import baker
+from rest_framework import serializers
+from openpyxl import load_workbook
+from PIL import Image
+from datetime import date, timedelta
+from library.autocomplete import book_titles, reset_indexes
+from library.reference import genres, libraries, reset_reference_tables
+from library.export_jobs import purge_expired_jobs
+from library.filters import BookFilterSerializer, LoanFilterSerializer
+from library import benchmarks, fast_lists
+from library.benchmarks import legacy_member_stats
+from library.models import Book, ExportJob, Genre, Library, Loan, Member, UserProfile
+from library.serializers import BookSerializer
+from library.stats_cache import current_generation
+from library.versions import bump_version, versions_scope
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    reset_indexes()
+    reset_reference_tables()
 
 
 @pytest.mark.django_db
 class TestLibraryAPI:
-    def test_get_libraries(self, client):
-        baker.make("library.Library", 5)
-        r = client.get("/api/library/")
+    def test_get_libraries(self, admin_client):
+        baker.make("library.Library", _quantity=5)
+        r = admin_client.get("/api/libraries/")
         data = r.json()
         assert r.status_code == 200
-        assert len(data) == 5
+        assert len(data["results"]) == 5
 
-    def test_create_library(self, client):
+    def test_create_library(self, admin_client):
         payload = {"name": "Городская библиотека", "address": "ул. Ленина, 10"}
-        r = client.post("/api/library/", json.dumps(payload), content_type="application/json")
+        r = admin_client.post("/api/libraries/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 201
         data = r.json()
         assert data["name"] == "Городская библиотека"
 
-    def test_update_library(self, client):
+    def test_update_library(self, admin_client):
         lib = baker.make("library.Library")
         payload = {"name": "Новая библиотека", "address": "ул. Чехова, 5"}
-        r = client.put(f"/api/library/{lib.id}/", json.dumps(payload), content_type="application/json")
+        r = admin_client.put(f"/api/libraries/{lib.id}/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 200
         data = r.json()
         assert data["name"] == "Новая библиотека"
@@ -31,96 +64,1455 @@ class TestLibraryAPI:
 
 @pytest.mark.django_db
 class TestGenreAPI:
-    def test_get_genres(self, client):
-        baker.make("library.Genre", 4)
-        r = client.get("/api/genre/")
+    def test_get_genres(self, admin_client):
+        baker.make("library.Genre", _quantity=4)
+        r = admin_client.get("/api/genres/")
         data = r.json()
         assert r.status_code == 200
-        assert len(data) == 4
+        assert len(data["results"]) == 4
 
-    def test_create_genre(self, client):
+    def test_create_genre(self, admin_client):
         payload = {"name": "Фантастика"}
-        r = client.post("/api/genre/", json.dumps(payload), content_type="application/json")
+        r = admin_client.post("/api/genres/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 201
         assert r.json()["name"] == "Фантастика"
 
-    def test_update_genre(self, client):
+    def test_update_genre(self, admin_client):
         genre = baker.make("library.Genre")
         payload = {"name": "Детектив"}
-        r = client.put(f"/api/genre/{genre.id}/", json.dumps(payload), content_type="application/json")
+        r = admin_client.put(f"/api/genres/{genre.id}/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 200
         assert r.json()["name"] == "Детектив"
 
 
 @pytest.mark.django_db
 class TestBookAPI:
-    def test_get_books(self, client):
-        baker.make("library.Book", 5)
-        r = client.get("/api/book/")
+    def test_get_books(self, admin_client):
+        baker.make("library.Book", _quantity=5)
+        r = admin_client.get("/api/books/")
         data = r.json()
         assert r.status_code == 200
-        assert len(data) == 5
+        assert len(data["results"]) == 5
 
-    def test_create_book(self, client):
+    def test_create_book(self, admin_client):
         genre = baker.make("library.Genre")
         library = baker.make("library.Library")
         payload = {"title": "1984", "genre": genre.id, "library": library.id}
-        r = client.post("/api/book/", json.dumps(payload), content_type="application/json")
+        r = admin_client.post("/api/books/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 201
         assert r.json()["title"] == "1984"
 
-    def test_update_book(self, client):
+    def test_update_book(self, admin_client):
         book = baker.make("library.Book")
         payload = {"title": "Animal Farm", "genre": book.genre.id, "library": book.library.id}
-        r = client.put(f"/api/book/{book.id}/", json.dumps(payload), content_type="application/json")
+        r = admin_client.put(f"/api/books/{book.id}/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 200
         assert r.json()["title"] == "Animal Farm"
 
 
 @pytest.mark.django_db
 class TestMemberAPI:
-    def test_get_members(self, client):
-        baker.make("library.Member", 6)
-        r = client.get("/api/member/")
+    def test_get_members(self, admin_client):
+        baker.make("library.Member", _quantity=6)
+        r = admin_client.get("/api/library-members/")
         data = r.json()
         assert r.status_code == 200
-        assert len(data) == 6
+        assert len(data["results"]) == 6
 
-    def test_create_member(self, client):
+    def test_create_member(self, admin_client):
         library = baker.make("library.Library")
         payload = {"first_name": "Иван", "library": library.id}
-        r = client.post("/api/member/", json.dumps(payload), content_type="application/json")
+        r = admin_client.post("/api/library-members/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 201
         assert r.json()["first_name"] == "Иван"
 
-    def test_update_member(self, client):
+    def test_update_member(self, admin_client):
         member = baker.make("library.Member")
         payload = {"first_name": "Петр", "library": member.library.id}
-        r = client.put(f"/api/member/{member.id}/", json.dumps(payload), content_type="application/json")
+        r = admin_client.put(f"/api/library-members/{member.id}/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 200
         assert r.json()["first_name"] == "Петр"
 
 
 @pytest.mark.django_db
 class TestLoanAPI:
-    def test_get_loans(self, client):
-        baker.make("library.Loan", 3)
-        r = client.get("/api/loan/")
+    def test_get_loans(self, admin_client):
+        baker.make("library.Loan", _quantity=3)
+        r = admin_client.get("/api/loans/")
         data = r.json()
         assert r.status_code == 200
-        assert len(data) == 3
+        assert len(data["results"]) == 3
 
-    def test_create_loan(self, client):
+    def test_create_loan(self, admin_client):
         book = baker.make("library.Book")
         member = baker.make("library.Member")
         payload = {"book": book.id, "member": member.id, "loan_date": "2024-10-01"}
-        r = client.post("/api/loan/", json.dumps(payload), content_type="application/json")
+        r = admin_client.post("/api/loans/", json.dumps(payload), content_type="application/json")
         assert r.status_code == 201
         assert r.json()["loan_date"] == "2024-10-01"
 
-    def test_update_loan(self, client):
+    def test_update_loan(self, admin_client):
         loan = baker.make("library.Loan")
         payload = {"book": loan.book.id, "member": loan.member.id, "loan_date": "2024-12-31"}
-        r = client.put(f"/api/loan/{loan.id}/", json.dumps(payload), content_type="application/json")
+        r = admin_client.put(f"/api/loans/{loan.id}/", json.dumps(payload), content_type="application/json")
+        assert r.status_code == 200
+        assert r.json()["loan_date"] == "2024-12-31"
+
+@pytest.mark.django_db
+class TestBookAvailability:
+    def test_loan_lifecycle_updates_availability(self):
+        book = baker.make("library.Book")
+        assert book.is_available
+
+        loan = baker.make("library.Loan", book=book, return_date=None)
+        book.refresh_from_db()
+        assert not book.is_available
+
+        loan.return_date = "2024-10-10"
+        loan.save()
+        book.refresh_from_db()
+        assert book.is_available
+
+        loan.return_date = None
+        loan.save()
+        loan.delete()
+        book.refresh_from_db()
+        assert book.is_available
+
+    def test_moving_loan_frees_previous_book(self):
+        first, second = baker.make("library.Book", _quantity=2)
+        loan = baker.make("library.Loan", book=first, return_date=None)
+
+        loan.book = second
+        loan.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert first.is_available
+        assert not second.is_available
+
+    def test_serializer_reads_stored_availability(self, admin_client):
+        books = baker.make("library.Book", _quantity=20)
+        baker.make("library.Loan", book=books[0], return_date=None)
+
+        with CaptureQueriesContext(connection) as ctx:
+            r = admin_client.get("/api/books/")
+        assert r.status_code == 200
+        assert not [q for q in ctx.captured_queries if "library_loan" in q["sql"]]
+        availability = {row["id"]: row["is_available"] for row in r.json()["results"]}
+        assert availability[books[0].id] is False
+        assert availability[books[1].id] is True
+
+    def test_check_availability_repairs_drift(self):
+        book = baker.make("library.Book")
+        baker.make("library.Loan", book=book, return_date=None)
+        Book.objects.filter(pk=book.pk).update(is_available=True)
+
+        call_command("check_availability")
+        book.refresh_from_db()
+        assert not book.is_available
+
+
+@pytest.mark.django_db
+class TestBookQueryBudget:
+    def test_list_query_count_is_constant(self, admin_client, django_assert_max_num_queries):
+        genre = baker.make("library.Genre")
+        library = baker.make("library.Library")
+        Book.objects.bulk_create(
+            Book(title=f"Книга {i}", genre=genre, library=library) for i in range(10_000)
+        )
+        # genre and library names come from the reference snapshots, which a running server keeps warm
+        genres.all(), libraries.all()
+
+        with django_assert_max_num_queries(4):  # session + user + table versions + page
+            r = admin_client.get("/api/books/", {"page_size": 1000})
         assert r.status_code == 200
-        assert r.json()["loan_date"] == "2024-12-31"
\ No newline at end of file
+        assert len(r.json()["results"]) == 1000
+
+    def test_retrieve_query_count(self, admin_client, django_assert_max_num_queries):
+        book = baker.make("library.Book")
+        genres.all(), libraries.all()
+
+        with django_assert_max_num_queries(4):  # session + user + table versions + book
+            r = admin_client.get(f"/api/books/{book.id}/")
+        assert r.status_code == 200
+        assert r.json()["genre_name"] == book.genre.name
+        assert r.json()["library_name"] == book.library.name
+
+
+@pytest.mark.django_db
+class TestCursorPagination:
+    def test_books_are_paged_by_cursor(self, admin_client):
+        baker.make("library.Book", _quantity=5)
+
+        r = admin_client.get("/api/books/", {"page_size": 2})
+        data = r.json()
+        assert r.status_code == 200
+        assert "count" not in data
+        assert len(data["results"]) == 2
+
+        seen = [row["id"] for row in data["results"]]
+        while data["next"]:
+            data = admin_client.get(data["next"]).json()
+            seen += [row["id"] for row in data["results"]]
+        assert seen == sorted(Book.objects.values_list("id", flat=True))
+
+    def test_count_is_opt_in(self, admin_client):
+        baker.make("library.Genre", _quantity=3)
+
+        r = admin_client.get("/api/genres/", {"with_count": "true"})
+        assert r.json()["count"] == 3
+
+    def test_busy_days_are_paged_by_date_and_id(self, admin_client):
+        baker.make("library.Loan", loan_date="2024-05-01", _quantity=7)
+        baker.make("library.Loan", loan_date="2024-05-02", _quantity=2)
+        expected = list(Loan.objects.order_by("-loan_date", "-id").values_list("id", flat=True))
+
+        seen, pages = [], []
+        data = admin_client.get("/api/loans/", {"page_size": 2}).json()
+        while True:
+            seen += [row["id"] for row in data["results"]]
+            pages.append(data)
+            if not data["next"]:
+                break
+            with CaptureQueriesContext(connection) as ctx:
+                data = admin_client.get(data["next"]).json()
+            assert "OFFSET" not in ctx.captured_queries[-1]["sql"]
+        assert seen == expected
+
+        # and back again
+        back = []
+        data = pages[-1]
+        while data["previous"]:
+            data = admin_client.get(data["previous"]).json()
+            back = [row["id"] for row in data["results"]] + back
+        assert back == expected[:len(back)] and len(back) == len(expected) - len(pages[-1]["results"])
+
+    def test_broken_cursors_are_rejected(self, admin_client):
+        assert admin_client.get("/api/loans/", {"cursor": "cD0x"}).status_code == 404
+
+    def test_loans_newest_first(self, admin_client):
+        baker.make("library.Loan", loan_date="2024-01-01")
+        newest = baker.make("library.Loan", loan_date="2024-06-01")
+
+        r = admin_client.get("/api/loans/", {"page_size": 1})
+        assert r.json()["results"][0]["id"] == newest.id
+
+
+@pytest.mark.django_db
+class TestExport:
+    def test_loans_excel_streams_all_rows(self, admin_client):
+        baker.make("library.Loan", 3, return_date=None)
+
+        r = admin_client.get("/api/loans/export/", {"type": "excel"})
+        assert r.status_code == 200
+        assert r.streaming
+        assert r["Content-Disposition"] == 'attachment; filename="Loans.xlsx"'
+
+        sheet = load_workbook(io.BytesIO(b"".join(r.streaming_content))).active
+        rows = list(sheet.values)
+        assert rows[0] == ("ID", "Book", "Member", "User", "Loan Date", "Return Date")
+        assert len(rows) == 4
+        assert rows[1][5] == "Not returned"
+
+    def test_members_word_export(self, admin_client):
+        r = admin_client.get("/api/members/export/word/")
+        assert r.status_code == 200
+        assert r["Content-Disposition"] == 'attachment; filename="Members.docx"'
+
+    def test_books_csv_streams_values(self, admin_client):
+        book = baker.make("library.Book", title="Мы")
+        baker.make("library.Loan", book=book, return_date=None)
+
+        with CaptureQueriesContext(connection) as ctx:
+            r = admin_client.get("/api/books/export/", {"type": "csv"})
+            body = b"".join(r.streaming_content).decode()
+        assert r["Content-Type"] == "text/csv; charset=utf-8"
+        assert body.splitlines() == [
+            "ID,Title,Genre,Library,Status",
+            f"{book.id},Мы,{book.genre.name},{book.library.name},Borrowed",
+        ]
+        assert len([q for q in ctx.captured_queries if "library_book" in q["sql"]]) == 1
+
+    def test_loans_ndjson(self, admin_client):
+        loan = baker.make("library.Loan", loan_date="2024-05-01", return_date=None)
+
+        r = admin_client.get("/api/loans/export/", {"type": "ndjson"})
+        lines = [json.loads(line) for line in b"".join(r.streaming_content).decode().splitlines()]
+        assert lines == [{
+            "ID": loan.id,
+            "Book": loan.book.title,
+            "Member": loan.member.first_name,
+            "User": "",
+            "Loan Date": "2024-05-01",
+            "Return Date": "Not returned",
+        }]
+
+    def test_unknown_type(self, admin_client):
+        r = admin_client.get("/api/genres/export/", {"type": "pdf"})
+        assert r.status_code == 400
+
+
+@pytest.mark.django_db
+class TestExportJobs:
+    @pytest.fixture(autouse=True)
+    def eager_jobs(self, settings, tmp_path):
+        settings.EXPORT_JOBS_EAGER = True
+        settings.MEDIA_ROOT = tmp_path
+
+    def test_async_export_produces_downloadable_file(self, admin_client):
+        baker.make("library.Loan", 3)
+
+        r = admin_client.get("/api/loans/export/", {"type": "csv", "async": "true"})
+        assert r.status_code == 202
+        job = r.json()
+
+        r = admin_client.get(f"/api/export-jobs/{job['id']}/")
+        status = r.json()
+        assert status["status"] == "done"
+        assert status["progress"] == 100
+        assert status["rows_total"] == status["rows_done"] == 3
+
+        r = admin_client.get(status["download_url"])
+        assert r.status_code == 200
+        assert r["Content-Disposition"] == 'attachment; filename="Loans.csv"'
+        assert len(b"".join(r.streaming_content).decode().splitlines()) == 4
+
+    def test_failed_job_keeps_its_progress(self, admin_client, monkeypatch):
+        baker.make("library.Loan", 3)
+
+        def broken_writer(rows, *args):
+            for _ in rows:
+                pass
+            raise OSError("disk full")
+
+        monkeypatch.setattr("library.export_jobs.write_export", broken_writer)
+        admin_client.get("/api/loans/export/", {"type": "csv", "async": "true"})
+        job = ExportJob.objects.get()
+        assert job.status == ExportJob.FAILED
+        assert job.error == "disk full"
+        assert job.rows_done == 3
+
+    def test_jobs_are_private(self, admin_client, client, django_user_model):
+        admin_client.get("/api/genres/export/", {"async": "1"})
+        other = django_user_model.objects.create_user("reader", password="x")
+        client.force_login(other)
+
+        job = ExportJob.objects.get()
+        assert client.get(f"/api/export-jobs/{job.id}/").status_code == 404
+
+    def test_expired_artifacts_are_purged(self, admin_client):
+        admin_client.get("/api/genres/export/", {"async": "1"})
+        job = ExportJob.objects.get()
+        path = job.file.path
+
+        purge_expired_jobs(now=job.expires_at + timedelta(seconds=1))
+        assert not ExportJob.objects.exists()
+        assert not os.path.exists(path)
+
+
+@pytest.mark.django_db
+class TestExportSpecs:
+    def test_book_status_reflects_open_loans(self, admin_client):
+        borrowed, available = baker.make("library.Book", _quantity=2)
+        baker.make("library.Loan", book=borrowed, return_date=None)
+
+        r = admin_client.get("/api/books/export/", {"type": "ndjson"})
+        statuses = {row["ID"]: row["Status"] for row in map(json.loads, b"".join(r.streaming_content).splitlines())}
+        assert statuses == {borrowed.id: "Borrowed", available.id: "Available"}
+
+    @pytest.mark.parametrize("url", [
+        "/api/genres/export/", "/api/libraries/export/", "/api/books/export/",
+        "/api/loans/export/", "/api/members/export/", "/api/library-members/export/",
+    ])
+    def test_constant_query_count(self, admin_client, url, django_assert_max_num_queries):
+        baker.make("library.Loan", 30, user=baker.make("auth.User"))
+        baker.make("library.Genre", 30, user=baker.make("auth.User"))
+        baker.make("library.Library", 30, user=baker.make("auth.User"))
+
+        with django_assert_max_num_queries(4):
+            r = admin_client.get(url, {"type": "csv"})
+            b"".join(r.streaming_content)
+        assert r.status_code == 200
+
+    def test_library_members_mask_user_for_regular_users(self, client, django_user_model):
+        library = baker.make("library.Library")
+        user = django_user_model.objects.create_user("reader", password="x")
+        client.force_login(user)
+
+        r = client.get("/api/library-members/export/", {"type": "ndjson"})
+        rows = [json.loads(line) for line in b"".join(r.streaming_content).splitlines()]
+        assert rows == [{"ID": user.member_set.get().id, "Library": library.name, "User": "*****"}]
+
+
+@pytest.mark.django_db
+class TestStatsCache:
+    def test_second_call_is_served_from_cache(self, admin_client, django_assert_num_queries):
+        baker.make("library.Genre", 3)
+
+        first = admin_client.get("/api/genres/stats/")
+        assert first["X-Stats-Cache"] == "miss"
+
+        with django_assert_num_queries(3):  # session + user + table versions
+            second = admin_client.get("/api/genres/stats/")
+        assert second["X-Stats-Cache"] == "hit"
+        assert second.json() == first.json()
+
+    def test_writes_invalidate(self, admin_client):
+        baker.make("library.Genre", 3)
+        admin_client.get("/api/genres/stats/")
+
+        baker.make("library.Genre")
+        r = admin_client.get("/api/genres/stats/")
+        assert r["X-Stats-Cache"] == "miss"
+        assert r.json()["count"] == 4
+
+    def test_rolled_back_writes_keep_the_cache(self, admin_client):
+        baker.make("library.Genre", 3)
+        admin_client.get("/api/genres/stats/")
+
+        with transaction.atomic():
+            baker.make("library.Genre")
+            transaction.set_rollback(True)
+        assert admin_client.get("/api/genres/stats/")["X-Stats-Cache"] == "hit"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_commits_on_another_connection_invalidate(self, admin_client):
+        baker.make("library.Genre", 3)
+        admin_client.get("/api/genres/stats/")
+
+        def add_genre():
+            # another worker: its own connection, and its own LocMemCache in production
+            try:
+                with transaction.atomic():
+                    Genre.objects.bulk_create([Genre(name="Сатира")])
+                    bump_version(Genre)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=add_genre)
+        worker.start()
+        worker.join()
+        r = admin_client.get("/api/genres/stats/")
+        assert r["X-Stats-Cache"] == "miss"
+        assert r.json()["count"] == 4
+
+    def test_rollup_rebuilds_invalidate(self, admin_client):
+        admin_client.get("/api/books/stats/")
+        call_command("rebuild_rollups", stdout=io.StringIO())
+        assert admin_client.get("/api/books/stats/")["X-Stats-Cache"] == "miss"
+
+    def test_timed_out_wait_keeps_the_owners_lock(self, admin_client, settings):
+        settings.STATS_CACHE_LOCK_TIMEOUT = 0
+        baker.make("library.Genre")
+        key = f"stats:{current_generation()}:genre:all"
+        cache.add(f"{key}:lock", "owner", 60)
+
+        r = admin_client.get("/api/genres/stats/")
+        assert r["X-Stats-Cache"] == "miss"
+        assert cache.get(f"{key}:lock") == "owner"
+
+    def test_scoped_per_user(self, admin_client, client, django_user_model):
+        baker.make("library.Loan", 2)
+        assert admin_client.get("/api/loans/stats/").json()["count"] == 2
+
+        client.force_login(django_user_model.objects.create_user("reader", password="x"))
+        r = client.get("/api/loans/stats/")
+        assert r["X-Stats-Cache"] == "miss"
+        assert r.json()["count"] == 0
+
+    def test_hit_miss_counters(self, admin_client):
+        admin_client.get("/api/books/stats/")
+        admin_client.get("/api/books/stats/")
+
+        assert admin_client.get("/api/stats-cache/").json() == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+@pytest.mark.django_db
+class TestMemberStats:
+    def test_single_query_matches_legacy(self, admin_client, django_user_model, django_assert_num_queries):
+        for i, (age, is_superuser) in enumerate([(20, False), (31, False), (None, False), (0, False), (50, True)]):
+            user = django_user_model.objects.create_user(f"user{i}", password="x", is_superuser=is_superuser)
+            UserProfile.objects.filter(user=user).update(age=age)
+            member = baker.make("library.Member", user=user)
+            for _ in range(i):
+                baker.make("library.Loan", member=member)
+
+        with django_assert_num_queries(4):  # session + user + table versions + the aggregate
+            r = admin_client.get("/api/members/stats/")
+        assert r.json() == legacy_member_stats(django_user_model.objects.all())
+        assert r.json()["avg_age_users"] == 25.5
+
+
+def rollup_snapshot():
+    from library.models import BookCirculation, GenreCirculation, LibraryCirculation, MemberCirculation
+    return {
+        model.__name__: {
+            row.pop("pk"): row
+            for row in model.objects.filter(~Q(**{f: 0 for f in fields})).values("pk", *fields)
+        }
+        for model, fields in [
+            (LibraryCirculation, ["book_count", "loan_count", "open_loan_count"]),
+            (GenreCirculation, ["book_count", "loan_count", "open_loan_count"]),
+            (BookCirculation, ["loan_count", "open_loan_count"]),
+            (MemberCirculation, ["loan_count", "open_loan_count"]),
+        ]
+    }
+
+
+@pytest.mark.django_db
+class TestCirculationRollups:
+    def test_loan_lifecycle_updates_counts(self):
+        book = baker.make("library.Book")
+        loan = baker.make("library.Loan", book=book, return_date=None)
+        circulation = book.library.circulation
+        circulation.refresh_from_db()
+        assert (circulation.book_count, circulation.loan_count, circulation.open_loan_count) == (1, 1, 1)
+
+        loan.return_date = "2024-10-10"
+        loan.save()
+        circulation.refresh_from_db()
+        assert (circulation.loan_count, circulation.open_loan_count) == (1, 0)
+
+        loan.delete()
+        circulation.refresh_from_db()
+        assert circulation.loan_count == 0
+        book.genre.circulation.refresh_from_db()
+        assert book.genre.circulation.book_count == 1
+
+    def test_incremental_matches_rebuild(self):
+        books = baker.make("library.Book", _quantity=3)
+        loans = [baker.make("library.Loan", book=books[i % 3], return_date=None) for i in range(7)]
+        loans[0].book = books[2]
+        loans[0].save()
+        loans[1].return_date = "2024-10-10"
+        loans[1].save()
+        books[1].library = baker.make("library.Library")
+        books[1].save()
+        books[0].delete()
+        loans[3].member.delete()
+
+        incremental = rollup_snapshot()
+        call_command("rebuild_rollups", stdout=io.StringIO())
+        assert rollup_snapshot() == incremental
+
+    def test_stats_read_rollups(self, admin_client, django_assert_max_num_queries):
+        busy, quiet = baker.make("library.Book", _quantity=2)
+        baker.make("library.Loan", book=busy, _quantity=3)
+        baker.make("library.Loan", book=quiet)
+
+        with django_assert_max_num_queries(5):  # session + user + table versions + total + top book
+            r = admin_client.get("/api/books/stats/")
+        assert r.json() == {"count": 2, "most_borrowed": {"id": busy.id, "title": busy.title, "borrow_count": 3}}
+        assert admin_client.get("/api/libraries/stats/").json()["top"] == busy.library.name
+        assert admin_client.get("/api/loans/stats/").json()["count"] == 4
+
+
+def loan_query_plan(queryset):
+    plan = queryset.explain()
+    full_scans = [line for line in plan.splitlines() if line.split(None, 3)[-1] == "SCAN library_loan"]
+    assert not full_scans, plan
+    return plan
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != "sqlite", reason="EXPLAIN QUERY PLAN is SQLite specific")
+class TestLoanQueryPlans:
+    @pytest.fixture
+    def member(self, django_user_model):
+        user = django_user_model.objects.create_user("reader", password="x")
+        return baker.make("library.Member", user=user)
+
+    def test_book_availability_uses_open_loan_index(self):
+        open_loans = Loan.objects.filter(book=OuterRef("pk"), return_date__isnull=True)
+        plan = loan_query_plan(Book.objects.filter(pk=1).annotate(busy=Exists(open_loans)))
+        assert "loan_open_book_idx" in plan
+
+    def test_open_loans_per_member_use_partial_index(self):
+        queryset = (
+            Loan.objects.filter(return_date__isnull=True)
+            .values("member__id", "member__first_name")
+            .annotate(loan_count=Count("id"))
+            .order_by("-loan_count")
+        )
+        assert "loan_open_member_idx" in loan_query_plan(queryset)
+
+    def test_returned_loans_use_partial_index(self):
+        assert "loan_returned_idx" in loan_query_plan(Loan.objects.filter(return_date__isnull=False).values("id"))
+
+    def test_member_loans_page(self, member):
+        queryset = Loan.objects.select_related("book", "member", "user").filter(member__user=member.user)
+        assert "loan_member_date_idx" in loan_query_plan(queryset.order_by("-loan_date", "-id")[:50])
+
+    def test_member_top_reader(self, member):
+        queryset = (
+            Loan.objects.filter(member__user=member.user)
+            .values("member__id", "member__first_name")
+            .annotate(loan_count=Count("id"))
+            .order_by("-loan_count")
+        )
+        assert "loan_member_date_idx" in loan_query_plan(queryset)
+
+    def test_date_range_uses_date_index(self):
+        queryset = Loan.objects.filter(loan_date__gte="2024-01-01", loan_date__lt="2024-02-01").order_by("loan_date", "id")
+        assert "loan_date_id_idx" in loan_query_plan(queryset)
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != "sqlite", reason="FTS5 index is SQLite specific")
+class TestBookSearch:
+    @pytest.fixture
+    def books(self):
+        prose = baker.make("library.Genre", name="Проза")
+        poetry = baker.make("library.Genre", name="Поэзия")
+        return {
+            "war": baker.make("library.Book", title="Война и мир", genre=prose),
+            "hedgehog": baker.make("library.Book", title="Ёжик в тумане", genre=prose),
+            "onegin": baker.make("library.Book", title="Евгений Онегин", genre=poetry),
+            "mir": baker.make("library.Book", title="Мирный атом", genre=poetry),
+        }
+
+    def titles(self, response):
+        return [row["title"] for row in response.json()["results"]]
+
+    def test_cyrillic_is_case_insensitive_and_prefix_matched(self, admin_client, books):
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "ВОЙН"})) == ["Война и мир"]
+
+    def test_yo_and_ye_match_each_other(self, admin_client, books):
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "ежик"})) == ["Ёжик в тумане"]
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "Ёвгений"})) == ["Евгений Онегин"]
+
+    def test_title_matches_rank_above_genre(self, admin_client, books):
+        baker.make("library.Book", title="Поэзия серебряного века", genre=books["war"].genre)
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "поэзия"}))[0] == "Поэзия серебряного века"
+
+    def test_list_filter_keeps_cursor_pagination(self, admin_client, books):
+        r = admin_client.get("/api/books/", {"q": "поэзия"})
+        assert sorted(self.titles(r)) == ["Евгений Онегин", "Мирный атом"]
+        assert r.json()["next"] is None
+
+    def test_index_follows_renames_and_deletes(self, admin_client, books):
+        books["onegin"].genre.name = "Роман в стихах"
+        books["onegin"].genre.save()
+        books["mir"].delete()
+        Book.objects.filter(pk=books["war"].pk).update(title="Анна Каренина")
+
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "роман"})) == ["Евгений Онегин"]
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "атом"})) == []
+        assert self.titles(admin_client.get("/api/books/search/", {"q": "каренина"})) == ["Анна Каренина"]
+
+    def test_empty_and_punctuation_queries(self, admin_client, books):
+        assert self.titles(admin_client.get("/api/books/search/", {"q": '"*)('})) == []
+        assert len(self.titles(admin_client.get("/api/books/", {"q": "  "}))) == len(books)
+
+
+@pytest.mark.django_db
+class TestAutocomplete:
+    def suggest(self, client, url, **params):
+        return [row.get("title") or row.get("first_name") for row in client.get(url, params).json()["results"]]
+
+    def test_prefix_matches_in_order(self, admin_client):
+        for title in ["Мастер и Маргарита", "Мать", "Ёлка", "Машенька", "Идиот"]:
+            baker.make("library.Book", title=title)
+
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="ма") == ["Мастер и Маргарита", "Мать", "Машенька"]
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="МА", limit=1) == ["Мастер и Маргарита"]
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="елк") == ["Ёлка"]
+
+    def test_index_follows_signals(self, admin_client):
+        book = baker.make("library.Book", title="Отцы и дети")
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="отц") == ["Отцы и дети"]
+
+        book.title = "Дым"
+        book.save()
+        baker.make("library.Book", title="Обломов")
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="о") == ["Обломов"]
+
+        book.delete()
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="д") == []
+
+    def test_rebuilds_when_another_process_changed_data(self, admin_client):
+        baker.make("library.Book", title="Бесы")
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="б") == ["Бесы"]
+
+        Book.objects.bulk_create([Book(title="Братья Карамазовы", genre=baker.make("library.Genre"), library=baker.make("library.Library"))])
+        bump_version(Book)
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="б") == ["Бесы", "Братья Карамазовы"]
+
+    def test_committed_writes_patch_the_index(self, django_capture_on_commit_callbacks, django_assert_num_queries):
+        baker.make("library.Book", title="Бесы")
+        book_titles.lookup("б")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make("library.Book", title="Братья Карамазовы")
+        with django_assert_num_queries(1):  # the version, no rebuild
+            assert [text for _, text, _ in book_titles.lookup("б")] == ["Бесы", "Братья Карамазовы"]
+
+    def test_rolled_back_writes_leave_no_entries(self, django_capture_on_commit_callbacks):
+        baker.make("library.Book", title="Бесы")
+        book_titles.lookup("б")
+
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                baker.make("library.Book", title="Братья Карамазовы")
+                transaction.set_rollback(True)
+        assert callbacks == []
+        assert [text for _, text, _ in book_titles.lookup("б")] == ["Бесы"]
+
+    def test_library_and_availability_filters(self, admin_client):
+        library = baker.make("library.Library")
+        lent = baker.make("library.Book", title="Тихий Дон", library=library)
+        baker.make("library.Book", title="Тарас Бульба", library=library)
+        baker.make("library.Book", title="Тёмные аллеи")
+        baker.make("library.Loan", book=lent, return_date=None)
+
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="т", library=library.id) == ["Тарас Бульба", "Тихий Дон"]
+        assert self.suggest(admin_client, "/api/books/autocomplete/", q="т", library=library.id, available="true") == ["Тарас Бульба"]
+
+    def test_members_are_private_for_regular_users(self, admin_client, client, django_user_model):
+        baker.make("library.Library")
+        baker.make("library.Member", first_name="Анна")
+        client.force_login(django_user_model.objects.create_user("андрей", password="x"))
+
+        assert self.suggest(admin_client, "/api/library-members/autocomplete/", q="ан") == ["андрей", "Анна"]
+        assert self.suggest(client, "/api/library-members/autocomplete/", q="ан") == ["андрей"]
+
+
+@pytest.mark.django_db
+class TestListFilters:
+    def ids(self, response):
+        assert response.status_code == 200, response.json()
+        return sorted(row["id"] for row in response.json()["results"])
+
+    def test_book_filters(self, admin_client):
+        library = baker.make("library.Library")
+        lent, free = baker.make("library.Book", library=library, title="Записки охотника", _quantity=2)
+        other = baker.make("library.Book", title="Записки из подполья")
+        baker.make("library.Loan", book=lent, return_date=None)
+
+        assert self.ids(admin_client.get("/api/books/", {"library": library.id})) == [lent.id, free.id]
+        assert self.ids(admin_client.get("/api/books/", {"library": library.id, "available": "true"})) == [free.id]
+        assert self.ids(admin_client.get("/api/books/", {"available": "false"})) == [lent.id]
+        assert self.ids(admin_client.get("/api/books/", {"genre": other.genre_id})) == [other.id]
+        assert self.ids(admin_client.get("/api/books/", {"title": "подпол"})) == [other.id]
+        assert self.ids(admin_client.get("/api/books/", {"title": "хотни"})) == [lent.id, free.id]
+        assert self.ids(admin_client.get("/api/books/", {"title_prefix": "ПОДПОЛ"})) == [other.id]
+        assert self.ids(admin_client.get("/api/books/", {"title_prefix": "хотни"})) == []
+
+    def test_loan_filters(self, admin_client):
+        book = baker.make("library.Book")
+        january = baker.make("library.Loan", book=book, loan_date="2024-01-15", return_date=None)
+        march = baker.make("library.Loan", loan_date="2024-03-01", return_date="2024-03-10")
+
+        assert self.ids(admin_client.get("/api/loans/", {"status": "open"})) == [january.id]
+        assert self.ids(admin_client.get("/api/loans/", {"status": "returned"})) == [march.id]
+        assert self.ids(admin_client.get("/api/loans/", {"loan_date_from": "2024-02-01"})) == [march.id]
+        assert self.ids(admin_client.get("/api/loans/", {"loan_date_to": "2024-01-31"})) == [january.id]
+        assert self.ids(admin_client.get("/api/loans/", {"member": march.member_id})) == [march.id]
+        assert self.ids(admin_client.get("/api/loans/", {"book": book.id})) == [january.id]
+        assert self.ids(admin_client.get("/api/loans/", {"library": book.library_id})) == [january.id]
+
+    def test_member_filter(self, admin_client):
+        member = baker.make("library.Member")
+        baker.make("library.Member")
+        assert self.ids(admin_client.get("/api/library-members/", {"library": member.library_id})) == [member.id]
+
+    @pytest.mark.parametrize("url,params", [
+        ("/api/books/", {"available": "maybe"}),
+        ("/api/books/", {"genre": "fiction"}),
+        ("/api/loans/", {"status": "lost"}),
+        ("/api/loans/", {"loan_date_from": "2024-02-01", "loan_date_to": "2024-01-01"}),
+        ("/api/library-members/", {"library": "0"}),
+    ])
+    def test_invalid_parameters_are_rejected(self, admin_client, url, params):
+        r = admin_client.get(url, params)
+        assert r.status_code == 400
+        assert set(r.json()) <= set(params)
+
+    def test_export_honours_filters(self, admin_client):
+        open_loan = baker.make("library.Loan", return_date=None)
+        baker.make("library.Loan", return_date="2024-03-10")
+        r = admin_client.get("/api/loans/export/", {"type": "ndjson", "status": "open"})
+        rows = [json.loads(line) for line in b"".join(r.streaming_content).splitlines()]
+        assert [row["ID"] for row in rows] == [open_loan.id]
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != "sqlite", reason="EXPLAIN QUERY PLAN is SQLite specific")
+class TestFilterQueryPlans:
+    def plan(self, filter_class, params, queryset, ordering):
+        serializer = filter_class(data=params)
+        serializer.is_valid(raise_exception=True)
+        plan = serializer.filter_queryset(queryset).order_by(*ordering)[:50].explain()
+        table = queryset.model._meta.db_table
+        assert not [line for line in plan.splitlines() if line.split(None, 3)[-1] == f"SCAN {table}"], plan
+        return plan
+
+    @pytest.mark.parametrize("params,index", [
+        ({"status": "open"}, "loan_open_date_idx"),
+        ({"loan_date_from": "2024-01-01", "loan_date_to": "2024-02-01"}, "loan_date_id_idx"),
+        ({"member": 1}, "loan_member_date_idx"),
+        ({"book": 1}, "loan_book_date_idx"),
+        ({"status": "open", "library": 1}, "loan_open_book_idx"),
+    ])
+    def test_loan_filters_are_indexed(self, params, index):
+        assert index in self.plan(LoanFilterSerializer, params, Loan.objects.all(), ("-loan_date", "-id"))
+
+    @pytest.mark.parametrize("params,index", [
+        ({"available": "false"}, "book_borrowed_idx"),
+        ({"library": 1, "available": "true"}, "book_library_available_idx"),
+        ({"genre": 1, "available": "true"}, "book_genre_available_idx"),
+        ({"title_prefix": "война"}, "library_book_fts"),
+    ])
+    def test_book_filters_are_indexed(self, params, index):
+        assert index in self.plan(BookFilterSerializer, params, Book.objects.all(), ("id",))
+
+
+@pytest.mark.django_db
+class TestBulkCreate:
+    def test_books_are_created_in_one_batch(self, admin_client, django_assert_max_num_queries):
+        genre, other_genre = baker.make("library.Genre", _quantity=2)
+        library = baker.make("library.Library")
+        payload = [{"title": f"Том {i}", "genre": (genre, other_genre)[i % 2].id, "library": library.id} for i in range(30)]
+        genres.all(), libraries.all()
+
+        with django_assert_max_num_queries(13):  # the reference versions are read once for the names
+            r = admin_client.post("/api/books/bulk/", payload, content_type="application/json")
+        assert r.status_code == 201
+        results = r.json()["results"]
+        assert [row["title"] for row in results] == [item["title"] for item in payload]
+        assert results[0]["genre_name"] == genre.name
+        assert Book.objects.filter(library=library).count() == 30
+
+        library.circulation.refresh_from_db()
+        assert library.circulation.book_count == 30
+        assert Book.objects.search("том", column="title").count() == 30
+        assert len(admin_client.get("/api/books/autocomplete/", {"q": "том", "limit": 50}).json()["results"]) == 30
+
+    def test_errors_are_reported_per_item_and_nothing_is_saved(self, admin_client):
+        genre = baker.make("library.Genre")
+        library = baker.make("library.Library")
+        payload = [
+            {"title": "Верный", "genre": genre.id, "library": library.id},
+            {"title": "Без жанра", "genre": 999999, "library": library.id},
+            {"genre": genre.id, "library": "x"},
+        ]
+
+        r = admin_client.post("/api/books/bulk/", payload, content_type="application/json")
+        assert r.status_code == 400
+        errors = r.json()["errors"]
+        assert errors[0] == {}
+        assert list(errors[1]) == ["genre"]
+        assert set(errors[2]) == {"title", "library"}
+        assert not Book.objects.exists()
+
+    def test_rejects_non_list_payload(self, admin_client):
+        r = admin_client.post("/api/books/bulk/", {"title": "x"}, content_type="application/json")
+        assert r.status_code == 400
+
+    def test_loans_keep_derived_state(self, admin_client, django_user_model):
+        books = baker.make("library.Book", _quantity=3)
+        member = baker.make("library.Member")
+        admin_client.get("/api/loans/stats/")
+        payload = [{"book": book.id, "member": member.id, "loan_date": "2024-05-01"} for book in books]
+
+        r = admin_client.post("/api/loans/bulk/", payload, content_type="application/json")
+        assert r.status_code == 201
+        assert [row["book_title"] for row in r.json()["results"]] == [book.title for book in books]
+
+        assert not Book.objects.filter(pk__in=[book.pk for book in books], is_available=True).exists()
+        assert Loan.objects.filter(user__username="admin").count() == 3
+        member.circulation.refresh_from_db()
+        assert (member.circulation.loan_count, member.circulation.open_loan_count) == (3, 3)
+        stats = admin_client.get("/api/loans/stats/")
+        assert stats["X-Stats-Cache"] == "miss"
+        assert stats.json()["count"] == 3
+
+
+@pytest.mark.django_db
+class TestLoanReturn:
+    def test_single_return(self, admin_client):
+        loan = baker.make("library.Loan", return_date=None)
+        r = admin_client.post(f"/api/loans/{loan.id}/return/")
+        assert r.status_code == 200
+        loan.refresh_from_db()
+        assert loan.return_date is not None
+        assert admin_client.post(f"/api/loans/{loan.id}/return/").status_code == 400
+
+    def test_bulk_return(self, admin_client, django_assert_max_num_queries):
+        member = baker.make("library.Member")
+        books = baker.make("library.Book", _quantity=20)
+        loans = [baker.make("library.Loan", book=book, member=member, return_date=None) for book in books]
+        returned = baker.make("library.Loan", return_date="2024-01-01")
+        ids = [loan.id for loan in loans] + [returned.id, 999999]
+
+        with django_assert_max_num_queries(13):  # independent of the number of loans
+            r = admin_client.post("/api/loans/bulk-return/", {"ids": ids, "return_date": "2024-06-01"},
+                                  content_type="application/json")
+        assert r.json() == {
+            "returned": sorted(loan.id for loan in loans),
+            "already_returned": [returned.id],
+            "not_found": [999999],
+        }
+        assert Loan.objects.filter(return_date="2024-06-01").count() == 20
+        assert Book.objects.filter(pk__in=[book.pk for book in books], is_available=True).count() == 20
+
+        member.circulation.refresh_from_db()
+        assert (member.circulation.loan_count, member.circulation.open_loan_count) == (20, 0)
+        incremental = rollup_snapshot()
+        call_command("rebuild_rollups", stdout=io.StringIO())
+        assert rollup_snapshot() == incremental
+
+    def test_bulk_return_is_scoped_to_own_loans(self, client, django_user_model):
+        user = django_user_model.objects.create_user("reader", password="x")
+        own = baker.make("library.Loan", member=baker.make("library.Member", user=user), return_date=None)
+        foreign = baker.make("library.Loan", return_date=None)
+        client.force_login(user)
+
+        r = client.post("/api/loans/bulk-return/", {"ids": [own.id, foreign.id]}, content_type="application/json")
+        assert r.json()["returned"] == [own.id]
+        assert r.json()["not_found"] == [foreign.id]
+        foreign.refresh_from_db()
+        assert foreign.return_date is None
+
+    def test_bulk_return_validates_ids(self, admin_client):
+        r = admin_client.post("/api/loans/bulk-return/", {"ids": []}, content_type="application/json")
+        assert r.status_code == 400
+        assert "ids" in r.json()
+
+
+@pytest.mark.django_db
+class TestGenerateData:
+    def test_scaled_generation(self):
+        from library.models import BookCirculation, LibraryCirculation, Member
+
+        call_command(
+            "generate_data", "--libraries", "3", "--books", "300", "--members", "60", "--loans", "2000",
+            "--seed", "1", "--batch-size", "500", stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+        assert (Book.objects.count(), Member.objects.count(), Loan.objects.count()) == (300, 60, 2000)
+        assert not Loan.objects.exclude(member__library_id=F("book__library_id")).exists()
+
+        open_loans = Loan.objects.filter(return_date__isnull=True).count()
+        assert 0 < open_loans < 400
+        assert not Book.objects.availability_mismatches().exists()
+        assert sum(LibraryCirculation.objects.values_list("loan_count", flat=True)) == 2000
+        busiest = BookCirculation.objects.order_by("-loan_count").values_list("loan_count", flat=True)
+        assert busiest[0] > 5 * busiest[len(busiest) // 2]
+
+        title = Book.objects.first().title
+        assert Book.objects.search(title).exists()
+
+    def test_loans_are_deterministic(self):
+        from library.management.commands.generate_data import generate_loan_chunk, init_loan_worker
+
+        libraries = [([1, 2, 3], [10, 11]), ([4, 5], [12])]
+        init_loan_worker(libraries, 42, date(2025, 1, 1))
+        first = generate_loan_chunk((3, 100))
+        init_loan_worker(libraries, 42, date(2025, 1, 1))
+        assert generate_loan_chunk((3, 100)) == first
+        assert generate_loan_chunk((4, 100)) != first
+
+    def test_demo_generation(self):
+        call_command("generate_data", "--seed", "1", stdout=io.StringIO(), stderr=io.StringIO())
+        assert Loan.objects.count() == 1000
+        assert not Book.objects.availability_mismatches().exists()
+
+
+@pytest.mark.django_db
+class TestEndpointBudgets:
+    def test_query_counts_match_baseline(self):
+        # timings and memory depend on the machine and are checked by `benchmark endpoints`
+        call_command(
+            "generate_data", "--libraries=2", "--books=60", "--members=20", "--loans=300", "--seed=0",
+            stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+        measured = benchmarks.run_endpoint_suite(benchmarks.benchmark_superuser(), repeats=1, trace_memory=False)
+        budgets = benchmarks.load_baseline()["scales"]["small"]
+        assert benchmarks.check_budgets(measured, budgets, {}, metrics=("status", "queries")) == []
+
+    def test_exceeded_budget_is_reported(self):
+        measured = {"books.list": {"status": 200, "queries": 3, "p50_ms": 40.0}}
+        budgets = {"books.list": {"status": 200, "queries": 1, "p50_ms": 10.0}}
+        violations = benchmarks.check_budgets(measured, budgets, {"p50_ms": [1.5, 5]})
+        assert violations == ["books.list: queries 3 > 1", "books.list: p50_ms 40.0 > 20.0"]
+        assert benchmarks.check_budgets({"new.list": {}}, {}, {}) == ["new.list: no budget in the baseline"]
+
+
+def server_timing(response):
+    metrics = {}
+    for entry in response["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+@pytest.mark.django_db
+class TestServerTiming:
+    def test_header_reports_queries_and_phases(self, admin_client):
+        baker.make("library.Book", _quantity=5)
+        with CaptureQueriesContext(connection) as ctx:
+            r = admin_client.get("/api/books/")
+
+        metrics = server_timing(r)
+        assert metrics["db"]["desc"] == f'"{len(ctx.captured_queries)} queries"'
+        assert float(metrics["serialize"]["dur"]) > 0
+        assert float(metrics["render"]["dur"]) > 0
+        assert float(metrics["total"]["dur"]) >= float(metrics["db"]["dur"])
+
+    def test_structured_log(self, admin_client, settings, caplog):
+        import logging
+
+        settings.SERVER_TIMING_LOG = True
+        logger = logging.getLogger("library.timing")
+        logger.addHandler(caplog.handler)
+        try:
+            admin_client.get("/api/genres/")
+        finally:
+            logger.removeHandler(caplog.handler)
+
+        entry = json.loads(caplog.records[-1].getMessage())
+        assert entry["path"] == "/api/genres/"
+        assert entry["status"] == 200
+        assert entry["queries"] >= 1
+
+    def test_can_be_disabled(self, admin_client, settings):
+        settings.SERVER_TIMING = False
+        assert "Server-Timing" not in admin_client.get("/api/genres/")
+
+
+@pytest.fixture(autouse=True)
+def metrics_store(settings, tmp_path):
+    from library.metrics import process_metrics
+
+    settings.METRICS_DIR = tmp_path
+    process_metrics.reset()
+    yield tmp_path
+    process_metrics.reset()
+
+
+def metric_samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    def test_requests_are_labelled_by_viewset_action(self, admin_client, metrics_store):
+        admin_client.get("/api/loans/stats/")
+        admin_client.get("/api/loans/stats/")
+        r = admin_client.get("/api/metrics")
+        assert r["Content-Type"].startswith("text/plain; version=0.0.4")
+
+        samples = metric_samples(r.content.decode())
+        assert samples['library_http_requests_total{endpoint="loan.stats",status="200"}'] == 2
+        assert samples['library_http_request_duration_seconds_count{endpoint="loan.stats"}'] == 2
+        assert samples['library_http_request_duration_seconds_bucket{endpoint="loan.stats",le="+Inf"}'] == 2
+        assert samples['library_db_queries_total{endpoint="loan.stats"}'] > 0
+        assert samples['library_cache_hit_ratio{cache="stats"}'] == 0.5
+        # the scrape itself is still running
+        assert samples["library_http_requests_in_flight"] == 1
+
+    def test_export_bytes(self, admin_client, metrics_store):
+        baker.make("library.Genre", _quantity=3)
+        r = admin_client.get("/api/genres/export/", {"type": "csv"})
+        size = len(b"".join(r.streaming_content))
+
+        samples = metric_samples(admin_client.get("/api/metrics").content.decode())
+        assert samples['library_export_bytes_total{type="csv"}'] == size
+
+    def test_otp_lookups_count_present_keys_as_hits(self, admin_client, django_user_model, metrics_store):
+        admin = django_user_model.objects.get(username="admin")
+        admin_client.get("/api/userprofile/otp-status/")
+        cache.set(f"otp_good_{admin.id}", False)
+        assert admin_client.get("/api/userprofile/otp-status/").json() == {"otp_good": False}
+
+        samples = metric_samples(admin_client.get("/api/metrics").content.decode())
+        assert samples['library_cache_requests_total{cache="otp",result="miss"}'] == 1
+        assert samples['library_cache_requests_total{cache="otp",result="hit"}'] == 1
+
+    def test_sums_process_files(self, admin_client, metrics_store):
+        dead = {
+            "pid": 2 ** 22 + 1,
+            "counters": {"library_cache_requests_total": {'[["cache", "otp"], ["result", "hit"]]': 3}},
+            "gauges": {"library_http_requests_in_flight": {"[]": 5}},
+            "histograms": {},
+        }
+        (metrics_store / "other.json").write_text(json.dumps(dead))
+
+        samples = metric_samples(admin_client.get("/api/metrics").content.decode())
+        # counters of finished workers still count, their gauges don't
+        assert samples['library_cache_requests_total{cache="otp",result="hit"}'] == 3
+        assert samples['library_cache_hit_ratio{cache="otp"}'] == 1
+        assert samples["library_http_requests_in_flight"] == 1
+
+
+    def test_only_staff_and_allowed_addresses(self, client, django_user_model, settings, metrics_store):
+        assert client.get("/api/metrics").status_code == 403
+        client.force_login(django_user_model.objects.create_user("reader", password="x"))
+        assert client.get("/api/metrics").status_code == 403
+
+        settings.METRICS_ALLOWED_IPS = ["10.0.0.5"]
+        client.logout()
+        assert client.get("/api/metrics", REMOTE_ADDR="10.0.0.5").status_code == 200
+
+    def test_finished_processes_are_folded_into_totals(self, admin_client, metrics_store):
+        from library.metrics import TOTALS_FILE, compact_finished_processes
+
+        for index in range(2):
+            dead = {
+                "pid": 2 ** 22 + 1 + index,
+                "counters": {"library_export_bytes_total": {'[["type", "csv"]]': 10}},
+                "gauges": {},
+                "histograms": {"library_http_request_duration_seconds": {'[["endpoint", "x"]]': {
+                    "buckets": [1, 1], "le": [0.1, 1.0], "sum": 0.05, "count": 1,
+                }}},
+            }
+            (metrics_store / f"dead-{index}.json").write_text(json.dumps(dead))
+        compact_finished_processes()
+        compact_finished_processes()
+
+        assert not any(path.name.startswith("dead-") for path in metrics_store.glob("*.json"))
+        assert (metrics_store / TOTALS_FILE).exists()
+        samples = metric_samples(admin_client.get("/api/metrics").content.decode())
+        assert samples['library_export_bytes_total{type="csv"}'] == 20
+        assert samples['library_http_request_duration_seconds_count{endpoint="x"}'] == 2
+
+    def test_compaction_skips_while_locked(self, metrics_store):
+        from library.metrics import LOCK_FILE, compact_finished_processes
+
+        dead = {"pid": 2 ** 22 + 1, "counters": {}, "gauges": {}, "histograms": {}}
+        (metrics_store / "dead.json").write_text(json.dumps(dead))
+        (metrics_store / LOCK_FILE).touch()
+        compact_finished_processes()
+        assert (metrics_store / "dead.json").exists()
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+    def test_matching_etag_skips_query_and_serializer(self, admin_client, django_assert_num_queries):
+        baker.make("library.Book", _quantity=3)
+        r = admin_client.get("/api/books/")
+        etag = r["ETag"]
+        assert r["Cache-Control"] == "private, no-cache"
+
+        with django_assert_num_queries(3):  # session + user + table versions
+            r = admin_client.get("/api/books/", HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 304
+        assert r["ETag"] == etag
+        assert r.content == b""
+
+    def test_writes_change_the_etag(self, admin_client):
+        book = baker.make("library.Book")
+        etag = admin_client.get(f"/api/books/{book.id}/")["ETag"]
+
+        # availability changes through a loan, not through the book itself
+        loan = baker.make("library.Loan", book=book, return_date=None)
+        r = admin_client.get(f"/api/books/{book.id}/", HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 200
+        assert r.json()["is_available"] is False
+
+        etag = r["ETag"]
+        admin_client.post("/api/loans/bulk-return/", {"ids": [loan.id]}, content_type="application/json")
+        assert admin_client.get(f"/api/books/{book.id}/", HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    def test_bulk_create_changes_the_etag(self, admin_client):
+        genre, library = baker.make("library.Genre"), baker.make("library.Library")
+        etag = admin_client.get("/api/books/")["ETag"]
+        admin_client.post(
+            "/api/books/bulk/", [{"title": "Мы", "genre": genre.id, "library": library.id}], content_type="application/json"
+        )
+        assert admin_client.get("/api/books/", HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    def test_etag_changes_with_the_user_scope(self, client, django_user_model):
+        baker.make("library.Loan", _quantity=2)
+        user = django_user_model.objects.create_user("reader", password="x")
+        client.force_login(user)
+        etag = client.get("/api/loans/")["ETag"]
+
+        django_user_model.objects.filter(pk=user.pk).update(is_superuser=True)
+        r = client.get("/api/loans/", HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 200
+        assert len(r.json()["results"]) == 2
+
+    def test_etag_depends_on_user_and_query(self, admin_client, client, django_user_model):
+        baker.make("library.Loan", _quantity=2)
+        client.force_login(django_user_model.objects.create_user("reader", password="x"))
+
+        etag = admin_client.get("/api/loans/")["ETag"]
+        assert client.get("/api/loans/", HTTP_IF_NONE_MATCH=etag).status_code == 200
+        assert admin_client.get("/api/loans/", {"status": "open"}, HTTP_IF_NONE_MATCH=etag).status_code == 200
+        assert admin_client.get("/api/loans/", HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code == 304
+
+
+@pytest.mark.django_db
+class TestReferenceCache:
+    def test_list_and_retrieve_come_from_the_snapshot(self, admin_client, django_assert_num_queries):
+        for name in ("Проза", "Драма", "Лирика"):
+            baker.make("library.Genre", name=name)
+        genres.all()
+
+        with django_assert_num_queries(3):  # session + user + table versions
+            r = admin_client.get("/api/genres/", {"with_count": "1"})
+        data = r.json()
+        assert [row["name"] for row in data["results"]] == ["Драма", "Лирика", "Проза"]
+        assert data["count"] == 3
+        assert data["next"] is None and data["previous"] is None
+
+        genre = Genre.objects.get(name="Лирика")
+        with django_assert_num_queries(3):
+            r = admin_client.get(f"/api/genres/{genre.id}/")
+        assert r.json() == {"id": genre.id, "name": "Лирика", "user": None}
+        assert admin_client.get("/api/genres/0/").status_code == 404
+
+    def test_pages_with_a_cursor_use_the_database(self, admin_client):
+        baker.make("library.Library", _quantity=5)
+
+        first = admin_client.get("/api/libraries/", {"page_size": 2}).json()
+        second = admin_client.get(first["next"]).json()
+        everything = admin_client.get("/api/libraries/").json()["results"]
+        assert first["results"] + second["results"] == everything[:4]
+
+    def test_saving_refreshes_the_names(self, admin_client):
+        book = baker.make("library.Book")
+        assert admin_client.get(f"/api/books/{book.id}/").json()["genre_name"] == book.genre.name
+
+        book.genre.name = "Переименованный"
+        book.genre.save()
+        assert admin_client.get(f"/api/books/{book.id}/").json()["genre_name"] == "Переименованный"
+
+    def test_other_processes_reload_on_version_change(self):
+        library = baker.make("library.Library", name="Старое")
+        assert libraries.get(library.id).name == "Старое"
+
+        # another worker renames it: the row changes without this process hearing about it
+        Library.objects.filter(pk=library.id).update(name="Новое")
+        assert libraries.get(library.id).name == "Старое"
+        bump_version(Library)
+        assert libraries.get(library.id).name == "Новое"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_commits_on_another_connection_reload_the_snapshot(self):
+        library = baker.make("library.Library", name="Старое")
+        assert libraries.get(library.id).name == "Старое"
+
+        def rename():
+            # what a write in another worker leaves behind: its own connection, its own caches
+            try:
+                with transaction.atomic():
+                    Library.objects.filter(pk=library.id).update(name="Новое")
+                    bump_version(Library)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=rename)
+        worker.start()
+        worker.join()
+        assert libraries.get(library.id).name == "Новое"
+
+    def test_one_version_read_per_request(self, django_assert_num_queries):
+        library = baker.make("library.Library")
+        genres.all(), libraries.all()
+        with versions_scope(), django_assert_num_queries(1):
+            assert libraries.get(library.id).name == library.name
+            genres.all()
+            genres.all()
+
+    def test_snapshot_is_immutable(self):
+        library = baker.make("library.Library", name="Центральная")
+        row = libraries.get(library.id)
+        with pytest.raises(AttributeError):
+            row.name = "Другая"
+        with pytest.raises(TypeError):
+            libraries.snapshot().by_id[library.id] = row
+
+    def test_new_users_join_the_first_library(self, django_user_model):
+        first, _ = baker.make("library.Library", _quantity=2)
+        user = django_user_model.objects.create_user("reader", password="x")
+        assert Member.objects.get(user=user).library_id == first.id
+
+
+@pytest.mark.django_db
+class TestSparseFieldsets:
+    def test_only_requested_fields_are_rendered_and_loaded(self, admin_client):
+        baker.make("library.Book", _quantity=3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            r = admin_client.get("/api/books/", {"fields": "id,title"})
+        assert r.status_code == 200
+        assert all(set(row) == {"id", "title"} for row in r.json()["results"])
+        page_sql = ctx.captured_queries[-1]["sql"]
+        assert '"library_book"."title"' in page_sql
+        assert '"library_book"."cover"' not in page_sql
+
+    def test_exclude(self, admin_client):
+        book = baker.make("library.Book")
+        r = admin_client.get(f"/api/books/{book.id}/", {"exclude": "cover,cover_url,genre_name"})
+        assert set(r.json()) == {"id", "title", "genre", "library", "library_name", "thumb_url", "is_available"}
+
+    def test_unknown_fields_are_rejected(self, admin_client):
+        r = admin_client.get("/api/loans/", {"fields": "id,secret", "exclude": "nothing"})
+        assert r.status_code == 400
+        assert r.json() == {"fields": ["Unknown fields: secret."], "exclude": ["Unknown fields: nothing."]}
+
+    def test_cursor_pages_work_without_the_ordering_fields(self, admin_client, django_assert_num_queries):
+        loans = baker.make("library.Loan", _quantity=5)
+
+        seen = []
+        data = admin_client.get("/api/loans/", {"fields": "book_title", "page_size": 2}).json()
+        while True:
+            seen += [row["book_title"] for row in data["results"]]
+            if not data["next"]:
+                break
+            with django_assert_num_queries(4):  # session + user + table versions + page
+                data = admin_client.get(data["next"]).json()
+        assert sorted(seen) == sorted(loan.book.title for loan in loans)
+
+    def test_dropping_a_related_field_drops_its_queries(self, admin_client, django_assert_num_queries):
+        baker.make("auth.User", _quantity=5)
+
+        with django_assert_num_queries(4):  # session + user + table versions + page, no profile per user
+            r = admin_client.get("/api/members/", {"fields": "id,username"})
+        assert all(set(row) == {"id", "username"} for row in r.json()["results"])
+
+    def test_writes_ignore_the_parameters(self, admin_client):
+        genre, library = baker.make("library.Genre"), baker.make("library.Library")
+        r = admin_client.post(
+            "/api/books/?fields=id", {"title": "Мы", "genre": genre.id, "library": library.id}, content_type="application/json"
+        )
+        assert r.status_code == 201
+        assert r.json()["title"] == "Мы"
+
+
+@pytest.mark.django_db
+class TestFastLists:
+    def compare(self, client, url, params):
+        with override_settings(FAST_LISTS=True):
+            fast = client.get(url, params)
+        slow = client.get(url, params)
+        assert fast.status_code == slow.status_code == 200
+        assert fast.content == slow.content
+        return fast.json()
+
+    def test_output_matches_the_serializers(self, admin_client, client, django_user_model, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        loans = baker.make("library.Loan", _quantity=5)
+        Loan.objects.filter(pk=loans[0].pk).update(return_date=date(2024, 1, 2))
+        loans[1].book.cover.save("cover.png", ContentFile(b"png"))
+        member = loans[2].member
+        member.user = django_user_model.objects.create_user("reader", password="x")
+        member.photo.save("photo.png", ContentFile(b"png"))
+        client.force_login(member.user)
+
+        for user_client in (admin_client, client):
+            for url in ("/api/books/", "/api/loans/", "/api/genres/", "/api/libraries/", "/api/library-members/"):
+                for params in ({}, {"with_count": "1"}, {"exclude": "id"}):
+                    self.compare(user_client, url, params)
+
+                data = self.compare(user_client, url, {"page_size": 2})
+                while data["next"]:
+                    data = self.compare(user_client, data["next"], {})
+
+    def test_members_without_a_user_skip_the_user_name(self, admin_client):
+        baker.make("library.Member", user=None)
+        row = self.compare(admin_client, "/api/library-members/", {})["results"][0]
+        assert "user_name" not in row and row["user"] is None
+
+    def test_sparse_fields(self, admin_client):
+        baker.make("library.Loan", _quantity=3)
+        data = self.compare(admin_client, "/api/loans/", {"fields": "book_title,library"})
+        assert all(set(row) == {"book_title", "library"} for row in data["results"])
+
+    def test_unsupported_fields_take_the_serializer_path(self):
+        class TitleSerializer(serializers.ModelSerializer):
+            shout = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Book
+                fields = ["id", "shout"]
+
+            def get_shout(self, obj):
+                return obj.title.upper()
+
+        assert fast_lists.compile_plan(TitleSerializer(), Book) is None
+        plan = fast_lists.compile_plan(BookSerializer(), Book)
+        assert plan.columns == ["id", "title", "genre", "library", "cover", "cover_thumb", "is_available"]
+
+
+def image_bytes(size=(1200, 800), image_format="PNG"):
+    output = io.BytesIO()
+    Image.new("RGB", size, "teal").save(output, image_format)
+    return output.getvalue()
+
+
+@pytest.mark.django_db
+class TestThumbnails:
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        return tmp_path
+
+    def test_uploaded_cover_gets_a_thumbnail(self, admin_client, media_root):
+        genre, library = baker.make("library.Genre"), baker.make("library.Library")
+        cover = SimpleUploadedFile("cover.png", image_bytes(), content_type="image/png")
+        r = admin_client.post("/api/books/", {"title": "Мы", "genre": genre.id, "library": library.id, "cover": cover})
+        assert r.status_code == 201
+
+        book = Book.objects.get(pk=r.json()["id"])
+        assert book.cover_thumb.name == book.cover.name.rsplit(".", 1)[0] + ".thumb.webp"
+        assert r.json()["thumb_url"].endswith(book.cover_thumb.url)
+        with Image.open(media_root / book.cover_thumb.name) as thumb:
+            assert thumb.format == "WEBP"
+            assert thumb.size == (320, 213)
+
+    def test_replacing_and_clearing_the_photo(self, media_root):
+        member = baker.make("library.Member")
+        member.photo.save("first.png", ContentFile(image_bytes()))
+        first_thumb = member.photo_thumb.name
+        assert (media_root / first_thumb).exists()
+
+        member.photo.save("second.jpg", ContentFile(image_bytes(image_format="JPEG")))
+        assert member.photo_thumb.name.endswith("second.thumb.webp")
+        assert not (media_root / first_thumb).exists()
+
+        second_thumb = member.photo_thumb.name
+        member.photo = None
+        member.save()
+        assert not Member.objects.get(pk=member.pk).photo_thumb
+        assert not (media_root / second_thumb).exists()
+
+    def test_broken_images_keep_the_upload(self):
+        book = baker.make("library.Book")
+        book.cover.save("broken.png", ContentFile(b"not an image"))
+        book.refresh_from_db()
+        assert book.cover and not book.cover_thumb
+
+    def test_jpeg_format(self, settings):
+        settings.THUMBNAIL_FORMAT = "JPEG"
+        book = baker.make("library.Book")
+        book.cover.save("cover.png", ContentFile(image_bytes(size=(100, 100))))
+        assert book.cover_thumb.name.endswith(".thumb.jpg")
+        with Image.open(book.cover_thumb.path) as thumb:
+            assert thumb.format == "JPEG" and thumb.size == (100, 100)
+
+    def test_backfill_command(self, media_root):
+        books = baker.make("library.Book", _quantity=3)
+        baker.make("library.Book")
+        for book in books:
+            name = default_storage.save(f"books/{book.pk}.png", ContentFile(image_bytes()))
+            # existing media from before thumbnails: no signals ran for it
+            Book.objects.filter(pk=book.pk).update(cover=name)
+
+        out = io.StringIO()
+        call_command("generate_thumbnails", "--model", "books", stdout=out)
+        assert "books: создано 3, не удалось 0" in out.getvalue()
+        assert all(book.cover_thumb for book in Book.objects.filter(pk__in=[book.pk for book in books]))
+
+        out = io.StringIO()
+        call_command("generate_thumbnails", stdout=out)
+        assert "books: создано 0" in out.getvalue()
+        call_command("generate_thumbnails", "--force", stdout=out)
+        assert "books: создано 3" in out.getvalue()
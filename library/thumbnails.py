@@ -0,0 +1,93 @@
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from library.models import Book, Member
+
+
+logger = logging.getLogger(__name__)
+
+# model: (original image field, thumbnail field)
+THUMBNAILS = {
+    Book: ('cover', 'cover_thumb'),
+    Member: ('photo', 'photo_thumb'),
+}
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def thumbnail_size():
+    return tuple(getattr(settings, 'THUMBNAIL_SIZE', (320, 320)))
+
+
+def thumbnail_format():
+    image_format = getattr(settings, 'THUMBNAIL_FORMAT', 'WEBP').upper()
+    # Pillow can be built without libwebp
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def thumbnail_name(name):
+    # books/cover.png -> books/cover.thumb.webp, next to the original
+    root, _ = posixpath.splitext(name)
+    return f'{root}.thumb.{EXTENSIONS[thumbnail_format()]}'
+
+
+def render_thumbnail(source):
+    with Image.open(source) as image:
+        # phone photos are stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(image)
+        image_format = thumbnail_format()
+        if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if image_format == 'JPEG' else 'RGBA')
+        image.thumbnail(thumbnail_size(), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, image_format, quality=80)
+    return output.getvalue()
+
+
+def delete_thumbnail(field_file):
+    if field_file and field_file.storage.exists(field_file.name):
+        field_file.storage.delete(field_file.name)
+
+
+def update_thumbnail(instance, force=False):
+    """Brings the thumbnail of instance in line with its image, returns True when it changed.
+
+    The thumbnail is written with a name derived from the original, so an up to date one
+    is recognised by its name alone.
+    """
+    source_field, thumb_field = THUMBNAILS[type(instance)]
+    source, thumb = getattr(instance, source_field), getattr(instance, thumb_field)
+
+    if not source:
+        if not thumb:
+            return False
+        delete_thumbnail(thumb)
+        name = ''
+    else:
+        name = thumbnail_name(source.name)
+        if thumb.name == name and not force:
+            return False
+        try:
+            with source.open('rb') as original:
+                content = render_thumbnail(original)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as error:
+            logger.warning("Thumbnail for %s %s failed: %s", type(instance).__name__, instance.pk, error)
+            return False
+        if thumb.name != name:
+            delete_thumbnail(thumb)
+        # overwrite, so that the storage keeps the derived name
+        if thumb.storage.exists(name):
+            thumb.storage.delete(name)
+        name = thumb.storage.save(name, ContentFile(content))
+
+    # an update, the save that got us here has already run its signals
+    type(instance).objects.filter(pk=instance.pk).update(**{thumb_field: name})
+    setattr(instance, thumb_field, name)
+    return True
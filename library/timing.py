@@ -0,0 +1,146 @@
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+def timing_enabled():
+    return getattr(settings, 'SERVER_TIMING', True)
+
+
+def timing_logged():
+    return getattr(settings, 'SERVER_TIMING_LOG', False)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = False
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - started
+
+    def metrics(self, total):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db * 1000, 2),
+            'serialize_ms': round(self.serialize * 1000, 2),
+            'render_ms': round(self.render * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+
+    def header(self, total):
+        metrics = self.metrics(total)
+        return ', '.join([
+            f'db;dur={metrics["db_ms"]};desc="{self.queries} queries"',
+            f'serialize;dur={metrics["serialize_ms"]}',
+            f'render;dur={metrics["render_ms"]}',
+            f'total;dur={metrics["total_ms"]}',
+        ])
+
+
+@contextmanager
+def request_timings():
+    # nested middlewares share the timings of the outermost one
+    timings = current_timings.get()
+    if timings is not None:
+        yield timings
+        return
+
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings.record_query))
+            yield timings
+    finally:
+        current_timings.reset(token)
+
+
+@contextmanager
+def timed_serialization():
+    timings = current_timings.get()
+    if timings is None or timings.serializing:
+        yield
+        return
+
+    timings.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - started
+        timings.serializing = False
+
+
+class TimedSerializerMixin:
+    """Adds the time spent in to_representation to the current request's timings.
+
+    Only the outermost serializer is timed, nested ones are part of it. The time includes
+    the queries that serialization triggers, which are also counted under db.
+    """
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class ServerTimingMiddleware:
+    """Reports query count, DB, serializer and renderer time in a Server-Timing header.
+
+    Streaming responses (exports) get the header before their body is produced, so the
+    queries that run while streaming are not included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not timing_enabled():
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with request_timings() as timings:
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = timings.header(total)
+        if timing_logged():
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **timings.metrics(total),
+            }))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, the callback marks the end
+        timings = current_timings.get()
+        if timings is None:
+            return response
+        started = time.perf_counter()
+
+        def rendered(response):
+            timings.render += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
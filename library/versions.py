@@ -0,0 +1,118 @@
+import hashlib
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+
+from library.models import TableVersion
+
+
+# table: version, the versions already read by the current request
+current_versions = ContextVar('current_versions', default=None)
+
+
+def table_name(model):
+    # a model, or the name of a counter that belongs to no single table
+    return model if isinstance(model, str) else model._meta.label_lower
+
+
+def user_scope(user):
+    return 'all' if user.is_superuser else f'user:{user.pk}'
+
+
+def bump_version(model):
+    versions = TableVersion.objects.filter(table=table_name(model))
+    if not versions.update(version=F('version') + 1):
+        TableVersion.objects.bulk_create([TableVersion(table=table_name(model))], ignore_conflicts=True)
+        versions.update(version=F('version') + 1)
+    seen = current_versions.get()
+    if seen is not None:
+        seen.pop(table_name(model), None)
+
+
+def table_versions(models):
+    tables = sorted({table_name(model) for model in models})
+    seen = current_versions.get()
+    if seen is None:
+        seen = {}
+    missing = [table for table in tables if table not in seen]
+    if missing:
+        found = dict(TableVersion.objects.filter(table__in=missing).values_list('table', 'version'))
+        seen.update({table: found.get(table, 0) for table in missing})
+    return {table: seen[table] for table in tables}
+
+
+@contextmanager
+def versions_scope():
+    token = current_versions.set({})
+    try:
+        yield
+    finally:
+        current_versions.reset(token)
+
+
+class TableVersionMiddleware:
+    """Reads every table version at most once per request.
+
+    The ETag and the reference snapshots ask for the same versions, within a request they
+    share one read. Writes through bump_version drop the version they changed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with versions_scope():
+            return self.get_response(request)
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison
+    candidates = {candidate.strip().removeprefix('W/') for candidate in header.split(',')}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+
+class ConditionalGetMixin:
+    """ETags for list and retrieve, built from the versions of the tables in etag_models.
+
+    The versions are read before the main query, so a write that lands in between can only
+    make the ETag older than the data, never newer. A matching If-None-Match is answered
+    with 304 without running the main query or the serializer.
+    """
+
+    etag_models = ()
+
+    def get_etag(self, request):
+        key = json.dumps([
+            request.get_full_path(),
+            # what the user may see, not just who it is: promotions change the rows
+            request.user.pk,
+            user_scope(request.user),
+            request.accepted_renderer.format,
+            table_versions(self.etag_models),
+        ])
+        return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        # the browser keeps the copy but asks every time, which is where the 304 comes from
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
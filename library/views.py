@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.views.generic import TemplateView
 from typing import Any
 from rest_framework.viewsets import GenericViewSet
@@ -8,10 +10,12 @@ from django.contrib.auth import authenticate, login
 from django.core.cache import cache
 import time
 from rest_framework.permissions import BasePermission
-from library.models import Library
 from rest_framework import serializers, status
 from django.contrib.auth import logout as django_logout
-from library.models import UserProfile, Library
+from library.models import UserProfile
+from library.metrics import record_cache_lookup, render_metrics
+from library.reference import libraries
+from library.timing import TimedSerializerMixin
 import pyotp
 import qrcode
 import io
@@ -23,12 +27,33 @@ class ShowLibraryView(TemplateView):
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
-        context['library'] = Library.objects.all()
+        context['library'] = libraries.all()
         return context
 
+def metrics_allowed(request):
+    # staff in the browser, or the Prometheus server by address
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    # Prometheus text format, summed over all worker processes
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def otp_good_for(user):
+    otp_good = cache.get(f'otp_good_{user.id}')
+    # a hit is a key that is there, whatever it says
+    record_cache_lookup('otp', otp_good is not None)
+    return bool(otp_good)
+
+
 class OTPRequired(BasePermission):
     def has_permission(self, request, view):
-        otp_good = cache.get(f'otp_good_{request.user.id}', False)
+        otp_good = otp_good_for(request.user)
         if not otp_good:
             return False
         otp_timestamp = cache.get(f'otp_timestamp_{request.user.id}', 0)
@@ -48,7 +73,7 @@ class UserProfileViewSet(GenericViewSet):
         key = serializers.CharField()
         username = serializers.CharField()
 
-    class UserProfileSerializer(serializers.ModelSerializer):
+    class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
         username = serializers.CharField(source='user.username', read_only=True)
         email = serializers.CharField(source='user.email', read_only=True)
         first_name = serializers.CharField(source='user.first_name', read_only=True)
@@ -157,8 +182,7 @@ class UserProfileViewSet(GenericViewSet):
 
     @action(detail=False, url_path='otp-status', permission_classes=[IsAuthenticated])
     def get_otp_status(self, request):
-        otp_good = cache.get(f'otp_good_{request.user.id}', False)
-        return Response({'otp_good': otp_good})
+        return Response({'otp_good': otp_good_for(request.user)})
 
     @action(detail=False, url_path='info', permission_classes=[IsAuthenticated])
     def get_user_info(self, request):